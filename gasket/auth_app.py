@@ -6,18 +6,27 @@ and sending it a SIGHUP.
 # pylint: disable=import-error
 
 import argparse
+import concurrent.futures
 import logging
 import queue
-import re
 import signal
 import sys
+import threading
+import time
 
 from gasket.auth_config import AuthConfig
 from gasket import rule_manager
 from gasket import auth_app_utils
+from gasket.auth_app_metrics import AuthAppMetrics
 from gasket.hostapd_conf import HostapdConf
+from gasket.mac_location import MacLocationIndex, FaucetEventThread, LearnedMacs
+from gasket.prefetch import LocationPrefetcher
+from gasket.rate_limiter import RateLimiter
+from gasket.retry_queue import RetryQueue
 from gasket import hostapd_socket_thread
-from gasket.work_item import AuthWorkItem, DeauthWorkItem
+from gasket import hostapd_async_thread
+from gasket.work_item import AuthWorkItem, DeauthWorkItem, PortDownWorkItem
+from gasket.work_queue import CoalescingWorkQueue
 
 
 class Proto(object):
@@ -35,9 +44,6 @@ class Proto(object):
     HTTP_PORT = 80
 
 
-LEARNED_MACS_REGEX = r"""learned_macs{dp_id="(0x[a-f0-9]+)",dp_name="([\w-]+)",n="(\d+)",port="(\d+)",vlan="(\d+)"}"""
-
-
 class AuthApp(object):
     '''
     This class recieves messages hostapd_ctrl from the portal via
@@ -51,6 +57,8 @@ class AuthApp(object):
     config = None
     rule_man = None
     logger = None
+    metrics = None
+    prom_client = None
     logname = 'auth_app'
 
     work_queue = None
@@ -60,9 +68,45 @@ class AuthApp(object):
         super(AuthApp, self).__init__()
         self.config = config
         self.logger = logger
-        self.rule_man = rule_manager.RuleManager(self.config, self.logger)
-        self.learned_macs_compiled_regex = re.compile(LEARNED_MACS_REGEX)
-        self.work_queue = queue.Queue()
+        self.metrics = AuthAppMetrics()
+        self.prom_client = auth_app_utils.PrometheusClient(self.config.prom_url,
+                                                           self.config.prom_connect_timeout,
+                                                           self.config.prom_read_timeout,
+                                                           self.config.prom_compression,
+                                                           cache_ttl=self.config.scrape_cache_ttl,
+                                                           metrics=self.metrics)
+        self.rule_man = rule_manager.RuleManager(self.config, self.logger, self.metrics,
+                                                 self.prom_client)
+        self.work_queue = CoalescingWorkQueue(self.metrics,
+                                              self.config.work_queue_revoke_weight,
+                                              self.config.work_queue_grant_weight,
+                                              self.config.work_queue_max_size,
+                                              self.config.work_queue_overload_policy)
+        # {(dp name, port): time the port went down}
+        self.port_downs = {}
+        self.mac_index = None
+        if self.config.faucet_event_sock:
+            self.mac_index = MacLocationIndex(self.config.dp_port_mode, self.metrics)
+        self.rate_limiter = None
+        if self.config.rate_limit_mac_rate is not None or self.config.rate_limit_hostapd_rate is not None:
+            self.rate_limiter = RateLimiter(self.config.rate_limit_mac_rate,
+                                            self.config.rate_limit_mac_burst,
+                                            self.config.rate_limit_hostapd_rate,
+                                            self.config.rate_limit_hostapd_burst,
+                                            self.metrics)
+        self.prefetcher = None
+        if self.config.prefetch_workers:
+            self.prefetcher = LocationPrefetcher(self._get_dp_names_and_ports, self.rule_man,
+                                                 self.config.prefetch_workers,
+                                                 self.config.prefetch_ttl,
+                                                 self.metrics)
+        self.retry_queue = None
+        if self.config.retry_deadline:
+            self.retry_queue = RetryQueue(self.work_queue, self.config.logger_location,
+                                          self.config.retry_initial_delay,
+                                          self.config.retry_max_delay,
+                                          self.config.retry_deadline,
+                                          self.metrics)
 
     def start(self):
         """Starts separate thread for each hostapd socket.
@@ -72,82 +116,256 @@ class AuthApp(object):
         """
         signal.signal(signal.SIGINT, self._handle_sigint)
 
+        if self.config.metrics_port:
+            self.logger.info('Starting metrics server on port %d', self.config.metrics_port)
+            self.metrics.start_server(self.config.metrics_port, self.config.metrics_ip)
+
+        if self.mac_index is not None:
+            fet = FaucetEventThread(self.config.faucet_event_sock, self.mac_index, self.prom_client,
+                                    self.config.logger_location)
+            self.logger.info('Starting faucet event thread %s', fet)
+            fet.start()
+            self.threads.append(fet)
+
+        if self.retry_queue is not None:
+            self.logger.info('Starting retry queue %s', self.retry_queue)
+            self.retry_queue.start()
+            self.threads.append(self.retry_queue)
+
         self.logger.info('Starting hostapd socket threads')
         print('Starting hostapd socket threads ...')
 
-        for hostapd_name, conf in self.config.hostapds.items():
-            hostapd_conf = HostapdConf(hostapd_name, conf)
-            hst = hostapd_socket_thread.HostapdSocketThread(hostapd_conf, self.work_queue,
-                                                            self.config.logger_location)
-            self.logger.info('Starting thread %s', hst)
+        hostapd_confs = [HostapdConf(hostapd_name, conf)
+                         for hostapd_name, conf in self.config.hostapds.items()]
+        if self.config.hostapd_client == 'asyncio':
+            hst = hostapd_async_thread.HostapdAsyncThread(hostapd_confs, self.work_queue,
+                                                          self.config.logger_location,
+                                                          self.rate_limiter,
+                                                          self.prefetcher)
+            self.logger.info('Starting thread %s for %d hostapds', hst, len(hostapd_confs))
             hst.start()
             self.threads.append(hst)
             self.logger.info('Thread running')
+        else:
+            for hostapd_conf in hostapd_confs:
+                hst = hostapd_socket_thread.HostapdSocketThread(hostapd_conf, self.work_queue,
+                                                                self.config.logger_location,
+                                                                self.rate_limiter,
+                                                                self.prefetcher)
+                self.logger.info('Starting thread %s', hst)
+                hst.start()
+                self.threads.append(hst)
+                self.logger.info('Thread running')
 
         print('Started socket Threads.')
+        if self.config.pipeline_workers:
+            self._run_pipeline()
         self.logger.info('Starting worker thread.')
         while True:
-            work_item = self.work_queue.get()
+            batch = self._get_work_batch()
+            self.logger.info('Got %d work items from queue', len(batch))
+            self._process_batch(batch)
+
+    def _run_pipeline(self):
+        """Runs the worker as a pipeline: a feeder thread takes the batches off the work queue
+        and has a pool of 'pipeline: workers' threads prepare them (see _prepare_batch()),
+        while this thread commits the batches in order.
+        So the next batch is prepared while faucet reloads the previous one.
+        """
+        self.logger.info('Starting worker pipeline with %d workers.', self.config.pipeline_workers)
+        executor = concurrent.futures.ThreadPoolExecutor(self.config.pipeline_workers)
+        prepared = queue.Queue()
+        # the next batch is only taken once the previous one is being committed, so at most one
+        # batch is taken ahead and the rest are left on the work queue (to be coalesced, and for
+        # revocations to go ahead of).
+        may_take = threading.Semaphore(1)
+
+        def feed():
+            while True:
+                may_take.acquire()
+                batch = self._get_work_batch()
+                self.logger.info('Got %d work items from queue', len(batch))
+                prepared.put(executor.submit(self._prepare_batch, batch))
+
+        feeder = threading.Thread(target=feed, name='pipeline-feeder', daemon=True)
+        feeder.start()
+        while True:
+            batch = prepared.get()
+            may_take.release()
+            self._process_batch(batch.result())
+
+    def _prepare_batch(self, batch):
+        """Finds where the MACs of the batch's AuthWorkItems are (all at once) and generates their rules,
+        ahead of them being committed (unless that was done by the prefetcher). Run by the pipeline workers.
+        Returns:
+            batch. Items that could not be prepared are left unchanged (and are done when committed).
+        """
+        auth_items = [work_item for work_item in batch
+                      if isinstance(work_item, AuthWorkItem) and work_item.location is None]
+        if not auth_items:
+            return batch
+        try:
+            locations = self._get_dp_names_and_ports([work_item.mac for work_item in auth_items])
+            for work_item in auth_items:
+                location = locations.get(work_item.mac)
+                if location is None:
+                    # the mac has not been learned yet, it is looked up again when committed.
+                    continue
+                work_item.rules = self.rule_man.get_rules(work_item.username, work_item.mac,
+                                                          location[0], location[1], work_item.acllist)
+                work_item.location = location
+        except Exception as e:
+            self.logger.exception(e)
+        return batch
+
+    def _get_work_batch(self):
+        """Blocks until there is work on the queue, then keeps taking work until either
+        'batch: max_items' have been taken or 'batch: window' seconds have passed.
+        Items that are already waiting on the queue when the window closes are also taken
+        (up to max_items).
+        Returns:
+            list of WorkItem.
+        """
+        batch = [self.work_queue.get()]
+        deadline = time.time() + self.config.batch_window
+        while len(batch) < self.config.batch_max_items:
+            timeout = deadline - time.time()
+            try:
+                if timeout > 0:
+                    batch.append(self.work_queue.get(timeout=timeout))
+                else:
+                    batch.append(self.work_queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
 
-            self.logger.info('Got work from queue')
+    def _process_batch(self, batch):
+        """Applies all the work items in batch to the acl config,
+        then commits them with a single faucet reload.
+        Args:
+            batch (list of WorkItem): work to do.
+        """
+        start = time.time()
+        # find the macs that have not already been found (by the pipeline or prefetcher) all at once.
+        macs = [work_item.mac for work_item in batch
+                if isinstance(work_item, AuthWorkItem) and work_item.location is None]
+        locations = self._get_dp_names_and_ports(macs) if macs else {}
+        # EAP success times of the authentications committed.
+        successes = []
+        for work_item in batch:
             if isinstance(work_item, AuthWorkItem):
-                self.authenticate(work_item.mac, work_item.username, work_item.acllist)
+                location = work_item.location or locations.get(work_item.mac, ('', -1))
+                if self.retry_queue is not None:
+                    if work_item.attempts and not self.retry_queue.current(work_item):
+                        # cancelled (by a deauth or a newer auth) since it was put back on the queue.
+                        continue
+                    if location == ('', -1):
+                        if self.retry_queue.schedule(work_item):
+                            self.logger.info('mac %s not learned yet, retrying authentication of %s',
+                                             work_item.mac, work_item.username)
+                            continue
+                    else:
+                        self.retry_queue.cancel(work_item.mac)
+                self.authenticate(work_item.mac, work_item.username, work_item.acllist, commit=False,
+                                  queued=work_item.created, location=location,
+                                  rules=work_item.rules)
+                if work_item.success is not None and not work_item.attempts:
+                    # retried authentications are counted by the retry metrics instead.
+                    successes.append(work_item.success)
             elif isinstance(work_item, DeauthWorkItem):
-                self.deauthenticate(work_item.mac)
+                if self.retry_queue is not None:
+                    self.retry_queue.cancel(work_item.mac)
+                self.deauthenticate(work_item.mac, commit=False)
+            elif isinstance(work_item, PortDownWorkItem):
+                self.reset_port(work_item.dp_name, work_item.port, commit=False)
             else:
                 self.logger.warn("Unsupported WorkItem type: %s", type(work_item))
+        success = self.rule_man.commit()
+        end = time.time()
+        if self.rule_man.rolled_back:
+            self.logger.error('faucet rejected the config for batch: %s',
+                              ', '.join('%s %s' % (type(work_item).__name__,
+                                                   work_item.mac or (work_item.dp_name, work_item.port))
+                                        for work_item in batch))
+
+        oldest = min(work_item.queued for work_item in batch)
+        self.metrics.batch_size.observe(len(batch))
+        self.metrics.batch_latency.observe(end - start)
+        self.metrics.batch_queue_latency.observe(end - oldest)
+        for success_time in successes:
+            self.metrics.auth_success_to_reload.observe(end - success_time)
+        self.logger.info('batch of %d work items committed (success: %s) in %.3f seconds. oldest item queued for %.3f seconds',
+                         len(batch), success, end - start, end - oldest)
 
     def _get_dp_name_and_port(self, mac):
-        """Queries the prometheus faucet client,
-         and returns the 'access port' that the mac address is connected on.
+        """Finds the 'access port' that the mac address is connected on.
         Args:
              mac MAC address to find port for.
         Returns:
-             dp name & port number.
+             dp name & port number. '' & -1 if not found.
+        """
+        dp_name, port = self._get_dp_names_and_ports([mac]).get(mac, ('', -1))
+        self.logger.info("name: %s port: %d", dp_name, port)
+        return dp_name, port
+
+    def _get_dp_names_and_ports(self, macs):
+        """Looks up the macs in the mac index (if it is live), and finds the rest
+        in a (cached) scrape of faucet's learned_macs, all at once.
+        Args:
+            macs (list of str): MAC addresses to find.
+        Returns:
+            {mac: (dp name, port)} of the 'access port' each mac is connected on, for those found.
         """
+        found = {}
+        if self.mac_index is not None and self.mac_index.live:
+            for mac in macs:
+                location = self.mac_index.lookup(mac)
+                if location is not None:
+                    found[mac] = location
+            # any not found, their events may not have arrived yet.
+            macs = [mac for mac in macs if mac not in found]
+        if not macs:
+            return found
         # query faucets promethues.
-        self.logger.info('querying prometheus')
+        self.logger.info('querying prometheus for %d macs', len(macs))
         try:
-            prom_mac_table, prom_name_dpid = auth_app_utils.scrape_prometheus_vars(self.config.prom_url,
-                                                                                   ['learned_macs', 'faucet_config_dp_name'])
+            learned_macs, age = self.prom_client.cached_derived(
+                'learned_macs', ['learned_macs'], self._index_learned_macs)
+            found.update(learned_macs.find_access_ports(macs, self.config.dp_port_mode))
+            macs = [mac for mac in macs if mac not in found]
+            if macs and age > 0:
+                # the macs may have been learned since the cached scrape.
+                self.logger.info('%d macs not in cached scrape (%.3f seconds old), scraping again',
+                                 len(macs), age)
+                learned_macs, _ = self.prom_client.cached_derived(
+                    'learned_macs', ['learned_macs'], self._index_learned_macs, max_age=0)
+                found.update(learned_macs.find_access_ports(macs, self.config.dp_port_mode))
         except Exception as e:
             self.logger.exception(e)
-            return '', -1
-        self.logger.info('queried prometheus. mac_table:\n%s\n\nname_dpid:\n%s',
-                         prom_mac_table, prom_name_dpid)
-        ret_port = -1
-        ret_dp_name = ""
-        dp_port_mode = self.config.dp_port_mode
-        for line in prom_mac_table:
-            labels, float_as_mac = line.split(' ')
-            macstr = auth_app_utils.float_to_mac(float_as_mac)
-            self.logger.debug('float %s is mac %s', float_as_mac, macstr)
-            if mac == macstr:
-                # if this is also an access port, we have found the dpid and the port
-                values = self.learned_macs_compiled_regex.match(labels)
-                dpid, dp_name, n, port, vlan = values.groups()
-                if dp_name in dp_port_mode and \
-                        'interfaces' in dp_port_mode[dp_name] and \
-                        int(port) in dp_port_mode[dp_name]['interfaces'] and \
-                        'auth_mode' in dp_port_mode[dp_name]['interfaces'][int(port)] and \
-                        dp_port_mode[dp_name]['interfaces'][int(port)]['auth_mode'] == 'access':
-                    ret_port = int(port)
-                    ret_dp_name = dp_name
-                    break
-        self.logger.info("name: %s port: %d", ret_dp_name, ret_port)
-        return ret_dp_name, ret_port
-
-    def authenticate(self, mac, user, acl_list):
+        return found
+
+    @staticmethod
+    def _index_learned_macs(families):
+        return LearnedMacs(families['learned_macs'])
+
+    def authenticate(self, mac, user, acl_list, commit=True, queued=None, location=None, rules=None):
         """Authenticates the user as specifed by adding ACL rules
         to the Faucet configuration file. Once added Faucet is signaled via SIGHUP.
         Args:
             mac (str): MAC Address.
             user (str): Username.
             acl_list (list of str): names of acls (in order of highest priority to lowest) to be applied.
+            commit (bool): False to leave the change staged for a later RuleManager.commit().
+            queued (float): optional. time the authentication was queued. It is dropped if
+                            the port it is on has gone down since.
+            location (tuple): optional. (dp name, port) of mac if it has already been found.
+            rules (dict): optional. the rules for the user if they have already been generated.
         """
         self.logger.info("****authenticated: %s %s", mac, user)
 
-        switchname, switchport = self._get_dp_name_and_port(mac)
+        if location is None:
+            location = self._get_dp_name_and_port(mac)
+        switchname, switchport = location
 
         if switchname == '' or switchport == -1:
             self.logger.warn(
@@ -160,7 +378,14 @@ class AuthApp(object):
 
         self.logger.info('found mac')
 
-        success = self.rule_man.authenticate(user, mac, switchname, switchport, acl_list)
+        if queued is not None and self.port_downs.get((switchname, switchport), 0) > queued:
+            # the port down was served first (it has priority), so do not undo it.
+            self.logger.warn('port %s %d went down after %s %s authenticated on it. not authenticating',
+                             switchname, switchport, user, mac)
+            return
+
+        success = self.rule_man.authenticate(user, mac, switchname, switchport, acl_list, commit=commit,
+                                             rules=rules)
 
         # TODO probably shouldn't return success if the switch/port cannot be found.
         # but at this stage auth server (hostapd) can't do anything about it.
@@ -173,16 +398,17 @@ class AuthApp(object):
 #            self.hapd_req.deauthenticate(mac)
 #            self.hapd_req.disassociate(mac)
 
-    def deauthenticate(self, mac, username=None):
+    def deauthenticate(self, mac, username=None, commit=True):
         """Deauthenticates the mac and username by removing related acl rules
         from Faucet's config file.
         Args:
             mac (str): mac address string to deauth
             username (str): username to deauth.
+            commit (bool): False to leave the change staged for a later RuleManager.commit().
         """
         self.logger.info('---deauthenticated: %s %s', mac, username)
 
-        self.rule_man.deauthenticate(username, mac)
+        self.rule_man.deauthenticate(username, mac, commit=commit)
         # TODO possibly handle success somehow. However the client wpa_supplicant, etc,
         # will likley think it has logged off, so is there anything we can do from hostapd to
         # say they have not actually logged off.
@@ -202,13 +428,12 @@ class AuthApp(object):
         # if the dp is there, then use the port.
         #    if the port is there and it is set to 'access' return true
         # otherwise return false.
-        dp_names = auth_app_utils.scrape_prometheus_vars(self.config.prom_url, ['dp_status'])[0]
+        dp_id = '0x{:x}'.format(dpid)
         dp_name = ''
-        for l in dp_names:
-            pattern = r'dp_id="0x{:x}",dp_name="([\w-]+)"}}'.format(dpid)
-            match = re.search(pattern, l)
-            if match:
-                dp_name = match.group(1)
+        dp_status, _ = self.prom_client.cached_families(['dp_status'])
+        for _, labels, _ in dp_status['dp_status']:
+            if labels.get('dp_id') == dp_id:
+                dp_name = labels.get('dp_name', '')
                 break
 
         if dp_name in self.config.dp_port_mode:
@@ -219,8 +444,22 @@ class AuthApp(object):
                         return dp_name
         return None
 
+    def reset_port(self, dp_name, port, commit=True):
+        """Deauthenticates everything on the port.
+        Args:
+            dp_name (str): datapath name.
+            port (int): port number.
+            commit (bool): False to leave the change staged for a later RuleManager.commit().
+        """
+        removed_macs = self.rule_man.reset_port_acl(dp_name, port, commit=commit)
+        self.logger.info('removed macs: %s', removed_macs)
+        for mac in removed_macs:
+            self.logger.info('sending deauth for %s', mac)
+#            self.hapd_req.deauthenticate(mac)
+        self.logger.debug('reset port completed')
+
     def port_status_handler(self, ryu_event):
-        """Deauthenticates all hosts on a port if the port has gone down.
+        """Queues the deauthentication of all hosts on a port if the port has gone down.
         """
         msg = ryu_event.msg
         ryu_dp = msg.datapath
@@ -233,13 +472,9 @@ class AuthApp(object):
             dp_name = self.is_port_managed(dpid, port)
             self.logger.debug('dp_name: %s', dp_name)
             if dp_name:
-                removed_macs = self.rule_man.reset_port_acl(dp_name, port)
-                self.logger.info('removed macs: %s', removed_macs)
-                for mac in removed_macs:
-                    self.logger.info('sending deauth for %s', mac)
-#                    self.hapd_req.deauthenticate(mac)
-
-                self.logger.debug('reset port completed')
+                work_item = PortDownWorkItem(dp_name, port)
+                self.port_downs[(dp_name, port)] = work_item.created
+                self.work_queue.put(work_item)
 
     def _handle_sigint(self, sigid, frame):
         """Handles the SIGINT signal.
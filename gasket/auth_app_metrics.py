@@ -0,0 +1,134 @@
+"""Prometheus metrics for the authentication app.
+These are Gasket's own metrics (as opposed to the Faucet ones that are scraped),
+and are optionally exported over HTTP if 'metrics' is configured in auth.yaml.
+"""
+# pytype: disable=pyi-error
+from prometheus_client import CollectorRegistry, Counter, Gauge, Histogram, start_http_server
+
+
+class AuthAppMetrics(object):
+    """Container for the Prometheus metrics of the authentication app.
+    """
+
+    registry = None
+
+    def __init__(self, registry=None):
+        if registry is None:
+            registry = CollectorRegistry()
+        self.registry = registry
+
+        self.batch_size = self._histogram(
+            'gasket_batch_size',
+            'number of work items committed in a single faucet reload',
+            buckets=(1, 2, 5, 10, 20, 50, 100, 200, 500))
+        self.batch_latency = self._histogram(
+            'gasket_batch_latency_seconds',
+            'time taken to apply and commit a batch of work items')
+        self.batch_queue_latency = self._histogram(
+            'gasket_batch_queue_latency_seconds',
+            'time from the oldest work item in a batch being queued until it was committed')
+        self.work_items_superseded = self._counter(
+            'gasket_work_items_superseded',
+            'number of queued work items dropped because a later item for the same mac replaced them',
+            ['type'])
+        self.work_queue_wait = self._histogram(
+            'gasket_work_queue_wait_seconds',
+            'time a work item waited in its lane (revoke or grant) of the work queue',
+            ['lane'])
+        self.work_queue_depth = self._gauge(
+            'gasket_work_queue_depth',
+            'number of work items queued in each lane (revoke or grant) of the work queue',
+            ['lane'])
+        self.work_items_shed = self._counter(
+            'gasket_work_items_shed',
+            'number of work items dropped or rejected because the work queue was full',
+            ['type'])
+        self.rate_limited = self._counter(
+            'gasket_rate_limited',
+            'number of authentication events dropped for exceeding the mac or hostapd rate limit',
+            ['scope', 'hostapd'])
+        self.auth_retries = self._counter(
+            'gasket_auth_retries',
+            'number of authentications retried because the mac had not been learned')
+        self.auth_retries_expired = self._counter(
+            'gasket_auth_retries_expired',
+            'number of authentications given up on because the mac was not learned before the retry deadline')
+        self.auth_retries_pending = self._gauge(
+            'gasket_auth_retries_pending',
+            'number of authentications waiting to be retried')
+        self.location_prefetches = self._counter(
+            'gasket_location_prefetches',
+            'number of authentications whose location was prefetched when their EAP started (hit) or not (miss)',
+            ['result'])
+        self.auth_success_to_reload = self._histogram(
+            'gasket_auth_success_to_reload_seconds',
+            'time from hostapd reporting an EAP success until the authentication was committed')
+        self.mac_index_size = self._gauge(
+            'gasket_mac_index_size',
+            'number of macs in the index of macs learned on access ports')
+        self.mac_index_live = self._gauge(
+            'gasket_mac_index_live',
+            '1 if the mac index is following faucet\'s event socket (and is used for lookups)')
+        self.mac_index_age = self._gauge(
+            'gasket_mac_index_age_seconds',
+            'seconds since the mac index was last updated by a faucet event or resync')
+        self.mac_index_lookups = self._counter(
+            'gasket_mac_index_lookups',
+            'number of mac location lookups answered (hit) or not (miss) by the mac index',
+            ['result'])
+        self.faucet_reload_latency = self._histogram(
+            'gasket_faucet_reload_latency_seconds',
+            'time from signaling faucet until it was seen to have reloaded')
+        self.faucet_reload_errors = self._counter(
+            'gasket_faucet_reload_errors',
+            'number of reloads where faucet failed to load the config')
+        self.faucet_reload_scrapes = self._counter(
+            'gasket_faucet_reload_scrapes',
+            'number of times faucet has been scraped to check if it has reloaded')
+        self.scrape_cache_hits = self._counter(
+            'gasket_scrape_cache_hits',
+            'number of lookups answered from the cached faucet scrape')
+        self.scrape_cache_misses = self._counter(
+            'gasket_scrape_cache_misses',
+            'number of lookups that scraped faucet (or waited on a scrape in progress)')
+        self.scrape_cache_age = self._histogram(
+            'gasket_scrape_cache_age_seconds',
+            'age of the faucet scrape used for a lookup',
+            buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 1, 2, 5, 10))
+        self.commits_skipped = self._counter(
+            'gasket_commits_skipped',
+            'number of commits where the faucet acls were unchanged, so faucet was not reloaded')
+        self.config_generation = self._gauge(
+            'gasket_config_generation',
+            'number of the last config generation faucet loaded')
+        self.config_rollbacks = self._counter(
+            'gasket_config_rollbacks',
+            'number of times faucet rejected a config and it was rolled back')
+        self.config_rollback_latency = self._histogram(
+            'gasket_config_rollback_latency_seconds',
+            'time taken to roll back to the last good config and have faucet reload it')
+
+    def _counter(self, name, doc, labels=None):
+        if labels is None:
+            labels = []
+        return Counter(name, doc, labels, registry=self.registry)
+
+    def _gauge(self, name, doc, labels=None):
+        if labels is None:
+            labels = []
+        return Gauge(name, doc, labels, registry=self.registry)
+
+    def _histogram(self, name, doc, labels=None, buckets=None):
+        if labels is None:
+            labels = []
+        if buckets is None:
+            return Histogram(name, doc, labels, registry=self.registry)
+        return Histogram(name, doc, labels, buckets=buckets, registry=self.registry)
+
+    def start_server(self, port, addr=''):
+        """Starts the HTTP server that exports the metrics (in a daemon thread).
+        Args:
+            port (int): port to listen on.
+            addr (str): address to listen on.
+        """
+        start_http_server(port, addr, registry=self.registry)
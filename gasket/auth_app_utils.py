@@ -4,7 +4,11 @@
 import logging
 from logging.handlers import WatchedFileHandler
 import re
+import threading
+import time
+
 import requests
+from requests.adapters import HTTPAdapter
 
 def get_logger(logname, logfile, loglevel, propagate):
     """Create and return a logger object."""
@@ -91,25 +95,253 @@ def get_hashable_list(list_):
         hash_list.append(HashableDict(item))
     return hash_list
 
-def scrape_prometheus(prom_url):
-    """Query prometheus specified by config. Removes comment lines.
-    Returns:
-        string containing all prometheus variables without comments.
+
+# bytes read from a scrape response at a time.
+CHUNK_SIZE = 64 * 1024
+
+# suffixes of the samples that belong to a metric family. e.g. faucet_config_reload_requests_total
+FAMILY_SUFFIXES = ('_total', '_created', '_bucket', '_count', '_sum')
+
+LABEL_REGEX = re.compile(r'([a-zA-Z_][a-zA-Z0-9_]*)="((?:[^"\\]|\\.)*)"')
+
+
+def _unescape_label_value(value):
+    if '\\' not in value:
+        return value
+    return value.replace('\\\\', '\0').replace('\\"', '"').replace('\\n', '\n').replace('\0', '\\')
+
+
+def _sample_family(name, families):
+    """Returns the family in families that the sample name belongs to, or None."""
+    if name in families:
+        return name
+    for suffix in FAMILY_SUFFIXES:
+        if name.endswith(suffix) and name[:-len(suffix)] in families:
+            return name[:-len(suffix)]
+    return None
+
+
+def parse_prometheus(lines, families=None):
+    """Parses lines of the prometheus text exposition format in a single pass.
+    Args:
+        lines (iterable of str): lines of prometheus text. May be a stream.
+        families (list of str): metric families to keep, None for all.
+            If given, stops reading lines once every family has been seen,
+            as the samples of a family are always grouped together.
+    Yields:
+        (family, name, labels, value) for each sample. Where labels is a dict, and value a float.
+    """
+    if families is not None:
+        families = frozenset(families)
+    seen = set()
+    current = None
+    for line in lines:
+        if not line or line[0] == '#':
+            continue
+        brace = line.find('{')
+        space = line.find(' ')
+        has_labels = brace != -1 and (space == -1 or brace < space)
+        if has_labels:
+            name = line[:brace]
+        else:
+            name = line[:space]
+
+        if families is None:
+            family = name
+        else:
+            family = _sample_family(name, families)
+            if family is None:
+                if current is not None and len(seen) == len(families):
+                    # have passed the last wanted family.
+                    return
+                current = None
+                continue
+        current = family
+        seen.add(family)
+
+        if has_labels:
+            end = line.rfind('}')
+            labels = {k: _unescape_label_value(v)
+                      for k, v in LABEL_REGEX.findall(line, brace + 1, end)}
+            value = line[end + 1:].split()[0]
+        else:
+            labels = {}
+            value = line[space + 1:].split()[0]
+        yield family, name, labels, float(value)
+
+
+class _Scrape(object):
+    """A scrape for the cache that is in progress (or done)."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.samples = None
+        self.error = None
+        self.started = time.time()
+        # {name: value} computed from the samples by PrometheusClient.cached_derived().
+        self.derived = {}
+        self.derived_lock = threading.Lock()
+
+
+class PrometheusClient(object):
+    """Scrapes a prometheus client (Faucet) over a persistent (keep-alive) HTTP session,
+    so that a new connection is not made for every scrape.
+
+    cached_families() shares a scrape between callers: the last scrape is kept for cache_ttl seconds,
+    and callers that miss while a scrape is already in progress wait for that one rather than
+    starting another.
     """
-    prom_vars = []
-    for prom_line in requests.get(prom_url).text.split('\n'):
-        if not prom_line.startswith('#'):
-            prom_vars.append(prom_line)
-    return '\n'.join(prom_vars)
-
-def scrape_prometheus_vars(prom_url, variables):
-    prom_txt = scrape_prometheus(prom_url)
-
-    ret = []
-    for v in variables:
-        matches = []
-        for line in prom_txt.splitlines():
-            if line.startswith(v):
-                matches.append(line)
-        ret.append(matches)
-    return ret
+
+    prom_url = None
+    session = None
+    timeout = None
+    cache_ttl = 0
+    metrics = None
+    cache_hits = 0
+    cache_misses = 0
+
+    def __init__(self, prom_url, connect_timeout=1, read_timeout=5, compress=False, pool_size=4,
+                 cache_ttl=0, metrics=None):
+        """
+        Args:
+            prom_url (str): url of the prometheus client.
+            connect_timeout (float): seconds to wait for the connection to be made.
+            read_timeout (float): seconds to wait between bytes received.
+            compress (bool): True to ask for the response to be gzip compressed.
+            pool_size (int): max number of connections kept open to prom_url.
+            cache_ttl (float): seconds a scrape is used for by cached_families().
+            metrics (AuthAppMetrics): optional. for the cache hits, misses and age.
+        """
+        self.cache_ttl = cache_ttl
+        self.metrics = metrics
+        self._cache_lock = threading.Lock()
+        self._cached = None
+        self._in_flight = None
+        self.prom_url = prom_url
+        self.timeout = (connect_timeout, read_timeout)
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        if not compress:
+            self.session.headers['Accept-Encoding'] = 'identity'
+
+    def samples(self, families=None):
+        """Streams the response, and parses the samples of the metric families.
+        Args:
+            families (list of str): metric families to keep, None for all.
+        Yields:
+            (family, name, labels, value) for each sample.
+        """
+        resp = self.session.get(self.prom_url, timeout=self.timeout, stream=True)
+        try:
+            resp.raise_for_status()
+            if resp.encoding is None:
+                resp.encoding = 'utf-8'
+            for sample in parse_prometheus(resp.iter_lines(CHUNK_SIZE, decode_unicode=True), families):
+                yield sample
+            # parsing may stop before the end of the body (once the families have been seen).
+            # the rest is read so the connection can be put back in the pool rather than closed.
+            while resp.raw.read(CHUNK_SIZE):
+                pass
+        finally:
+            resp.close()
+
+    def cached_families(self, families, max_age=None):
+        """Gets the families from the cached scrape if it is no older than max_age,
+        otherwise scrapes (or waits for the scrape that is already in progress).
+        Args:
+            families (list of str): metric families to get.
+            max_age (float): seconds old the scrape may be. Defaults to cache_ttl.
+        Returns:
+            tuple of (dict of family name to list of (name, labels, value)
+                      for each sample in that family, age of the scrape in seconds).
+        """
+        scrape, age = self._cached_scrape(max_age)
+        return self._families(scrape, families), age
+
+    def cached_derived(self, name, families, derive, max_age=None):
+        """Like cached_families(), but returns derive(families), which is only computed once
+        for each scrape and shared by every caller that uses the scrape (e.g. an index of the samples).
+        Args:
+            name (str): name the derived value is kept under.
+            families (list of str): metric families to derive from.
+            derive (function): called with the dict of family name to samples.
+            max_age (float): seconds old the scrape may be. Defaults to cache_ttl.
+        Returns:
+            tuple of (derive's return value, age of the scrape in seconds).
+        """
+        scrape, age = self._cached_scrape(max_age)
+        with scrape.derived_lock:
+            if name not in scrape.derived:
+                scrape.derived[name] = derive(self._families(scrape, families))
+            return scrape.derived[name], age
+
+    def _cached_scrape(self, max_age):
+        """Returns:
+            tuple of (_Scrape no older than max_age, age of the scrape in seconds).
+        """
+        if max_age is None:
+            max_age = self.cache_ttl
+        with self._cache_lock:
+            scrape = self._cached
+            hit = scrape is not None and time.time() - scrape.started <= max_age
+            if hit:
+                self.cache_hits += 1
+            else:
+                self.cache_misses += 1
+                scrape = self._in_flight
+                leader = scrape is None
+                if leader:
+                    scrape = self._in_flight = _Scrape()
+
+        if not hit:
+            if leader:
+                self._scrape_for_cache(scrape)
+            else:
+                scrape.done.wait()
+            if scrape.error is not None:
+                raise scrape.error
+
+        age = time.time() - scrape.started
+        if self.metrics:
+            (self.metrics.scrape_cache_hits if hit else self.metrics.scrape_cache_misses).inc()
+            self.metrics.scrape_cache_age.observe(age)
+        return scrape, age
+
+    @staticmethod
+    def _families(scrape, families):
+        ret = {family: [] for family in families}
+        for name, samples in scrape.samples.items():
+            family = _sample_family(name, ret)
+            if family is not None:
+                ret[family].extend(samples)
+        return ret
+
+    def _scrape_for_cache(self, scrape):
+        try:
+            samples = {}
+            for _, name, labels, value in self.samples():
+                samples.setdefault(name, []).append((name, labels, value))
+            scrape.samples = samples
+        except Exception as e:
+            scrape.error = e
+        with self._cache_lock:
+            # if invalidated while scraping the result may be from before the invalidation.
+            if self._in_flight is scrape:
+                self._in_flight = None
+                if scrape.error is None:
+                    self._cached = scrape
+        scrape.done.set()
+
+    def invalidate(self):
+        """Drops the cached scrape, e.g. after faucet has been signaled to reload.
+        A scrape already in progress will not be cached.
+        """
+        with self._cache_lock:
+            self._cached = None
+            self._in_flight = None
+
+    def close(self):
+        """Closes the connections."""
+        self.session.close()
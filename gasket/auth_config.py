@@ -1,6 +1,6 @@
 """Configuration parser for authentication controller app."""
-# pytype: disable=pyi-error
-import yaml
+from gasket import serialization
+from gasket.work_queue import OVERLOAD_POLICIES
 
 
 class AuthConfig(object):
@@ -8,7 +8,7 @@ class AuthConfig(object):
     """
 
     def __init__(self, filename):
-        data = yaml.load(open(filename, 'r'))
+        data = serialization.load_file(filename)
 
         self.version = data['version']
         self.logger_location = data['logger_location']
@@ -16,10 +16,23 @@ class AuthConfig(object):
         self.prom_port = data['faucet']['prometheus_port']
         self.faucet_ip = data['faucet']['ip']
         self.prom_url = 'http://{}:{}'.format(self.faucet_ip, self.prom_port)
+        self.reload_timeout = data['faucet'].get('reload_timeout', 20)
+        self.reload_poll_min = data['faucet'].get('reload_poll_min', 0.01)
+        self.reload_poll_max = data['faucet'].get('reload_poll_max', 0.5)
+        self.prom_connect_timeout = data['faucet'].get('connect_timeout', 1)
+        self.prom_read_timeout = data['faucet'].get('read_timeout', 5)
+        self.prom_compression = data['faucet'].get('compression', False)
+        self.scrape_cache_ttl = data['faucet'].get('scrape_cache_ttl', 0)
+        self.faucet_event_sock = data['faucet'].get('event_sock', None)
 
         self.contr_pid_file = data["files"]["controller_pid"]
         self.faucet_config_file = data["files"]["faucet_config"]
         self.acl_config_file = data['files']['acl_config']
+        self.acl_config_dir = data['files'].get('acl_config_dir', None)
+        # format the faucet acl file(s) are written in. 'yaml' or 'json' (faster, and also valid yaml).
+        self.acl_format = data['files'].get('acl_format', 'yaml')
+        assert self.acl_format in serialization.FORMATS, \
+            'acl_format must be one of %s, was: %s' % (serialization.FORMATS, self.acl_format)
 
         self.base_filename = data['files']['base_config']
 
@@ -30,3 +43,56 @@ class AuthConfig(object):
         self.rules = data["auth-rules"]["file"]
 
         self.hostapds = data["hostapds"]
+        # 'threads' (a thread per hostapd) or 'asyncio' (all hostapds served by one event loop).
+        self.hostapd_client = data.get('hostapd_client', 'threads')
+        assert self.hostapd_client in ('threads', 'asyncio'), \
+            'hostapd_client must be threads or asyncio, was: %s' % self.hostapd_client
+
+        metrics = data.get('metrics', {})
+        self.metrics_port = metrics.get('prometheus_port', None)
+        self.metrics_ip = metrics.get('ip', '')
+
+        backups = data.get('backups', {})
+        self.backup_max_count = backups.get('max_count', 100)
+        self.backup_max_age = backups.get('max_age', None)
+        self.backup_compress = backups.get('compress', False)
+
+        journal = data.get('session_journal', {})
+        self.journal_file = journal.get('file', None)
+        self.journal_compact_after = journal.get('compact_after', 10000)
+        self.journal_fsync = journal.get('fsync', False)
+
+        work_queue = data.get('work_queue', {})
+        self.work_queue_revoke_weight = work_queue.get('revoke_weight', 4)
+        self.work_queue_grant_weight = work_queue.get('grant_weight', 1)
+        assert self.work_queue_revoke_weight > 0 and self.work_queue_grant_weight > 0, \
+            'work_queue weights must be positive'
+        self.work_queue_max_size = work_queue.get('max_size', None)
+        self.work_queue_overload_policy = work_queue.get('overload_policy', 'drop_oldest')
+        assert self.work_queue_overload_policy in OVERLOAD_POLICIES, \
+            'work_queue overload_policy must be one of %s, was: %s' % (
+                OVERLOAD_POLICIES, self.work_queue_overload_policy)
+
+        rate_limit = data.get('rate_limit', {})
+        mac_limit = rate_limit.get('mac', {})
+        self.rate_limit_mac_rate = mac_limit.get('rate', None)
+        self.rate_limit_mac_burst = mac_limit.get('burst', None)
+        hostapd_limit = rate_limit.get('hostapd', {})
+        self.rate_limit_hostapd_rate = hostapd_limit.get('rate', None)
+        self.rate_limit_hostapd_burst = hostapd_limit.get('burst', None)
+
+        retry = data.get('retry', {})
+        self.retry_initial_delay = retry.get('initial_delay', 0.5)
+        self.retry_max_delay = retry.get('max_delay', 8)
+        self.retry_deadline = retry.get('deadline', 60)
+
+        prefetch = data.get('prefetch', {})
+        self.prefetch_workers = prefetch.get('workers', 0)
+        self.prefetch_ttl = prefetch.get('ttl', 30)
+
+        pipeline = data.get('pipeline', {})
+        self.pipeline_workers = pipeline.get('workers', 0)
+
+        batch = data.get('batch', {})
+        self.batch_max_items = batch.get('max_items', 1)
+        self.batch_window = batch.get('window', 0)
@@ -0,0 +1,106 @@
+"""Keeps numbered backups ('.bakN') of the config files Gasket rewrites,
+within a retention policy of a maximum count and/or age, optionally gzip compressed.
+"""
+import collections
+import gzip
+import os
+import re
+import shutil
+import time
+
+
+class BackupManager(object):
+    """Backs up files to filename.bakN (or filename.bakN.gz), N increasing for each backup.
+    The existing backups of a file are found once (on its first backup),
+    from then on the generations are tracked in memory so a backup does not list the directory.
+    """
+
+    logger = None
+    max_count = None
+    max_age = None
+    compress = False
+
+    def __init__(self, logger, max_count=None, max_age=None, compress=False):
+        """
+        Args:
+            max_count (int): number of backups to keep of each file. None for no limit.
+            max_age (float): seconds to keep backups for. None for no limit.
+            compress (bool): True to gzip the backups.
+        """
+        self.logger = logger
+        self.max_count = max_count
+        self.max_age = max_age
+        self.compress = compress
+        # {filename: deque of (generation, backup path, time)} oldest first.
+        self.generations = {}
+
+    def _scan(self, filename):
+        """Finds the existing backups of filename.
+        Returns:
+            deque of (generation, backup path, mtime) oldest first.
+        """
+        directory = os.path.dirname(filename) or '.'
+        pattern = re.compile(re.escape(os.path.basename(filename)) + r'\.bak(\d+)(\.gz)?$')
+        found = []
+        for name in os.listdir(directory):
+            match = pattern.match(name)
+            if match:
+                path = os.path.join(directory, name)
+                mtime = os.path.getmtime(path) if self.max_age is not None else 0
+                found.append((int(match.group(1)), path, mtime))
+        found.sort()
+        return collections.deque(found)
+
+    def backup(self, filename):
+        """Backs up filename (if it exists), and removes the backups outside the retention policy.
+        Args:
+            filename (str)
+        Returns:
+            path of the backup, or None if filename does not exist.
+        """
+        if not os.path.exists(filename):
+            return None
+        generations = self.generations.get(filename)
+        if generations is None:
+            generations = self.generations[filename] = self._scan(filename)
+        generation = generations[-1][0] + 1 if generations else 1
+
+        path = '%s.bak%d' % (filename, generation)
+        if self.compress:
+            path += '.gz'
+            with open(filename, 'rb') as src, gzip.open(path, 'wb', compresslevel=1) as dst:
+                shutil.copyfileobj(src, dst)
+        else:
+            shutil.copy2(filename, path)
+        generations.append((generation, path, time.time()))
+        self.prune(filename)
+        return path
+
+    def prune(self, filename):
+        """Removes the backups of filename that are outside the retention policy.
+        The latest backup is always kept.
+        """
+        generations = self.generations.get(filename)
+        if not generations:
+            return
+        oldest = time.time() - self.max_age if self.max_age is not None else None
+        while len(generations) > 1:
+            _, path, mtime = generations[0]
+            too_many = self.max_count is not None and len(generations) > self.max_count
+            too_old = oldest is not None and mtime < oldest
+            if not too_many and not too_old:
+                break
+            generations.popleft()
+            try:
+                os.remove(path)
+            except OSError as e:
+                self.logger.warning('unable to remove backup %s: %s', path, e)
+
+    def backups(self, filename):
+        """Returns:
+            list of the backup paths of filename, oldest first.
+        """
+        generations = self.generations.get(filename)
+        if generations is None:
+            generations = self.generations[filename] = self._scan(filename)
+        return [path for _, path, _ in generations]
@@ -0,0 +1,164 @@
+"""Serves every configured hostapd from one thread running an asyncio event loop.
+An alternative to one HostapdSocketThread per hostapd, for when there are many hostapds.
+"""
+import asyncio
+import logging
+import threading
+import time
+
+from gasket import auth_app_utils
+from gasket import hostapd_ctrl_async
+from gasket import work_item
+from gasket.hostapd_socket_thread import event_mac, find_event_mac, is_eap_start, sta_acl_list, \
+    MacOrderedResults, RADIUS_ACL_MIB_KEY
+
+
+class HostapdAsyncThread(threading.Thread):
+    """Connects to all the hostapds, and puts the same work items on the work queue
+    as HostapdSocketThread does.
+    """
+
+    logger = None
+    logger_location = None
+    confs = None
+    work_queue = None
+    rate_limiter = None
+    prefetcher = None
+    loop = None
+    stop = False
+
+    def __init__(self, confs, work_queue, logger_location, rate_limiter=None, prefetcher=None):
+        """
+        Args:
+            confs (list of HostapdConf): hostapds to connect to.
+            work_queue (Queue): queue to put work items on.
+            logger_location (str): log file.
+            rate_limiter (RateLimiter): optional. limits the authentications queued.
+            prefetcher (LocationPrefetcher): optional. finds the MACs' locations when their EAP starts.
+        """
+        super().__init__()
+        self.confs = confs
+        self.work_queue = work_queue
+        self.rate_limiter = rate_limiter
+        self.prefetcher = prefetcher
+        self.logger_location = logger_location
+        self.logger = auth_app_utils.get_logger('hostapd_async', logger_location, logging.DEBUG, 1)
+        self.tasks = []
+        # STA requests are pipelined, this keeps the work items for each MAC in event order.
+        # putting must not block the event loop.
+        self.ordered_results = MacOrderedResults(work_queue, self.logger, block=False)
+        self.connected_count = 0
+        # set once every hostapd has been connected & attached to.
+        self.all_connected = threading.Event()
+
+    def run(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.logger.info('serving %d hostapds', len(self.confs))
+        self.tasks = [self.loop.create_task(self._serve(conf)) for conf in self.confs]
+        try:
+            self.loop.run_until_complete(asyncio.wait(self.tasks))
+        finally:
+            self.loop.close()
+            self.logger.info('event loop closed')
+
+    def kill(self):
+        """Stops serving the hostapds. May be called from any thread."""
+        self.stop = True
+        if self.loop is not None and not self.loop.is_closed():
+            self.loop.call_soon_threadsafe(self._cancel_tasks)
+
+    def _cancel_tasks(self):
+        for task in self.tasks:
+            task.cancel()
+
+    def _make_ctrls(self, conf, logger, on_event):
+        if conf.udp:
+            request_sock = hostapd_ctrl_async.AsyncHostapdCtrlUDP(
+                self.loop, conf.remote_host, conf.remote_port,
+                conf.request_bind_address, conf.request_bind_port,
+                logger, conf.request_timeout)
+            unsolicited_sock = hostapd_ctrl_async.AsyncHostapdCtrlUDP(
+                self.loop, conf.remote_host, conf.remote_port,
+                conf.unsolicited_bind_address, conf.unsolicited_bind_port,
+                logger, conf.unsolicited_timeout, on_event)
+        else:
+            request_sock = hostapd_ctrl_async.AsyncHostapdCtrlUNIX(
+                self.loop, conf.unix_socket_path, logger, conf.request_timeout)
+            unsolicited_sock = hostapd_ctrl_async.AsyncHostapdCtrlUNIX(
+                self.loop, conf.unix_socket_path, logger, conf.unsolicited_timeout, on_event)
+        return request_sock, unsolicited_sock
+
+    async def _serve(self, conf):
+        """Connects to a hostapd and processes its unsolicited events until stopped."""
+        logger = auth_app_utils.get_logger(conf.name, self.logger_location, logging.DEBUG, 1)
+        events = asyncio.Queue()
+        request_sock, unsolicited_sock = self._make_ctrls(conf, logger, events.put_nowait)
+        try:
+            await hostapd_ctrl_async.connect_with_retry(request_sock, False, logger)
+            await hostapd_ctrl_async.connect_with_retry(unsolicited_sock, True, logger)
+            logger.info('sockets initiated')
+            self.connected_count += 1
+            if self.connected_count == len(self.confs):
+                self.all_connected.set()
+
+            while not self.stop:
+                try:
+                    data = await asyncio.wait_for(events.get(), conf.unsolicited_timeout)
+                except asyncio.TimeoutError:
+                    if not await request_sock.ping():
+                        logger.info('Connection to hostapd lost. Retrying to connect')
+                        await hostapd_ctrl_async.connect_with_retry(request_sock, False, logger)
+                        await hostapd_ctrl_async.connect_with_retry(unsolicited_sock, True, logger)
+                        logger.info('Connection to hostapd re-established.')
+                    continue
+                logger.info('received message: %s', data)
+                self._handle_event(conf, logger, request_sock, data)
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            logger.info('exception in serve.')
+            logger.exception(e)
+        finally:
+            request_sock.close()
+            unsolicited_sock.close()
+
+    def _handle_event(self, conf, logger, request_sock, data):
+        if 'CTRL-EVENT-EAP-SUCCESS' in data:
+            success = time.time()
+            mac = event_mac(data)
+            if self.rate_limiter and not self.rate_limiter.allow(mac, conf.name):
+                logger.warning('%s is over the rate limit, ignoring success', mac)
+                return
+            task = self.loop.create_task(self._get_auth_work_item(conf, logger, request_sock, mac,
+                                                                  success))
+            self.ordered_results.add(mac, task)
+        elif 'AP-STA-DISCONNECTED' in data:
+            logger.info('%s disconnected message', data)
+            mac = event_mac(data)
+            self.ordered_results.add_item(mac, work_item.DeauthWorkItem(mac, conf.name))
+        elif is_eap_start(data):
+            mac = find_event_mac(data)
+            if self.prefetcher and mac:
+                logger.info('prefetching location of %s', mac)
+                self.prefetcher.prefetch(mac)
+        else:
+            logger.info('unknown message %s', data)
+
+    async def _get_auth_work_item(self, conf, logger, request_sock, mac, success=None):
+        try:
+            sta = await request_sock.get_sta(mac)
+        except (asyncio.TimeoutError, OSError):
+            logger.warning('request socket timed out while getting mib for mac: %s', mac)
+            return None
+        radius_acl_list = sta_acl_list(sta)
+        if radius_acl_list is None:
+            logger.info('%s not in mib', RADIUS_ACL_MIB_KEY)
+            return None
+        username = sta['dot1xAuthSessionUserName']
+        item = work_item.AuthWorkItem(mac, username, radius_acl_list, conf.name)
+        item.success = success
+        if self.prefetcher:
+            # may wait for the prefetch, so not on the event loop.
+            await self.loop.run_in_executor(None, self.prefetcher.prepare, item)
+        return item
@@ -24,6 +24,7 @@ class HostapdConf(gasket_conf.GasketConf):
     unsolicited_bind_port = None
     request_timeout = None
     unsolicited_timeout = None
+    request_pool_size = None
     ifname = None
 
 
@@ -39,6 +40,7 @@ class HostapdConf(gasket_conf.GasketConf):
         'unsolicited_bind_port': None,
         'request_timeout': 5,
         'unsolicited_timeout': 5,
+        'request_pool_size': 4,
         'ifname': None,
     }
 
@@ -54,6 +56,7 @@ class HostapdConf(gasket_conf.GasketConf):
         'unsolicited_bind_port': int,
         'request_timeout': int,
         'unsolicited_timeout': int,
+        'request_pool_size': int,
         'ifname': str,
     }
 
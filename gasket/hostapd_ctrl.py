@@ -5,11 +5,21 @@
 # pytype: disable=name-error
 # pytype: disable=wrong-keyword-args
 
+import itertools
 import socket
-from datetime import datetime
 import os
 import time
 
+_unix_sock_counter = itertools.count()
+
+
+def unix_client_path():
+    """Returns:
+        a path to bind a (client) UNIX control socket to, unique within this process.
+    """
+    return '/tmp/auth-sock-%d-%d' % (os.getpid(), next(_unix_sock_counter))
+
+
 class HostapdCtrl(object):
     """Abstract class for the control interface to hostapd.
     May be either a UNIX socket, or UDP (IPv4 or IPv6).
@@ -213,7 +223,7 @@ class HostapdCtrlUNIX(HostapdCtrl):
         """
         self.close()
 
-        tmpfile = '/tmp/auth-sock-%s' % datetime.now().microsecond
+        tmpfile = unix_client_path()
         self.local_unix_sock_path = tmpfile
 
         if not self.open_connection(ifname, tmpfile):
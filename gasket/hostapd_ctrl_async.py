@@ -0,0 +1,251 @@
+"""asyncio hostapd control interface.
+Speaks the same protocol as hostapd_ctrl (cookie handshake, ATTACH, request/response,
+unsolicited events) but without blocking, so that one event loop can serve many hostapds.
+"""
+import asyncio
+import os
+import socket
+import time
+
+from gasket.hostapd_ctrl import unix_client_path
+
+
+class HostapdCtrlProtocol(asyncio.DatagramProtocol):
+    """Datagram protocol for a hostapd control socket.
+    Unsolicited events (which hostapd prefixes with '<level>') are passed to on_event,
+    everything else is a reply to the oldest outstanding request.
+    """
+
+    def __init__(self, on_event=None):
+        self.transport = None
+        self.on_event = on_event
+        self.pending = []
+        self.closed = False
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        data = data.decode()
+        if data.startswith('<'):
+            if self.on_event:
+                self.on_event(data)
+            return
+        while self.pending:
+            fut = self.pending.pop(0)
+            if not fut.done():
+                fut.set_result(data)
+                return
+
+    def error_received(self, exc):
+        self._fail(exc)
+
+    def connection_lost(self, exc):
+        self.closed = True
+        self._fail(exc or ConnectionResetError('hostapd control socket closed'))
+
+    def _fail(self, exc):
+        pending, self.pending = self.pending, []
+        for fut in pending:
+            if not fut.done():
+                fut.set_exception(exc)
+
+
+class AsyncHostapdCtrl(object):
+    """A (non blocking) control interface to hostapd.
+    Requests may be pipelined, replies are matched to requests in the order they were sent
+    as hostapd answers the requests on a socket in order.
+    If a request times out the socket is reopened, so a late reply cannot be taken as the answer to a later request.
+    """
+
+    def __init__(self, loop, logger, timeout, on_event=None):
+        self.loop = loop
+        self.logger = logger
+        self.timeout = timeout
+        self.on_event = on_event
+        self.transport = None
+        self.protocol = None
+        self.cookie = None
+        self.attached = False
+        self.should_attach = False
+
+    def _new_socket(self):
+        raise NotImplementedError
+
+    def _cleanup_socket(self):
+        pass
+
+    async def connect(self, attach=False):
+        """Opens the socket (and attaches to receive unsolicited events).
+        Raises:
+            OSError, asyncio.TimeoutError: if hostapd cannot be reached.
+        """
+        self.close()
+        self.should_attach = attach
+        sock = self._new_socket()
+        try:
+            self.transport, self.protocol = await self.loop.create_datagram_endpoint(
+                lambda: HostapdCtrlProtocol(self.on_event), sock=sock)
+        except Exception:
+            sock.close()
+            self._cleanup_socket()
+            raise
+        await self._handshake()
+        if attach:
+            self.attached = self._returned_ok(await self.request('ATTACH'))
+            if not self.attached:
+                raise ConnectionError('hostapd ATTACH failed')
+
+    async def _handshake(self):
+        pass
+
+    async def request(self, cmd, timeout=None):
+        """Sends a command and waits for the reply.
+        Args:
+            cmd (str): command to send.
+            timeout (float): seconds to wait for the reply. Defaults to the socket timeout.
+        Returns:
+            reply (str)
+        """
+        if self.transport is None or self.protocol.closed:
+            raise ConnectionError('hostapd control socket is not open')
+        if self.cookie:
+            cmd = 'COOKIE=%s %s' % (self.cookie, cmd)
+        protocol = self.protocol
+        fut = self.loop.create_future()
+        protocol.pending.append(fut)
+        self.transport.sendto(cmd.encode())
+        try:
+            return await asyncio.wait_for(fut, timeout or self.timeout)
+        except asyncio.TimeoutError:
+            # a late reply would otherwise be matched to the next request.
+            # other requests pipelined on the socket fail, and it is only reopened once.
+            if self.protocol is protocol:
+                self.logger.warning('request "%s" timed out. reopening control socket.', cmd)
+                await self.connect(self.should_attach)
+            raise
+
+    async def ping(self):
+        """Returns:
+            True if hostapd replied 'PONG'.
+        """
+        try:
+            return await self.request('PING') == 'PONG\n'
+        except (asyncio.TimeoutError, OSError):
+            return False
+
+    async def get_sta(self, mac):
+        """Get MIB variables for one station
+        Args:
+            mac (str): addr of station to request MIB
+        Returns:
+            dict of station MIB
+        """
+        return self._to_dict(await self.request('STA %s' % mac))
+
+    def _to_dict(self, d):
+        dic = {}
+        for s in d.split('\n'):
+            try:
+                k, v = s.split('=')
+                dic[k] = v
+            except ValueError:
+                self.logger.debug('line: %s cannot be split by "="', s)
+        return dic
+
+    @staticmethod
+    def _returned_ok(data):
+        return data == 'OK\n'
+
+    def close(self):
+        """Closes the socket."""
+        if self.transport is not None:
+            self.transport.close()
+            self.transport = None
+            self.protocol = None
+            self._cleanup_socket()
+        self.cookie = None
+        self.attached = False
+
+
+class AsyncHostapdCtrlUNIX(AsyncHostapdCtrl):
+    """UNIX socket control interface."""
+
+    def __init__(self, loop, path, logger, timeout, on_event=None):
+        super(AsyncHostapdCtrlUNIX, self).__init__(loop, logger, timeout, on_event)
+        self.path = path
+        self.local_unix_sock_path = None
+
+    def _new_socket(self):
+        cli_path = unix_client_path()
+        if len(cli_path) > 107:
+            raise RuntimeError('hostapd ctrl socket path must be <= 108 bytes (including null terminator), was: %d bytes, %s' %
+                               (len(cli_path), cli_path))
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        sock.setblocking(False)
+        try:
+            if os.path.exists(cli_path):
+                os.remove(cli_path)
+            sock.bind(cli_path)
+            self.local_unix_sock_path = cli_path
+            sock.connect(self.path)
+        except OSError:
+            sock.close()
+            self._cleanup_socket()
+            raise
+        return sock
+
+    def _cleanup_socket(self):
+        if self.local_unix_sock_path and os.path.exists(self.local_unix_sock_path):
+            os.remove(self.local_unix_sock_path)
+        self.local_unix_sock_path = None
+
+
+class AsyncHostapdCtrlUDP(AsyncHostapdCtrl):
+    """UDP socket control interface. Uses the GET_COOKIE handshake."""
+
+    def __init__(self, loop, host, port, bind_address, bind_port, logger, timeout, on_event=None):
+        super(AsyncHostapdCtrlUDP, self).__init__(loop, logger, timeout, on_event)
+        addrinfo = socket.getaddrinfo(host, port, type=socket.SOCK_DGRAM)[0]
+        self.family = addrinfo[0]
+        self.sockaddr = addrinfo[4]
+        self.bind_address = bind_address
+        self.bind_port = bind_port
+
+    def _new_socket(self):
+        sock = socket.socket(self.family, socket.SOCK_DGRAM)
+        sock.setblocking(False)
+        try:
+            if self.bind_address is not None and self.bind_port is not None:
+                sock.bind((self.bind_address, int(self.bind_port)))
+            sock.connect(self.sockaddr)
+        except OSError:
+            sock.close()
+            raise
+        return sock
+
+    async def _handshake(self):
+        cookie = (await self.request('GET_COOKIE')).strip()
+        if cookie.startswith('COOKIE='):
+            cookie = cookie[len('COOKIE='):]
+        self.cookie = cookie
+        self.logger.info('UDP Socket Cookie is %s', self.cookie)
+
+
+async def connect_with_retry(ctrl, attach, logger, retry_interval=2):
+    """Keeps trying to connect ctrl until successful.
+    Args:
+        ctrl (AsyncHostapdCtrl): control interface.
+        attach (bool): True to attach for unsolicited events.
+    Returns:
+        seconds it took to connect.
+    """
+    start = time.time()
+    while True:
+        try:
+            await ctrl.connect(attach)
+            return time.time() - start
+        except (OSError, asyncio.TimeoutError) as e:
+            logger.info('unable to connect to hostapd (%s). retrying', e)
+            ctrl.close()
+            await asyncio.sleep(retry_interval)
@@ -1,7 +1,12 @@
 """Configuration for a hostapd socket."""
+import collections
+from concurrent.futures import ThreadPoolExecutor
 import logging
+import queue
+import re
 import socket
 import threading
+import time
 
 from gasket import auth_app_utils
 from gasket import hostapd_ctrl
@@ -11,6 +16,131 @@ from gasket import work_item
 FAUCET_ENTERPRISE_NUMBER = 12345
 FAUCET_RADIUS_ATTRIBUTE_ACL_TYPE = 1
 
+RADIUS_ACL_MIB_KEY = 'AccessAccept:Vendor-Specific:%d:%d' % (FAUCET_ENTERPRISE_NUMBER,
+                                                             FAUCET_RADIUS_ATTRIBUTE_ACL_TYPE)
+
+# events sent when an EAP exchange starts, before the RADIUS exchange that decides it.
+EAP_START_EVENTS = ('CTRL-EVENT-EAP-STARTED', 'CTRL-EVENT-EAP-PROPOSED-METHOD')
+MAC_PATTERN = re.compile(r'(?:[0-9a-fA-F]{2}:){5}[0-9a-fA-F]{2}')
+
+
+def event_mac(data):
+    """Gets the MAC address from a hostapd event.
+    Args:
+        data (str): unsolicited event e.g. "<3>CTRL-EVENT-EAP-SUCCESS 00:00:00:00:00:01"
+    Returns:
+        MAC address (str)
+    """
+    return data.split()[1].replace("'", '')
+
+
+def find_event_mac(data):
+    """Finds the MAC address in a hostapd event that may not have one
+    (e.g. CTRL-EVENT-EAP-PROPOSED-METHOD does not in some hostapd versions).
+    Returns:
+        MAC address (str), or None.
+    """
+    match = MAC_PATTERN.search(data)
+    return match.group(0) if match else None
+
+
+def is_eap_start(data):
+    """Returns:
+        True if data is one of the EAP_START_EVENTS.
+    """
+    return any(event in data for event in EAP_START_EVENTS)
+
+
+def sta_acl_list(sta):
+    """Gets the list of acl names that the RADIUS server sent for a station.
+    Args:
+        sta (dict): station MIB.
+    Returns:
+        list of acl names (str), or None if the MIB does not contain them.
+    """
+    if RADIUS_ACL_MIB_KEY in sta:
+        return sta[RADIUS_ACL_MIB_KEY].split(',')
+    return None
+
+
+class _Done(object):
+    """A result that is already available, in place of a future."""
+
+    def __init__(self, result):
+        self._result = result
+
+    def done(self):
+        return True
+
+    def cancelled(self):
+        return False
+
+    def result(self):
+        return self._result
+
+
+class MacOrderedResults(object):
+    """Puts work items on the work queue as the futures producing them complete,
+    but for any one MAC in the order they were added.
+    So MIB lookups for different MACs can overlap, but (e.g.) an auth and the deauth that
+    followed it for the same MAC are always queued in that order.
+    Works with concurrent.futures and asyncio futures.
+    """
+
+    def __init__(self, work_queue, logger, block=True):
+        """
+        Args:
+            block (bool): False if putting on the work queue must not block
+                          (if it is full, the work item is dropped).
+        """
+        self.work_queue = work_queue
+        self.logger = logger
+        self.block = block
+        self.lock = threading.Lock()
+        # {mac: deque of futures}
+        self.pending = {}
+
+    def add(self, mac, future):
+        """Args:
+            mac (str): MAC address the work item will be for.
+            future: resolves to a WorkItem, or None if there is no work.
+        """
+        with self.lock:
+            self.pending.setdefault(mac, collections.deque()).append(future)
+        future.add_done_callback(lambda _: self._drain(mac))
+
+    def add_item(self, mac, item):
+        """Queues a work item that is already available, after any still pending for the MAC."""
+        with self.lock:
+            if mac in self.pending:
+                self.pending[mac].append(_Done(item))
+                return
+            self._put(item)
+
+    def _put(self, item):
+        try:
+            self.work_queue.put(item, block=self.block)
+            self.logger.info('work given to queue')
+        except queue.Full:
+            self.logger.warning('work queue is full. dropped %s for %s', type(item).__name__, item.mac)
+
+    def _drain(self, mac):
+        with self.lock:
+            pending = self.pending.get(mac)
+            while pending and pending[0].done():
+                future = pending.popleft()
+                if future.cancelled():
+                    continue
+                try:
+                    item = future.result()
+                except Exception as e:
+                    self.logger.exception(e)
+                    continue
+                if item is not None:
+                    self._put(item)
+            if pending is not None and not pending:
+                del self.pending[mac]
+
 
 class HostapdSocketThread(threading.Thread):
     """Stores state related to a hostapd instance.
@@ -19,19 +149,30 @@ class HostapdSocketThread(threading.Thread):
 
     conf = None
     request_sock = None
+    # pool of request sockets, so MIB lookups for a burst of events run concurrently.
+    request_socks = None
+    request_pool = None
+    executor = None
     unsolicited_sock = None
     work_queue = None
+    rate_limiter = None
+    prefetcher = None
     udp = False
     stop = False
 
-    def __init__(self, conf, work_queue, logger_location):
+    def __init__(self, conf, work_queue, logger_location, rate_limiter=None, prefetcher=None):
         super().__init__()
         self.conf = conf
+        self.rate_limiter = rate_limiter
+        self.prefetcher = prefetcher
         self.logger = auth_app_utils.get_logger(self.conf.name,
                                                 logger_location,
                                                 logging.DEBUG,
                                                 1)
         self.work_queue = work_queue
+        self.ordered_results = MacOrderedResults(work_queue, self.logger)
+        self.request_socks = []
+        self.request_pool = queue.Queue()
 
     def run(self):
         """Main loop, waits for messages from hostapd ctl socket,
@@ -48,6 +189,9 @@ class HostapdSocketThread(threading.Thread):
             except Exception as e:
                 self.logger.exception(e)
                 raise
+        for sock in self.request_socks:
+            self.request_pool.put(sock)
+        self.executor = ThreadPoolExecutor(max_workers=len(self.request_socks))
 
         try:
             self.logger.info('sockets initiated')
@@ -57,43 +201,29 @@ class HostapdSocketThread(threading.Thread):
                 try:
                     data = str(self.unsolicited_sock.receive())
                 except socket.timeout:
-                    self.request_sock.ping()
+                    self._ping()
                     continue
                 self.logger.info('received message: %s', data)
                 if 'CTRL-EVENT-EAP-SUCCESS' in data:
                     self.logger.info('success message')
-                    mac = data.split()[1].replace("'", '')
-                    try:
-                        sta = self.request_sock.get_sta(mac)
-                    except socket.timeout:
-                        self.logger.warning('request socket timed out while getting mib for mac: %s',
-                                            mac)
-                        continue
-
-                    if 'AccessAccept:Vendor-Specific:%d:%d' \
-                                            % (FAUCET_ENTERPRISE_NUMBER,
-                                               FAUCET_RADIUS_ATTRIBUTE_ACL_TYPE) in sta:
-                        radius_acl_list = sta['AccessAccept:Vendor-Specific:%d:%d'
-                                              % (FAUCET_ENTERPRISE_NUMBER,
-                                                 FAUCET_RADIUS_ATTRIBUTE_ACL_TYPE)].split(',')
-                    else:
-                        self.logger.info('AccessAccept:Vendor-Specific:%d:%d not in mib',
-                                         FAUCET_ENTERPRISE_NUMBER,
-                                         FAUCET_RADIUS_ATTRIBUTE_ACL_TYPE)
+                    success = time.time()
+                    mac = event_mac(data)
+                    if self.rate_limiter and not self.rate_limiter.allow(mac, self.conf.name):
+                        self.logger.warning('%s is over the rate limit, ignoring success', mac)
                         continue
-                    username = sta['dot1xAuthSessionUserName']
-                    # and add mac, username, radius_acl_list to work queue.
-                    self.logger.info('work about to be given to queue')
-                    self.work_queue.put(work_item.AuthWorkItem(mac,
-                                                               username,
-                                                               radius_acl_list,
-                                                               self.conf.name))
-                    self.logger.info('work given to queue')
+                    # the MIB is fetched on the pool, so the next event can be read meanwhile.
+                    self.ordered_results.add(mac, self.executor.submit(self._get_auth_work_item, mac,
+                                                                       success))
                 elif 'AP-STA-DISCONNECTED' in data:
                     self.logger.info('%s disconnected message', data)
-                    mac = data.split()[1].replace("'", '')
+                    mac = event_mac(data)
                     # and add mac to the work queue for deauth. maybe add which hostapd it came from
-                    self.work_queue.put(work_item.DeauthWorkItem(mac, self.conf.name))
+                    self.ordered_results.add_item(mac, work_item.DeauthWorkItem(mac, self.conf.name))
+                elif is_eap_start(data):
+                    mac = find_event_mac(data)
+                    if self.prefetcher and mac:
+                        self.logger.info('prefetching location of %s', mac)
+                        self.prefetcher.prefetch(mac)
                 else:
                     self.logger.info('unknown message %s', data)
         except Exception as e:
@@ -101,22 +231,71 @@ class HostapdSocketThread(threading.Thread):
             self.logger.exception(e)
             return
 
+    def _get_auth_work_item(self, mac, success=None):
+        """Gets the MIB for mac from hostapd (using a socket from the pool).
+        Args:
+            mac (str): MAC address.
+            success (float): time the EAP success was received.
+        Returns:
+            AuthWorkItem, or None if the MIB could not be got or has no acls.
+        """
+        request_sock = self.request_pool.get()
+        try:
+            sta = request_sock.get_sta(mac)
+        except socket.timeout:
+            self.logger.warning('request socket timed out while getting mib for mac: %s', mac)
+            return None
+        finally:
+            self.request_pool.put(request_sock)
+
+        radius_acl_list = sta_acl_list(sta)
+        if radius_acl_list is None:
+            self.logger.info('%s not in mib', RADIUS_ACL_MIB_KEY)
+            return None
+        username = sta['dot1xAuthSessionUserName']
+        item = work_item.AuthWorkItem(mac, username, radius_acl_list, self.conf.name)
+        item.success = success
+        if self.prefetcher:
+            self.prefetcher.prepare(item)
+        return item
+
+    def _ping(self):
+        """Pings (and reconnects if necessary) each idle request socket."""
+        for _ in range(len(self.request_socks)):
+            request_sock = self.request_pool.get()
+            try:
+                request_sock.ping()
+            finally:
+                self.request_pool.put(request_sock)
+
+    def _request_pool_size(self):
+        if self.conf.udp and self.conf.request_bind_port:
+            # only one socket can be bound to the port.
+            return 1
+        return max(1, self.conf.request_pool_size)
+
     def kill(self):
         # TODO Does this even work? - does hostapd detatch the socket.
-        self.request_sock.close()
+        for request_sock in self.request_socks:
+            request_sock.close()
+        if self.executor:
+            self.executor.shutdown(wait=False)
         self.unsolicited_sock.detach()
         self.unsolicited_sock.close()
         self.stop = True
 
     def _init_udp_sockets(self):
         self.logger.info('initiating UDP socket for hostapd ctrl')
-        self.request_sock = hostapd_ctrl.request_socket_udp(self.conf.ifname,
-                                                            self.conf.remote_host,
-                                                            self.conf.remote_port,
-                                                            self.conf.request_bind_address,
-                                                            self.conf.request_bind_port,
-                                                            self.conf.request_timeout,
-                                                            self.logger)
+        for _ in range(self._request_pool_size()):
+            self.request_socks.append(
+                hostapd_ctrl.request_socket_udp(self.conf.ifname,
+                                                self.conf.remote_host,
+                                                self.conf.remote_port,
+                                                self.conf.request_bind_address,
+                                                self.conf.request_bind_port,
+                                                self.conf.request_timeout,
+                                                self.logger))
+        self.request_sock = self.request_socks[0]
 
         self.unsolicited_sock = hostapd_ctrl.unsolicited_socket_udp(self.conf.ifname,
                                                                     self.conf.remote_host,
@@ -129,9 +308,12 @@ class HostapdSocketThread(threading.Thread):
 
     def _init_unix_sockets(self):
         self.logger.info('initiating UNIX socket for hostapd ctrl')
-        self.request_sock = hostapd_ctrl.request_socket_unix(self.conf.unix_socket_path,
-                                                             self.conf.request_timeout,
-                                                             self.logger)
+        for _ in range(self._request_pool_size()):
+            self.request_socks.append(
+                hostapd_ctrl.request_socket_unix(self.conf.unix_socket_path,
+                                                 self.conf.request_timeout,
+                                                 self.logger))
+        self.request_sock = self.request_socks[0]
         self.unsolicited_sock = hostapd_ctrl.unsolicited_socket_unix(self.conf.unix_socket_path,
                                                                      self.conf.unsolicited_timeout,
                                                                      self.logger)
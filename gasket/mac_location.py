@@ -0,0 +1,258 @@
+"""Index of the access port each MAC address has been learned on, kept current by
+Faucet's event socket (L2_LEARN & L2_EXPIRE events) rather than scraping all of learned_macs per login.
+And, for when learned_macs is scraped, an index of the scrape so many MACs can be found in one pass.
+"""
+import json
+import logging
+import socket
+import threading
+import time
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from gasket import auth_app_utils
+
+
+def is_access_port(dp_port_mode, dp_name, port):
+    """Args:
+        dp_port_mode (dict): the 'dps' of auth.yaml.
+        dp_name (str): datapath name.
+        port (int): port number.
+    Returns:
+        True if the port is configured with 'auth_mode: access'.
+    """
+    interfaces = dp_port_mode.get(dp_name, {}).get('interfaces', {})
+    return interfaces.get(port, {}).get('auth_mode') == 'access'
+
+
+def mac_from_value(value):
+    """Returns:
+        MAC address string of a learned_macs sample value (the MAC as a number).
+    """
+    return auth_app_utils.float_to_mac('%d' % value)
+
+
+def mac_to_value(mac):
+    """Returns:
+        the MAC address string as a number (as learned_macs sample values are).
+    """
+    return int(mac.replace(':', ''), 16)
+
+
+class LearnedMacs(object):
+    """The learned_macs samples of a scrape, for finding many MACs at once.
+    With NumPy (optional) the values (the MAC as a number) are decoded once into a sorted uint64 array
+    that is binary searched for all the MACs being found,
+    otherwise the samples are scanned once for all the MACs being found.
+    Either way the labels are only looked at for the samples of the MACs being found.
+    """
+
+    samples = None
+    use_numpy = False
+
+    def __init__(self, learned_macs, use_numpy=True):
+        """
+        Args:
+            learned_macs (list): (name, labels, value) samples of faucet's learned_macs.
+            use_numpy (bool): False to not use NumPy even if it is installed.
+        """
+        self.samples = learned_macs
+        self.use_numpy = use_numpy and numpy is not None
+        if self.use_numpy:
+            values = numpy.fromiter((value for _, _, value in learned_macs), numpy.float64,
+                                    len(learned_macs)).astype(numpy.uint64)
+            self.order = numpy.argsort(values, kind='stable')
+            self.values = values[self.order]
+
+    def _positions(self, values):
+        """Returns:
+            list (one for each of values) of the positions of the samples with that value.
+        """
+        if self.use_numpy:
+            keys = numpy.array(values, dtype=numpy.uint64)
+            lefts = numpy.searchsorted(self.values, keys, 'left').tolist()
+            rights = numpy.searchsorted(self.values, keys, 'right').tolist()
+            return [self.order[left:right].tolist() for left, right in zip(lefts, rights)]
+        positions = {value: [] for value in values}
+        for i, (_, _, value) in enumerate(self.samples):
+            found = positions.get(int(value))
+            if found is not None:
+                found.append(i)
+        return [positions[value] for value in values]
+
+    def find_access_ports(self, macs, dp_port_mode):
+        """Args:
+            macs (list of str): MAC addresses to find.
+            dp_port_mode (dict): the 'dps' of auth.yaml.
+        Returns:
+            {mac: (dp name, port)} for the macs learned on an access port.
+        """
+        found = {}
+        for mac, positions in zip(macs, self._positions([mac_to_value(mac) for mac in macs])):
+            for i in positions:
+                labels = self.samples[i][1]
+                dp_name = labels.get('dp_name')
+                port = int(labels.get('port', -1))
+                if is_access_port(dp_port_mode, dp_name, port):
+                    found[mac] = (dp_name, port)
+                    break
+        return found
+
+
+class MacLocationIndex(object):
+    """{mac: (dp name, port)} of the MACs learned on access ports. MACs on other (e.g. trunk) ports are not kept.
+    Updated from Faucet's events, and rebuilt from a learned_macs scrape when (re)connecting to them.
+    The index is only used for lookups while it is 'live' (following the events).
+    Thread safe.
+    """
+
+    dp_port_mode = None
+    metrics = None
+    # True while the index is following faucet's events.
+    live = False
+    # time of the last event or resync.
+    updated = None
+
+    def __init__(self, dp_port_mode, metrics=None):
+        """
+        Args:
+            dp_port_mode (dict): the 'dps' of auth.yaml.
+            metrics (AuthAppMetrics): optional. for the index's size, age and lookups.
+        """
+        self.dp_port_mode = dp_port_mode
+        self.metrics = metrics
+        self.lock = threading.Lock()
+        self.locations = {}
+        self.updated = time.time()
+        if self.metrics:
+            self.metrics.mac_index_size.set_function(lambda: len(self.locations))
+            self.metrics.mac_index_live.set_function(lambda: 1 if self.live else 0)
+            self.metrics.mac_index_age.set_function(self.age)
+
+    def age(self):
+        """Returns:
+            seconds since the index was last updated (by an event or resync).
+        """
+        return time.time() - self.updated
+
+    def resync(self, learned_macs):
+        """Rebuilds the index from a scrape.
+        Args:
+            learned_macs (list): (name, labels, value) samples of faucet's learned_macs.
+        """
+        locations = {}
+        for _, labels, value in learned_macs:
+            dp_name = labels.get('dp_name')
+            port = int(labels.get('port', -1))
+            if is_access_port(self.dp_port_mode, dp_name, port):
+                locations[mac_from_value(value)] = (dp_name, port)
+        with self.lock:
+            self.locations = locations
+            self.updated = time.time()
+
+    def learn(self, mac, dp_name, port):
+        """The MAC has been learned on dp_name's port (possibly having moved from another)."""
+        with self.lock:
+            self.updated = time.time()
+            if is_access_port(self.dp_port_mode, dp_name, port):
+                self.locations[mac] = (dp_name, port)
+            elif self.locations.get(mac, (None,))[0] == dp_name:
+                # moved off an access port (onto one that is not) on the same datapath.
+                del self.locations[mac]
+
+    def expire(self, mac, dp_name, port):
+        """The MAC has expired from dp_name's port."""
+        with self.lock:
+            self.updated = time.time()
+            if self.locations.get(mac) == (dp_name, port):
+                del self.locations[mac]
+
+    def lookup(self, mac):
+        """Returns:
+            (dp name, port) of the access port mac was learned on, or None if it is not in the index.
+        """
+        location = self.locations.get(mac)
+        if self.metrics:
+            self.metrics.mac_index_lookups.labels('hit' if location else 'miss').inc()
+        return location
+
+
+class FaucetEventThread(threading.Thread):
+    """Follows Faucet's event socket (FAUCET_EVENT_SOCK), applying the L2_LEARN and L2_EXPIRE
+    events to a MacLocationIndex. The index is resynced from a scrape each time the socket is connected,
+    and is not live while it is disconnected.
+    """
+
+    logger = None
+    sock_path = None
+    index = None
+    prom_client = None
+    sock = None
+    stop = False
+
+    def __init__(self, sock_path, index, prom_client, logger_location, retry_interval=5):
+        """
+        Args:
+            sock_path (str): path of faucet's event socket.
+            index (MacLocationIndex): index to keep current.
+            prom_client (PrometheusClient): for the learned_macs scrape on connecting.
+            logger_location (str): log file.
+            retry_interval (float): seconds to wait before reconnecting.
+        """
+        super().__init__(daemon=True)
+        self.sock_path = sock_path
+        self.index = index
+        self.prom_client = prom_client
+        self.retry_interval = retry_interval
+        self.logger = auth_app_utils.get_logger('faucet_events', logger_location, logging.DEBUG, 1)
+
+    def run(self):
+        while not self.stop:
+            self.sock = None
+            try:
+                self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+                self.sock.connect(self.sock_path)
+                self.logger.info('connected to faucet event socket %s', self.sock_path)
+                # events received while resyncing wait in the socket, and are applied after.
+                learned_macs, _ = self.prom_client.cached_families(['learned_macs'], max_age=0)
+                self.index.resync(learned_macs['learned_macs'])
+                self.index.live = True
+                self.logger.info('resynced %d macs', len(self.index.locations))
+                self._follow(self.sock.makefile('r'))
+                self.logger.warning('faucet event socket closed')
+            except Exception as e:
+                if not self.stop:
+                    self.logger.warning('faucet event socket %s: %s', self.sock_path, e)
+            finally:
+                self.index.live = False
+                if self.sock is not None:
+                    self.sock.close()
+            if not self.stop:
+                time.sleep(self.retry_interval)
+
+    def _follow(self, lines):
+        """Applies the events (a JSON object per line) until the socket is closed."""
+        for line in lines:
+            try:
+                event = json.loads(line)
+            except ValueError:
+                self.logger.warning('cannot parse faucet event: %s', line)
+                continue
+            if 'L2_LEARN' in event:
+                learn = event['L2_LEARN']
+                self.index.learn(learn['eth_src'].lower(), event['dp_name'], int(learn['port_no']))
+            elif 'L2_EXPIRE' in event:
+                expire = event['L2_EXPIRE']
+                self.index.expire(expire['eth_src'].lower(), event['dp_name'], int(expire['port_no']))
+
+    def kill(self):
+        """Stops following the events. May be called from any thread."""
+        self.stop = True
+        if self.sock is not None:
+            try:
+                self.sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
@@ -0,0 +1,88 @@
+"""Speculatively finds where a MAC is when its EAP exchange starts, so the (hundreds of milliseconds of)
+RADIUS exchange hides the learned_macs lookup, and the authentication can go straight to commit.
+"""
+from concurrent.futures import ThreadPoolExecutor
+import threading
+import time
+
+
+class LocationPrefetcher(object):
+    """prefetch() starts finding a MAC's location on a pool of threads (and reloads the rules file if it
+    has changed, so that is not done on success either). prepare() then gives an AuthWorkItem for the MAC
+    the prefetched location and its rules, waiting for the prefetch if it is still in progress.
+    A prefetch is used at most once, and not at all once it is older than ttl seconds.
+    Thread safe, one LocationPrefetcher is shared by all the hostapd threads.
+    """
+
+    resolve = None
+    rule_man = None
+    metrics = None
+    ttl = 30
+
+    def __init__(self, resolve, rule_man, workers=2, ttl=30, metrics=None):
+        """
+        Args:
+            resolve (function): takes a list of MACs, returns {mac: (dp name, port)} for those found.
+            rule_man (RuleManager): for the rules.
+            workers (int): threads to prefetch with.
+            ttl (float): seconds a prefetched location may be used for.
+            metrics (AuthAppMetrics): optional. for the number of prefetches used (hit) or not (miss).
+        """
+        self.resolve = resolve
+        self.rule_man = rule_man
+        self.ttl = ttl
+        self.metrics = metrics
+        self.executor = ThreadPoolExecutor(workers)
+        self.lock = threading.Lock()
+        # {mac: (time started, future of (dp name, port) or None)}
+        self.prefetches = {}
+        self.last_prune = time.time()
+
+    def prefetch(self, mac):
+        """Starts finding mac's location, unless that is already in progress (or done recently)."""
+        now = time.time()
+        with self.lock:
+            prefetch = self.prefetches.get(mac)
+            if prefetch is not None and now - prefetch[0] < self.ttl:
+                return
+            self.prefetches[mac] = (now, self.executor.submit(self._fetch, mac))
+            self._prune(now)
+
+    def _fetch(self, mac):
+        self.rule_man.rule_gen.reload_if_changed()
+        return self.resolve([mac]).get(mac)
+
+    def _prune(self, now):
+        """Forgets the prefetches that are too old to be used (at most once per ttl)."""
+        if now - self.last_prune < self.ttl:
+            return
+        self.last_prune = now
+        for mac in [mac for mac, (started, _) in self.prefetches.items() if now - started >= self.ttl]:
+            del self.prefetches[mac]
+
+    def prepare(self, item):
+        """Sets item's location and rules from the prefetch for its MAC, if there is one that found it.
+        Otherwise item is left for the worker to find.
+        Args:
+            item (AuthWorkItem)
+        Returns:
+            item
+        """
+        with self.lock:
+            prefetch = self.prefetches.pop(item.mac, None)
+        location = None
+        if prefetch is not None and time.time() - prefetch[0] < self.ttl:
+            try:
+                location = prefetch[1].result()
+            except Exception:
+                location = None
+        if self.metrics:
+            self.metrics.location_prefetches.labels('hit' if location else 'miss').inc()
+        if location is not None:
+            item.rules = self.rule_man.get_rules(item.username, item.mac, location[0], location[1],
+                                                 item.acllist)
+            item.location = location
+        return item
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False)
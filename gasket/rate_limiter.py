@@ -0,0 +1,120 @@
+"""Token bucket rate limiting of the authentication events from the hostapds,
+so one misbehaving supplicant (or hostapd) cannot use up the faucet reloads.
+"""
+import threading
+import time
+
+MAC = 'mac'
+HOSTAPD = 'hostapd'
+
+
+class TokenBucket(object):
+    """Holds up to burst tokens, refilled at rate tokens per second."""
+
+    __slots__ = ('tokens', 'updated')
+
+    def __init__(self, burst, now):
+        self.tokens = burst
+        self.updated = now
+
+    def refill(self, rate, burst, now):
+        self.tokens = min(burst, self.tokens + (now - self.updated) * rate)
+        self.updated = now
+
+
+class RateLimiter(object):
+    """Limits events per MAC and per hostapd, each with a token bucket.
+    An event is allowed if both its MAC's and its hostapd's buckets have a token,
+    and then takes one from each.
+    The buckets of MACs that have been idle long enough to have refilled are forgotten,
+    so the number kept is bounded by the MACs active within the last burst / rate seconds.
+    Thread safe, one RateLimiter is shared by all the hostapd threads.
+    """
+
+    metrics = None
+    mac_rate = None
+    mac_burst = None
+    hostapd_rate = None
+    hostapd_burst = None
+
+    def __init__(self, mac_rate=None, mac_burst=None, hostapd_rate=None, hostapd_burst=None,
+                 metrics=None):
+        """
+        Args:
+            mac_rate (float): events per second allowed per MAC. None for no limit.
+            mac_burst (int): events a MAC may make at once. Defaults to mac_rate (at least 1).
+            hostapd_rate (float): events per second allowed per hostapd. None for no limit.
+            hostapd_burst (int): events a hostapd may make at once. Defaults to hostapd_rate (at least 1).
+            metrics (AuthAppMetrics): optional. for the number of events limited.
+        """
+        self.mac_rate = mac_rate
+        self.mac_burst = self._burst(mac_rate, mac_burst)
+        self.hostapd_rate = hostapd_rate
+        self.hostapd_burst = self._burst(hostapd_rate, hostapd_burst)
+        self.metrics = metrics
+        self.lock = threading.Lock()
+        # {mac: TokenBucket}
+        self.macs = {}
+        # {hostapd name: TokenBucket}
+        self.hostapds = {}
+        self.limited = {MAC: 0, HOSTAPD: 0}
+        self.last_prune = time.time()
+
+    @staticmethod
+    def _burst(rate, burst):
+        if rate is None:
+            return None
+        if burst is None:
+            return max(1, rate)
+        return burst
+
+    def _bucket(self, buckets, key, rate, burst, now):
+        bucket = buckets.get(key)
+        if bucket is None:
+            bucket = buckets[key] = TokenBucket(burst, now)
+        else:
+            bucket.refill(rate, burst, now)
+        return bucket
+
+    def allow(self, mac, hostapd_name):
+        """Returns:
+            True if the event from mac (on hostapd_name) is within the limits.
+        """
+        now = time.time()
+        with self.lock:
+            mac_bucket = None
+            hostapd_bucket = None
+            if self.mac_rate is not None:
+                mac_bucket = self._bucket(self.macs, mac, self.mac_rate, self.mac_burst, now)
+                if mac_bucket.tokens < 1:
+                    return self._limited(MAC, hostapd_name)
+            if self.hostapd_rate is not None:
+                hostapd_bucket = self._bucket(self.hostapds, hostapd_name, self.hostapd_rate,
+                                              self.hostapd_burst, now)
+                if hostapd_bucket.tokens < 1:
+                    return self._limited(HOSTAPD, hostapd_name)
+            if mac_bucket is not None:
+                mac_bucket.tokens -= 1
+            if hostapd_bucket is not None:
+                hostapd_bucket.tokens -= 1
+            self._prune(now)
+        return True
+
+    def _limited(self, scope, hostapd_name):
+        self.limited[scope] += 1
+        if self.metrics:
+            self.metrics.rate_limited.labels(scope, hostapd_name).inc()
+        return False
+
+    def _prune(self, now):
+        """Forgets the MAC buckets that would have refilled by now (at most once per refill time)."""
+        if self.mac_rate is None:
+            return
+        refill_time = self.mac_burst / self.mac_rate
+        if now - self.last_prune < refill_time:
+            return
+        self.last_prune = now
+        full = [mac for mac, bucket in self.macs.items()
+                if bucket.tokens + (now - bucket.updated) * self.mac_rate >= self.mac_burst]
+        for mac in full:
+            del self.macs[mac]
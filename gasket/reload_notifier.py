@@ -0,0 +1,126 @@
+"""Notifiers that tell the waiting thread when Faucet has finished reloading its config (after a SIGHUP).
+"""
+import abc
+import time
+
+
+class ReloadNotifier(abc.ABC):
+    """Interface for finding out when Faucet has reloaded.
+    PollingReloadNotifier polls faucet's prometheus. Another source (e.g. one that faucet pushes
+    reload events to) implements get_reload_state() and wait_for_reload(), and is given to RuleManager.
+    """
+
+    logger = None
+    metrics = None
+    timeout = 20
+    # seconds the last successful reload took (from wait_for_reload being called).
+    last_reload_latency = None
+    # True if faucet reported an error loading the config on the last reload.
+    last_load_error = False
+
+    def __init__(self, logger, timeout=20, metrics=None):
+        self.logger = logger
+        self.timeout = timeout
+        self.metrics = metrics
+
+    @abc.abstractmethod
+    def get_reload_state(self):
+        """Returns:
+            tuple of (number of times faucet has reloaded, True if the last load errored).
+        """
+
+    def reload_count(self):
+        """Returns:
+            number of times faucet has reloaded.
+        """
+        return self.get_reload_state()[0]
+
+    @abc.abstractmethod
+    def wait_for_reload(self, start_count):
+        """Blocks until faucet has reloaded since the reload count was start_count.
+        Args:
+            start_count (int): reload count from before faucet was signaled.
+        Returns:
+            True if faucet reloaded the config without error within timeout seconds, False otherwise.
+            last_load_error is True if it reloaded, but failed to load the config.
+        """
+
+    def _reloaded(self, start_time, load_error):
+        self.last_reload_latency = time.time() - start_time
+        self.last_load_error = load_error
+        if self.metrics:
+            self.metrics.faucet_reload_latency.observe(self.last_reload_latency)
+            if load_error:
+                self.metrics.faucet_reload_errors.inc()
+        if load_error:
+            self.logger.error('faucet reloaded in %.3f seconds, but failed to load the config.',
+                              self.last_reload_latency)
+            return False
+        self.logger.info('faucet has reloaded. took %.3f seconds', self.last_reload_latency)
+        return True
+
+
+class PollingReloadNotifier(ReloadNotifier):
+    """Polls faucet's prometheus 'faucet_config_reload_requests' and 'faucet_config_load_error'.
+    Rather than polling at a fixed rate the first poll is made at about the time previous reloads
+    have taken, and the interval then backs off exponentially from min_interval up to max_interval.
+    """
+
+    prom_client = None
+    min_interval = 0.01
+    max_interval = 0.5
+    # exponentially weighted average of the reload latency, used to schedule the first poll.
+    expected_latency = None
+
+    def __init__(self, prom_client, logger, timeout=20, min_interval=0.01, max_interval=0.5,
+                 metrics=None):
+        super(PollingReloadNotifier, self).__init__(logger, timeout, metrics)
+        self.prom_client = prom_client
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+
+    def get_reload_state(self):
+        if self.metrics:
+            self.metrics.faucet_reload_scrapes.inc()
+        count = 0
+        load_error = False
+        for _, name, _, value in self.prom_client.samples(['faucet_config_reload_requests',
+                                                           'faucet_config_load_error']):
+            if name in ('faucet_config_reload_requests', 'faucet_config_reload_requests_total'):
+                count = int(value)
+            elif name == 'faucet_config_load_error':
+                load_error = value > 0
+        return count, load_error
+
+    def poll_intervals(self):
+        """Generates the time to sleep before each poll."""
+        interval = self.min_interval
+        if self.expected_latency:
+            yield max(self.min_interval, self.expected_latency * 0.8)
+        while True:
+            yield interval
+            interval = min(interval * 2, self.max_interval)
+
+    def wait_for_reload(self, start_count):
+        start = time.time()
+        self.last_load_error = False
+        deadline = start + self.timeout
+        polls = 0
+        for interval in self.poll_intervals():
+            interval = min(interval, deadline - time.time())
+            if interval <= 0:
+                break
+            time.sleep(interval)
+            polls += 1
+            count, load_error = self.get_reload_state()
+            if count > start_count:
+                success = self._reloaded(start, load_error)
+                if self.expected_latency is None:
+                    self.expected_latency = self.last_reload_latency
+                else:
+                    self.expected_latency = 0.7 * self.expected_latency + 0.3 * self.last_reload_latency
+                self.logger.debug('faucet reload detected after %d polls', polls)
+                return success
+            self.logger.debug('waiting for faucet to process sighup config reload. %d', polls)
+        self.logger.error('faucet did not process sighup within %d seconds. (%d polls)', self.timeout, polls)
+        return False
@@ -0,0 +1,124 @@
+"""Retries the authentications of MACs that Faucet had not learned (so the access port was not known)
+when they were processed, with exponential backoff until a deadline.
+"""
+import heapq
+import logging
+import threading
+import time
+
+from gasket import auth_app_utils
+
+
+class RetryQueue(threading.Thread):
+    """Timer heap of AuthWorkItems to put back on the work queue.
+
+    The worker schedule()s an item when its MAC cannot be found, and the item is put back on
+    the work queue after initial_delay seconds, then twice that, ... up to max_delay seconds,
+    until deadline seconds after the item was first queued, when it is given up on (expired).
+    A MAC has at most one item scheduled (or being retried) at a time.
+    cancel() (e.g. on deauthentication) forgets the MAC's item, and a retried item
+    that is no longer current() must not be authenticated.
+    Cancelled items are left in the heap and skipped, so scheduling and cancelling are O(log n) and O(1).
+    """
+
+    logger = None
+    work_queue = None
+    metrics = None
+    initial_delay = 0.5
+    max_delay = 8
+    deadline = 60
+    stop = False
+
+    def __init__(self, work_queue, logger_location, initial_delay=0.5, max_delay=8, deadline=60,
+                 metrics=None):
+        """
+        Args:
+            work_queue (CoalescingWorkQueue): queue to put the items back on.
+            logger_location (str): log file.
+            initial_delay (float): seconds before the first retry.
+            max_delay (float): maximum seconds between retries.
+            deadline (float): seconds after an item was first queued to give up on it.
+            metrics (AuthAppMetrics): optional. for the number of retries, expiries and pending items.
+        """
+        super().__init__(daemon=True)
+        self.work_queue = work_queue
+        self.initial_delay = initial_delay
+        self.max_delay = max_delay
+        self.deadline = deadline
+        self.metrics = metrics
+        self.logger = auth_app_utils.get_logger('retry_queue', logger_location, logging.DEBUG, 1)
+        self.lock = threading.Lock()
+        self.wakeup = threading.Condition(self.lock)
+        # heap of (due time, sequence number, AuthWorkItem)
+        self.heap = []
+        self.seq = 0
+        # {mac: the AuthWorkItem scheduled or being retried}
+        self.pending = {}
+        if self.metrics:
+            self.metrics.auth_retries_pending.set_function(lambda: len(self.pending))
+
+    def schedule(self, item):
+        """Schedules item's next retry.
+        Returns:
+            False if item has passed its deadline (and has been given up on).
+        """
+        now = time.time()
+        give_up = item.created + self.deadline
+        with self.lock:
+            if now >= give_up:
+                if self.pending.get(item.mac) is item:
+                    del self.pending[item.mac]
+                self.logger.warning('giving up on authenticating %s after %d retries', item.mac, item.attempts)
+                if self.metrics:
+                    self.metrics.auth_retries_expired.inc()
+                return False
+            due = min(now + min(self.initial_delay * 2 ** item.attempts, self.max_delay), give_up)
+            self.pending[item.mac] = item
+            self.seq += 1
+            heapq.heappush(self.heap, (due, self.seq, item))
+            if self.heap[0][2] is item:
+                self.wakeup.notify()
+        return True
+
+    def cancel(self, mac):
+        """Forgets the item scheduled (or being retried) for mac."""
+        with self.lock:
+            self.pending.pop(mac, None)
+
+    def current(self, item):
+        """Returns:
+            True if item is the one scheduled (or being retried) for its MAC, i.e. it has not been cancelled.
+        """
+        return self.pending.get(item.mac) is item
+
+    def run(self):
+        while not self.stop:
+            with self.lock:
+                due = []
+                now = time.time()
+                while self.heap and self.heap[0][0] <= now:
+                    _, _, item = heapq.heappop(self.heap)
+                    if self.pending.get(item.mac) is item:
+                        due.append(item)
+                if not due:
+                    timeout = self.heap[0][0] - now if self.heap else None
+                    self.wakeup.wait(timeout)
+                    continue
+            for item in due:
+                item.attempts += 1
+                # so the time waiting to be retried is not counted as time waiting on the work queue.
+                item.queued = time.time()
+                self.logger.info('retrying authentication of %s (attempt %d)', item.mac, item.attempts)
+                if self.metrics:
+                    self.metrics.auth_retries.inc()
+                try:
+                    self.work_queue.put(item, block=False)
+                except Exception as e:
+                    self.logger.warning('cannot requeue %s: %s', item.mac, e)
+                    self.cancel(item.mac)
+
+    def kill(self):
+        """Stops retrying. May be called from any thread."""
+        with self.lock:
+            self.stop = True
+            self.wakeup.notify()
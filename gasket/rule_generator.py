@@ -6,20 +6,61 @@ as discovered at runtime.
 TODO maybe make this an interface for yaml or db generator subclasses.
 """
 # pytype: disable=pyi-error
-import yaml
+import hashlib
+import os
+
+from gasket import serialization
+
+USER_MAC = '_user-mac_'
+USER_NAME = '_user-name_'
+AUTH_PORT = '_authport_'
+
+
+class RuleTemplate(object):
+    """A rule from the rules file, with the keys of the placeholder values found in advance.
+    Placeholders are only substituted in the top level values of a rule.
+    The template is shared by every rendered rule, so must not be modified.
+    """
+
+    __slots__ = ('rule', 'mac_keys', 'name_keys')
+
+    def __init__(self, rule):
+        self.rule = rule
+        self.mac_keys = tuple(k for k, v in rule.items() if v == USER_MAC)
+        self.name_keys = tuple(k for k, v in rule.items() if v == USER_NAME)
+
+    def render(self, username, mac):
+        """Returns:
+            {'rule': rule} with the placeholders replaced.
+            Only the top level dict is new, nested values are shared with the template.
+        """
+        r = dict(self.rule)
+        for k in self.mac_keys:
+            r[k] = mac
+        for k in self.name_keys:
+            r[k] = username
+        return {'rule': r}
 
 
 class RuleGenerator(object):
     """Object for gernerating rules from a yaml file.
+    The file is compiled into RuleTemplates when it is loaded,
+    and only reloaded when it has been modified.
     """
 
     yaml_file = ""
     conf = None
     logger = None
+    # {acl name: [(port acl name, [RuleTemplate, ...]), ...]}
+    templates = None
+    # (mtime, size) and hash of the file the templates were compiled from.
+    file_stat = None
+    file_hash = None
 
     def __init__(self, rule_file, logger):
-        self.reload(rule_file)
         self.logger = logger
+        self.templates = {}
+        self.reload(rule_file)
 
     def get_rules(self, username, auth_port_acl, mac, acl_list):
         """Gets Faucet ACL rules for the specified user.
@@ -32,66 +73,83 @@ class RuleGenerator(object):
         Returns:
             Dictionary of port_acl names to list of rules.
         """
-        # if we don't reload the values that we will want to swap
-        # may already be filled if the user has logged on already.
-
-        # what about doing a copy or deepcopy?
-        # and only do a full reload when file has actually changed?
-        self.reload(self.yaml_file)
+        self.reload_if_changed()
 
         rules = dict()
         for aclname in acl_list:
-            if aclname in list(self.conf['acls']):
-                for portacl in list(self.conf['acls'][aclname].keys()):
-                    if portacl not in rules:
-                        rules[portacl] = []
-                    for obj in self.conf['acls'][aclname][portacl]:
-                        if isinstance(obj, dict) and 'rule' in obj:
-                            r = obj["rule"]
-                            for k, v in list(r.items()):
-                                if v == "_user-mac_":
-                                    r[k] = mac
-                                if v == "_user-name_":
-                                    r[k] = username
-                            d = dict()
-                            d["rule"] = r
-                            rules[portacl].append(d)
-                        elif isinstance(obj, list):
-                            for y in obj:
-                                if isinstance(y, dict):
-                                    # list of dicts
-                                    for _, rule in list(y.items()):
-                                        r = rule
-                                        for k, v in list(r.items()):
-                                            if v == "_user-mac_":
-                                                r[k] = mac
-                                            if v == "_user-name_":
-                                                r[k] = username
-                                        d = dict()
-                                        d["rule"] = r
-                                        rules[portacl].append(d)
-                                else:
-                                    self.logger.warning('list of unrecognised objects')
-                                    self.logger.warning('child type: %s' % type(y))
-                                    self.logger.warning('list object: %s' % obj)
-
-                        else:
-                            self.logger.debug('obj is type %s', type(obj))
-                    if portacl == "_authport_":
-                        # rename the port acl to the one the user authenticated on.
-                        temp = rules[portacl]
-                        del rules[portacl]
-                        if auth_port_acl in rules:
-                            rules[auth_port_acl].extend(temp)
-                        else:
-                            rules[auth_port_acl] = temp
+            for portacl, templates in self.templates.get(aclname, ()):
+                if portacl == AUTH_PORT:
+                    # rename the port acl to the one the user authenticated on.
+                    portacl = auth_port_acl
+                if portacl not in rules:
+                    rules[portacl] = []
+                rules[portacl].extend([t.render(username, mac) for t in templates])
         return rules
 
+    def reload_if_changed(self):
+        """Reloads the rule file if it has been modified since it was last loaded.
+        Returns:
+            True if the rules were recompiled.
+        """
+        try:
+            stat = os.stat(self.yaml_file)
+        except OSError as e:
+            self.logger.warning('cannot stat rule file %s: %s. using the loaded rules.', self.yaml_file, e)
+            return False
+        if (stat.st_mtime_ns, stat.st_size) == self.file_stat:
+            return False
+        return self.reload(self.yaml_file)
+
     def reload(self, rule_file):
         """(Re)loads the rule yaml file.
+        The rules are only recompiled if the content of the file has changed.
         Args:
             rule_file: path to file.
+        Returns:
+            True if the rules were recompiled.
         """
+        stat = os.stat(rule_file)
+        with open(rule_file, 'rb') as f:
+            content = f.read()
+        file_hash = hashlib.sha256(content).hexdigest()
+        self.file_stat = (stat.st_mtime_ns, stat.st_size)
+        if rule_file == self.yaml_file and file_hash == self.file_hash:
+            return False
         self.yaml_file = rule_file
-        self.conf = yaml.load(open(rule_file, "r"))
+        self.conf = serialization.load(content)
+        self.templates = self.compile(self.conf)
+        self.file_hash = file_hash
+        self.logger.info('compiled rules for %d acls from %s', len(self.templates), rule_file)
+        return True
+
+    def compile(self, conf):
+        """Compiles the 'acls' of the rules file.
+        Args:
+            conf (dict): loaded rules file.
+        Returns:
+            {acl name: [(port acl name, [RuleTemplate, ...]), ...]}
+        """
+        templates = {}
+        for aclname, portacls in (conf.get('acls') or {}).items():
+            templates[aclname] = [(portacl, self._compile_rules(objs))
+                                  for portacl, objs in portacls.items()]
+        return templates
 
+    def _compile_rules(self, objs):
+        templates = []
+        for obj in objs:
+            if isinstance(obj, dict) and 'rule' in obj:
+                templates.append(RuleTemplate(obj['rule']))
+            elif isinstance(obj, list):
+                for y in obj:
+                    if isinstance(y, dict):
+                        # list of dicts
+                        for _, rule in list(y.items()):
+                            templates.append(RuleTemplate(rule))
+                    else:
+                        self.logger.warning('list of unrecognised objects')
+                        self.logger.warning('child type: %s' % type(y))
+                        self.logger.warning('list object: %s' % obj)
+            else:
+                self.logger.debug('obj is type %s', type(obj))
+        return templates
@@ -1,17 +1,20 @@
 """Handles the construction of the Faucet ACL configuration from the authentication application."""
 # pytype: disable=pyi-error
+import hashlib
 import logging
 import os
-import re
 import shutil
 import signal
 import sys
 import time
 # pytype: disable=pyi-error
-import yaml
-
 from gasket.rule_generator import RuleGenerator
 from gasket import auth_app_utils
+from gasket import serialization
+from gasket.backup_manager import BackupManager
+from gasket.session_store import SessionStore
+from gasket.session_journal import SessionJournal
+from gasket.reload_notifier import PollingReloadNotifier
 
 def main():
     """Create a default base config and the initial Faucet ACL yaml file,
@@ -32,8 +35,7 @@ def create_base_faucet_acls(input_f, output_f):
         input_f (str): input filename (base config)
         output_f (str): output filename (faucet-acl.yaml)
     """
-    with open(input_f) as f:
-        base = yaml.safe_load(f)
+    base = serialization.load_file(input_f)
     logging.basicConfig(filename='rule_man_base.log', level=logging.DEBUG)
     final = create_faucet_acls(base, logger=logging)
     write_yaml(final, output_f, True)
@@ -51,61 +53,56 @@ def create_faucet_acls(doc, logger):
     final_acls = final['acls']
 
     for acl_name, acl in list(doc['acls'].items()):
-        seq = []
-        for obj in acl:
-            if isinstance(obj, dict) and 'rule' in obj:
-                # rule
-                for _, rule in list(obj.items()):
-                    # TODO is this a pointless for loop? instead do rule = obj['rule']
-                    # TODO can thes ifs by made a function as reused?
-                    new_rule = {}
-                    new_rule['rule'] = rule
-                    if '_mac_' in rule:
-                        del rule['_mac_']
-                    if '_name_' in rule:
-                        del rule['_name_']
-                    seq.append(new_rule)
-            elif isinstance(obj, dict):
-                #alias
-                for name, l in list(obj.items()):
-                    for rule in l:
-                        r = rule['rule']
-                        if '_mac_' in r:
-                            del r['_mac_']
-                        if '_name_' in r:
-                            del r['_name_']
-                        seq.append(rule)
-            elif isinstance(obj, list):
-                for y in obj:
-                    if isinstance(y, dict):
-                        # list of dicts
-                        for _, rule in list(y.items()):
-                            new_rule = {}
-                            new_rule['rule'] = rule
-                            if '_mac_' in rule:
-                                del rule['_mac_']
-                            if '_name_' in rule:
-                                del rule['_name_']
-                            seq.append(new_rule)
-                    else:
-                        logger.warning('list of unrecognised objects')
-                        logger.warning('child type: %s' % type(y))
-                        logger.warning('list object: %s' % obj)
-            elif isinstance(obj, str):
-                # this is likey just a 'flag' used to mark position to insert the rules when authed
-                if obj == 'authed-rules':
-                    continue
+        final_acls[acl_name] = create_faucet_acl(acl, logger)
+    return final
+
+
+def create_faucet_acl(acl, logger):
+    """Creates the list of faucet rules for a single acl.
+    Args:
+        acl (list): the pre-faucet version of the acl (from the base config).
+    Returns: list of rules.
+    """
+    seq = []
+    for obj in acl:
+        if isinstance(obj, dict) and 'rule' in obj:
+            # rule
+            seq.append({'rule': _strip_rule(obj['rule'])})
+        elif isinstance(obj, dict):
+            #alias
+            for name, l in list(obj.items()):
+                for rule in l:
+                    seq.append({'rule': _strip_rule(rule['rule'])})
+        elif isinstance(obj, list):
+            for y in obj:
+                if isinstance(y, dict):
+                    # list of dicts
+                    for _, rule in list(y.items()):
+                        seq.append({'rule': _strip_rule(rule)})
                 else:
-                    logger.warning('illegal string %s', obj)
+                    logger.warning('list of unrecognised objects')
+                    logger.warning('child type: %s' % type(y))
+                    logger.warning('list object: %s' % obj)
+        elif isinstance(obj, str):
+            # this is likey just a 'flag' used to mark position to insert the rules when authed
+            if obj == 'authed-rules':
+                continue
             else:
-                logger.warning('Object type %s not recognised', type(obj))
-                logger.warning('Object: %s', obj)
+                logger.warning('illegal string %s', obj)
+        else:
+            logger.warning('Object type %s not recognised', type(obj))
+            logger.warning('Object: %s', obj)
+    return seq
 
-        final_acls[acl_name] = seq
-    return final
+
+def _strip_rule(rule):
+    """Returns a copy of rule without the gasket only keys ('_mac_' & '_name_').
+    The rule itself is not modified, as it is still part of the base config.
+    """
+    return {k: v for k, v in rule.items() if k not in ('_mac_', '_name_')}
 
 
-def write_yaml(yml, filename, ignore_aliases=False):
+def write_yaml(yml, filename, ignore_aliases=False, fmt='yaml'):
     """Writes a yaml object to file.
     Args:
         yml (yaml): yaml object to write to file.
@@ -113,15 +110,10 @@ def write_yaml(yml, filename, ignore_aliases=False):
         ignore_aliases (bool): True if yaml aliases should be removed
                                 and object written out in full.
                                 False if aliases can be used.
+        fmt (str): 'yaml' or 'json' (which faucet can also read).
     """
-    if ignore_aliases:
-        noalias_dumper = yaml.dumper.SafeDumper
-        noalias_dumper.ignore_aliases = lambda self, data: True
-        with open(filename, 'w') as f:
-            yaml.dump(yml, f, default_flow_style=False, Dumper=noalias_dumper)
-    else:
-        with open(filename, 'w') as f:
-            yaml.dump(yml, f, default_flow_style=False)
+    with open(filename, 'w') as f:
+        f.write(serialization.dump(yml, ignore_aliases, fmt))
 
 
 class RuleManager(object):
@@ -130,57 +122,447 @@ class RuleManager(object):
     """
 
     logger = None
+    metrics = None
 
-    def __init__(self, config, logger):
+    def __init__(self, config, logger, metrics=None, prom_client=None, reload_notifier=None):
+        """
+        Args:
+            config (AuthConfig)
+            logger (logging.Logger)
+            metrics (AuthAppMetrics): optional.
+            prom_client (PrometheusClient): optional. client of faucet's prometheus to share.
+            reload_notifier (ReloadNotifier): optional. how to find out faucet has reloaded.
+                Defaults to polling faucet's prometheus.
+        """
         self.config = config
         self.logger = logger
+        self.metrics = metrics
+        if prom_client is None:
+            prom_client = auth_app_utils.PrometheusClient(self.config.prom_url,
+                                                          self.config.prom_connect_timeout,
+                                                          self.config.prom_read_timeout,
+                                                          self.config.prom_compression)
+        self.prom_client = prom_client
+        if reload_notifier is None:
+            reload_notifier = PollingReloadNotifier(self.prom_client, self.logger,
+                                                    timeout=self.config.reload_timeout,
+                                                    min_interval=self.config.reload_poll_min,
+                                                    max_interval=self.config.reload_poll_max,
+                                                    metrics=self.metrics)
+        self.reload_notifier = reload_notifier
         self.rule_gen = RuleGenerator(self.config.rules, self.logger)
+        self.backups = BackupManager(self.logger,
+                                     max_count=self.config.backup_max_count,
+                                     max_age=self.config.backup_max_age,
+                                     compress=self.config.backup_compress)
         self.base_filename = self.config.base_filename
         self.faucet_acl_filename = self.config.acl_config_file
+        # if set each port acl is written to its own file in this directory,
+        # and faucet_acl_filename just includes them.
+        self.faucet_acl_dir = self.config.acl_config_dir
+
+        # the authenticated (username, mac, dp, port) sessions.
+        self.sessions = SessionStore()
+
+        # The base config is loaded once, and from then on this in memory copy is authoritative.
+        # The base file is only ever written as a rendering of it.
+        self.base = None
+        self.base_orig = None
+        self.base_changed = False
+        # indexes of the 'aauth' entries in base.
+        self.aauth_macs = {} # {_mac_: set(aauth names)}
+        self.aauth_names = {} # {_name_: set(aauth names)}
+        self.aauth_port_acls = {} # {aauth name: set(port acl names that reference it)}
+        # port acls that have changed since they were last written (when using faucet_acl_dir).
+        self.changed_acls = set()
+        # Each config faucet loads is a generation. If faucet rejects a config the changes since
+        # the last generation are undone, and the faucet acl files of that generation restored.
+        self.generation = 0
+        # closures that undo the changes made since the last commit. None while rolling back.
+        self.undo_log = []
+        # descriptions of the changes made since the last commit.
+        self.pending_changes = []
+        # content of the faucet acl files as of the last generation. {filename: str or None}
+        self.last_good_files = {}
+        # faucet acl files written since the last generation. {filename: str}
+        self.pending_files = {}
+        # True if the last commit was rejected by faucet (and rolled back).
+        self.rolled_back = False
+        self.last_rejected_changes = []
+        # sha256 of the content of the files gasket has written (or found on first write).
+        # files are not rewritten if their content has not changed. {filename: hexdigest or None}
+        self.file_hashes = {}
+        # if used the sessions are journaled, and the base file is only written on compaction.
+        self.journal = None
+        if self.config.journal_file:
+            self.journal = SessionJournal(self.config.journal_file, self.logger,
+                                          compact_after=self.config.journal_compact_after,
+                                          fsync=self.config.journal_fsync)
+        self.load_base()
+
+    def load_base(self):
+        """Loads the base config file into memory, and indexes the authenticated rules ('aauth').
+        If the session journal is used the base starts from the original (no one authenticated)
+        base file, and the sessions are replayed from the journal.
+        """
+        filename = self.base_filename
+        if self.journal and os.path.exists(self.base_filename + '-orig'):
+            filename = self.base_filename + '-orig'
+        self.base = serialization.load_file(filename)
+        if not self.base.get('aauth'):
+            self.base['aauth'] = {}
+        self.base_changed = False
+        # write every acl (and the include file) on the first commit.
+        self.changed_acls = set(self.base['acls'])
+
+        self.aauth_macs = {}
+        self.aauth_names = {}
+        self.aauth_port_acls = {}
+        for aauth_name, acllist in self.base['aauth'].items():
+            self._index_aauth(aauth_name, acllist)
+        for port_acl_name, port_acl in self.base['acls'].items():
+            for item in port_acl:
+                if isinstance(item, dict):
+                    for aauth_name in item:
+                        if aauth_name in self.base['aauth']:
+                            self.aauth_port_acls.setdefault(aauth_name, set()).add(port_acl_name)
+        if self.journal:
+            self.replay_journal()
+
+    def replay_journal(self):
+        """Restores the sessions (and their rules) recorded in the session journal."""
+        for session, rules in self.journal.replay().items():
+            self.sessions.add(*session)
+            self.add_to_base_acls(rules, session.username, session.mac)
+        # the faucet acls written before the restart already include them.
+        self.base_changed = False
+        self.undo_log = []
+
+    def _index_aauth(self, aauth_name, acllist):
+        for r in acllist:
+            rule = r['rule']
+            if '_mac_' in rule:
+                self.aauth_macs.setdefault(rule['_mac_'], set()).add(aauth_name)
+            if '_name_' in rule:
+                self.aauth_names.setdefault(rule['_name_'], set()).add(aauth_name)
+
+    def _unindex_aauth(self, aauth_name, acllist):
+        for r in acllist:
+            rule = r['rule']
+            for index, key in ((self.aauth_macs, '_mac_'), (self.aauth_names, '_name_')):
+                if key in rule and rule[key] in index:
+                    index[rule[key]].discard(aauth_name)
+                    if not index[rule[key]]:
+                        del index[rule[key]]
+
+    def _remove_aauth(self, aauth_name):
+        """Removes the aauth entry and all references to it in the port acls.
+        Args:
+            aauth_name (str): name of the aauth entry.
+        """
+        acllist = self.base['aauth'].pop(aauth_name)
+        self._unindex_aauth(aauth_name, acllist)
+        removed_from = []
+        for port_acl_name in self.aauth_port_acls.pop(aauth_name, ()):
+            port_acl = self.base['acls'].get(port_acl_name, [])
+            for i, item in enumerate(port_acl):
+                if isinstance(item, dict) and aauth_name in item:
+                    del port_acl[i]
+                    removed_from.append((port_acl_name, port_acl, i, item))
+                    break
+            self.changed_acls.add(port_acl_name)
+        self.base_changed = True
+        self._undo(lambda: self._restore_aauth(aauth_name, acllist, removed_from))
+
+    def _restore_aauth(self, aauth_name, acllist, removed_from):
+        """Undoes _remove_aauth()."""
+        self.base['aauth'][aauth_name] = acllist
+        self._index_aauth(aauth_name, acllist)
+        port_acls = self.aauth_port_acls.setdefault(aauth_name, set())
+        for port_acl_name, port_acl, i, item in reversed(removed_from):
+            port_acl.insert(i, item)
+            port_acls.add(port_acl_name)
+            self.changed_acls.add(port_acl_name)
+
+    def _undo(self, undo):
+        """Records how to undo a change, in case faucet rejects the config.
+        Args:
+            undo (callable): reverts the change.
+        """
+        if self.undo_log is not None:
+            self.undo_log.append(undo)
+
+    def _remove_session(self, session):
+        """Removes a session from the session store (and journal)."""
+        if self.sessions.remove(session):
+            self._sessions_removed([session])
+
+    def _sessions_removed(self, removed):
+        """Journals the sessions that have been removed from the session store.
+        Args:
+            removed (list of Session)
+        """
+        for session in removed:
+            rules = None
+            if self.journal:
+                rules = self.journal.live.get(session)
+                self.journal.remove(session)
+            self._undo(lambda session=session, rules=rules: self._restore_session(session, rules))
+
+    def _restore_session(self, session, rules):
+        """Undoes the removal of a session."""
+        self.sessions.add(*session)
+        if self.journal and rules is not None:
+            self.journal.add(session, rules)
+
+    def commit(self):
+        """Writes the base config and the faucet acl file if they have been changed
+        since the last commit, and signals faucet to reload.
+        Returns:
+            True if there was nothing to commit or faucet reloads. False otherwise.
+        """
+        self.rolled_back = False
+        if not self.base_changed:
+            self.logger.debug('nothing to commit')
+            if self.metrics:
+                self.metrics.commits_skipped.inc()
+            return True
+        self.base_changed = False
+
+        if self.journal:
+            # the base can be rebuilt from the journal, so is only written when compacting.
+            self.journal.sync()
+            if self.journal.needs_compaction():
+                self.journal.compact()
+                self.write_base(backup=False)
+        else:
+            self.write_base()
+        # update faucet
+        if not self.write_faucet_acls():
+            # e.g. rules that net to the same faucet config, or resetting an already clean port.
+            self.logger.info('faucet acls are unchanged. not reloading faucet')
+            if self.metrics:
+                self.metrics.commits_skipped.inc()
+            self.undo_log = []
+            self.pending_changes = []
+            return True
+        if self.reload_faucet():
+            self._new_generation()
+            return True
+        if self.reload_notifier.last_load_error:
+            self.rollback()
+        else:
+            # faucet may not be running, the config is kept as it has not been rejected.
+            self._new_generation()
+        return False
+
+    def _new_generation(self):
+        """Makes the config just written the last good generation."""
+        self.generation += 1
+        self.last_good_files.update(self.pending_files)
+        self.pending_files = {}
+        self.undo_log = []
+        self.pending_changes = []
+        if self.metrics:
+            self.metrics.config_generation.set(self.generation)
+        self.logger.info('config generation %d', self.generation)
+
+    def rollback(self):
+        """Undoes the changes since the last generation, restores the faucet acl files of it,
+        and signals faucet to reload them.
+        Each rejected file is kept as filename.rejected.
+        Returns:
+            True if faucet reloaded the last good generation.
+        """
+        start = time.time()
+        self.rolled_back = True
+        self.last_rejected_changes = self.pending_changes
+        self.logger.error('faucet rejected config generation %d. rolling back to generation %d. changes: %s',
+                          self.generation + 1, self.generation, '; '.join(self.pending_changes))
+        undo_log, self.undo_log = self.undo_log, None
+        for undo in reversed(undo_log):
+            undo()
+        self.undo_log = []
+        self.pending_changes = []
+        if self.journal:
+            self.journal.sync()
+
+        for filename, content in self.pending_files.items():
+            with open(filename + '.rejected', 'w') as f:
+                f.write(content)
+            last_good = self.last_good_files.get(filename)
+            if last_good is None:
+                # did not exist in the last generation.
+                os.remove(filename)
+                self.file_hashes[filename] = None
+                continue
+            self._write_file(filename, last_good, backup=False)
+        self.pending_files = {}
+        self.changed_acls = set()
+        self.base_changed = False
+        if not self.journal:
+            self.write_base(backup=False)
+
+        success = self.reload_faucet()
+        if self.metrics:
+            self.metrics.config_rollbacks.inc()
+            self.metrics.config_rollback_latency.observe(time.time() - start)
+        if success:
+            self.logger.info('rolled back to generation %d in %.3f seconds', self.generation, time.time() - start)
+        else:
+            self.logger.error('faucet did not reload generation %d after rolling back', self.generation)
+        return success
+
+    def write_base(self, backup=True):
+        """Writes the in memory base config back to the base file.
+        Args:
+            backup (bool): True to keep a backup of the previous base file.
+        """
+        if self._write_file(self.base_filename, serialization.dump(self.base), backup):
+            self.logger.info('updated base')
+
+    @staticmethod
+    def _hash(content):
+        return hashlib.sha256(content.encode()).hexdigest()
+
+    def _file_hash(self, filename):
+        """Returns the hash of the content of filename (as last written). None if it does not exist."""
+        if filename not in self.file_hashes:
+            self.file_hashes[filename] = None
+            if os.path.exists(filename):
+                with open(filename) as f:
+                    self.file_hashes[filename] = self._hash(f.read())
+        return self.file_hashes[filename]
+
+    def _write_file(self, filename, content, backup=True):
+        """Atomically replaces the content of filename (keeping a backup of the previous),
+        unless the content is unchanged.
+        Returns:
+            True if the file was written.
+        """
+        content_hash = self._hash(content)
+        if content_hash == self._file_hash(filename):
+            self.logger.debug('%s is unchanged', filename)
+            return False
+        with open(filename + '.tmp', 'w') as f:
+            f.write(content)
+        if backup:
+            self.backup_file(filename)
+        self.swap_temp_file(filename)
+        self.file_hashes[filename] = content_hash
+        return True
+
+    def write_faucet_acls(self):
+        """Writes the faucet acl file from the base config.
+        If faucet_acl_dir is used only the port acl files that have changed are written.
+        Files whose content is unchanged are not rewritten.
+        Returns:
+            True if any file was written.
+        """
+        if not self.faucet_acl_dir:
+            final = create_faucet_acls(self.base, self.logger)
+            self.changed_acls = set()
+            return self._write_faucet_file(self.faucet_acl_filename, final)
+
+        if not os.path.isdir(self.faucet_acl_dir):
+            os.makedirs(self.faucet_acl_dir)
+        write_include = False
+        written = False
+        for acl_name in sorted(self.changed_acls):
+            if acl_name not in self.base['acls']:
+                continue
+            filename = self.acl_filename(acl_name)
+            if not os.path.exists(filename):
+                write_include = True
+            final = {'acls': {acl_name: create_faucet_acl(self.base['acls'][acl_name], self.logger)}}
+            if self._write_faucet_file(filename, final):
+                written = True
+                self.logger.debug('wrote acl file %s', filename)
+        self.changed_acls = set()
+
+        if write_include or not os.path.exists(self.faucet_acl_filename):
+            include = {'include': [self.acl_filename(acl_name) for acl_name in sorted(self.base['acls'])]}
+            if self._write_faucet_file(self.faucet_acl_filename, include):
+                written = True
+        return written
+
+    def _write_faucet_file(self, filename, yml):
+        """Writes (and backs up) a faucet acl file if it has changed, remembering its content for rollback.
+        Args:
+            filename (str)
+            yml (yaml): yaml object to write to file.
+        Returns:
+            True if the file was written.
+        """
+        content = serialization.dump(yml, True, self.config.acl_format)
+        if filename not in self.last_good_files:
+            # the file as it was before gasket first wrote it is taken as the last good.
+            self.last_good_files[filename] = None
+            if os.path.exists(filename):
+                with open(filename) as f:
+                    self.last_good_files[filename] = f.read()
+                self.file_hashes[filename] = self._hash(self.last_good_files[filename])
+        if not self._write_file(filename, content):
+            return False
+        self.pending_files[filename] = content
+        return True
 
-        # TODO do we want to use another datastructure? and keep more data in memory.
-        self.authed_users = {} # {mike: {aa:aa:aa:aa:aa:aa: {faucet-1: {p1: 1. p2: 1}}}}
+    def acl_filename(self, acl_name):
+        """Returns the name of the file that the port acl acl_name is written to.
+        Args:
+            acl_name (str): name of port acl.
+        """
+        return os.path.join(self.faucet_acl_dir, acl_name.replace(os.sep, '_') + '.yaml')
 
-    def add_to_base_acls(self, filename, rules, user, mac):
-        '''Adds rules to the base acl file (and writes).
+    def reload_faucet(self):
+        """Sends faucet a SIGHUP, and waits for it to reload the config.
+        Returns:
+            True if faucet reloaded the config within the reload timeout. False otherwise.
+        """
+        start_count = self.get_faucet_reload_count()
+        self.send_signal(signal.SIGHUP)
+        self.prom_client.invalidate()
+        self.logger.info('signal sent.')
+        return self.reload_notifier.wait_for_reload(start_count)
+
+    def add_to_base_acls(self, rules, user, mac):
+        '''Adds rules to the base acl config.
         Args:
-            filename (str);
             rules (dict): {port_s1_1 : list of rules}
             user (str): username
+            mac (str): MAC address
         '''
-        with open(filename) as f:
-            base = yaml.safe_load(f)
         # somehow add the rules to the base where ideally the items in the acl are the pointers.
         # but guess it might not matter, just hurts readability.
 
         # this is NOT a spelling mistake. this ensures that the auth rules are defined before
         # the use in the port acl.
         # and that the port acl will have the pointer. At the end of the day it doesn't matter.
-        if 'aauth' not in base:
-            base['aauth'] = {}
-
         for aclname, acllist in list(rules.items()):
-            self.logger.debug('base %s', base)
             self.logger.debug("aclname: %s user: %s mac:%s", aclname, user, mac)
-            base['aauth'][aclname + user + mac] = acllist
-            base_acl = base['acls'][aclname]
+            aauth_name = aclname + user + mac
+            if aauth_name in self.base['aauth']:
+                # replace rather than reference the same rules twice.
+                self._remove_aauth(aauth_name)
+            self.base['aauth'][aauth_name] = acllist
+            self._index_aauth(aauth_name, acllist)
+            base_acl = self.base['acls'][aclname]
             i = base_acl.index('authed-rules')
             # insert rules above the authed-rules 'flag'. Add 1 for below it.
             # this may not be included as the reference. but instead inserting each.
-            base_acl[i:i] = [{aclname + user + mac: acllist}]
-
-        # 'rotate' filename - filename.bak, filename.bak.1 this is primiarily for logging,
-        # to see how users affect the config.
-
-        # write back to filename
-        write_yaml(base, filename + '.tmp')
-        self.backup_file(filename)
-        self.logger.warn('backed up base')
-        self.swap_temp_file(filename)
-        self.logger.warn('swapped tmp for base')
-        return base
+            base_acl[i:i] = [{aauth_name: acllist}]
+            self.aauth_port_acls.setdefault(aauth_name, set()).add(aclname)
+            self.changed_acls.add(aclname)
+            self._undo(lambda aauth_name=aauth_name: self._remove_aauth(aauth_name))
+        self.base_changed = True
+
+    def get_rules(self, username, mac, switch, port, acl_list):
+        """Returns:
+            the rules for the user authenticated on switch and port (see RuleGenerator.get_rules).
+        """
+        return self.rule_gen.get_rules(username, 'port_' + switch + '_' + str(port), mac, acl_list)
 
-    def authenticate(self, username, mac, switch, port, acl_list):
+    def authenticate(self, username, mac, switch, port, acl_list, commit=True, rules=None):
         """Authenticates a username and MAC address on a switch and port.
         Args:
             username (str)
@@ -188,39 +570,32 @@ class RuleManager(object):
             switch (str): Switch that authentication occured on
             port (str): the 'access port' as configured in 'auth.yaml'
             acl_list (list of str): names of acls (in order of highest priority to lowest) to be applied.
+            commit (bool): True to write the config and reload faucet now.
+                False to only stage the change until commit() is called.
+            rules (dict): optional. the rules from get_rules(), if they have already been generated.
         Returns:
-            True if rules are found and faucet reloads or already authenticated. False otherwise.
+            True if rules are found and faucet reloads (or the change is staged)
+            or already authenticated. False otherwise.
         """
-        self.logger.debug('authenticate  authed_users')
-        self.logger.debug(self.authed_users)
+        self.logger.debug('authenticate. %d sessions', len(self.sessions))
         # get rules to apply
         if not self.is_authenticated(mac, username, switch, port):
-            self.add_to_authed_dict(username, mac, switch, port)
-            rules = self.rule_gen.get_rules(username, 'port_' + switch + '_' + str(port), mac, acl_list)
+            session = self.sessions.add(username, mac, switch, port)
+            self._undo(lambda: self._remove_session(session))
+            self.pending_changes.append('authenticate user: %s mac: %s on %s port %s acls: %s' %
+                                        (username, mac, switch, port, acl_list))
+            if rules is None:
+                rules = self.get_rules(username, mac, switch, port, acl_list)
             if rules is None:
                 self.logger.warn('cannot authenticate user: %s, mac: %s no rules found.',
                                  username, mac)
                 return False
             # update base
-            base = self.add_to_base_acls(self.base_filename, rules, username, mac)
-            # update faucet
-            final = create_faucet_acls(base, self.logger)
-            write_yaml(final, self.faucet_acl_filename + '.tmp', True)
-            self.backup_file(self.faucet_acl_filename)
-            self.swap_temp_file(self.faucet_acl_filename)
-            # sighup.
-            start_count = self.get_faucet_reload_count()
-            self.send_signal(signal.SIGHUP)
-            self.logger.info('auth signal sent.')
-            for i in range(400):
-                end_count = self.get_faucet_reload_count()
-                if end_count > start_count:
-                    self.logger.info('auth - faucet has reloaded.')
-                    return True
-                time.sleep(0.05)
-                self.logger.info('auth - waiting for faucet to process sighup config reload. %d', i)
-            self.logger.error('auth - faucet did not process sighup within 20 seconds. 0.05 * 400')
-            return False
+            self.add_to_base_acls(rules, username, mac)
+            if self.journal:
+                self.journal.add(session, rules)
+            if commit:
+                return self.commit()
         return True
 
     def get_faucet_reload_count(self):
@@ -228,11 +603,7 @@ class RuleManager(object):
         Returns:
             number of times faucet has reloaded
         """
-        txt = auth_app_utils.scrape_prometheus(self.config.prom_url)
-        for l in txt.splitlines():
-            if l.startswith('faucet_config_reload_requests'):
-                return int(float(l.split()[1]))
-        return 0
+        return self.reload_notifier.reload_count()
 
     def remove_from_base(self, username, mac):
         """Removes rules that have matching mac= _mac_ and username=_name_
@@ -241,121 +612,74 @@ class RuleManager(object):
         Args:
             username (str)
             mac (str): MAC address
+        Returns:
+            True if anything was removed.
         """
-        with open(self.base_filename) as f:
-            base = yaml.safe_load(f)
+        # only the aauth entries that contain the mac or name can possibly match.
+        candidates = set(self.aauth_macs.get(mac, ()))
+        if username is not None:
+            candidates.update(self.aauth_names.get(username, ()))
 
-        self.logger.info(base)
         remove = []
-
-        if 'aauth' in base:
-            for acl in list(base['aauth'].keys()):
-                self.logger.debug('aauth acl')
-                self.logger.debug(acl)
-                for  r in base['aauth'][acl]:
-                    rule = r['rule']
-                    if '_mac_' in rule and '_name_' in rule:
-                        self.logger.debug('mac and name exist')
-                        if mac == rule['_mac_'] and \
-                                (username is None or \
-                                username == rule['_name_']):
-                            self.logger.debug('removing based on name and mac')
-                            remove.append(acl)
-                            break
-                    elif '_mac_' in rule and mac == rule['_mac_']:
-                        self.logger.debug('removing based on mac')
-                        remove.append(acl)
-                        break
-                    elif '_name_' in rule and username == rule['_name_']:
-                        self.logger.warning('removing based on name')
+        for acl in candidates:
+            self.logger.debug('aauth acl')
+            self.logger.debug(acl)
+            for r in self.base['aauth'][acl]:
+                rule = r['rule']
+                if '_mac_' in rule and '_name_' in rule:
+                    self.logger.debug('mac and name exist')
+                    if mac == rule['_mac_'] and \
+                            (username is None or \
+                            username == rule['_name_']):
+                        self.logger.debug('removing based on name and mac')
                         remove.append(acl)
                         break
+                elif '_mac_' in rule and mac == rule['_mac_']:
+                    self.logger.debug('removing based on mac')
+                    remove.append(acl)
+                    break
+                elif '_name_' in rule and username == rule['_name_']:
+                    self.logger.warning('removing based on name')
+                    remove.append(acl)
+                    break
         self.logger.info('remove from auth')
         self.logger.info(remove)
-        removed = False
         for aclname in remove:
-            del base['aauth'][aclname]
-            removed = True
-
-            for port_acl_name, port_acl_list in list(base['acls'].items()):
-                for item in port_acl_list:
-                    if isinstance(item, dict):
-                        if aclname in item:
-                            try:
-                                base['acls'][port_acl_name].remove(item)
-                                removed = True
-                            except Exception as e:
-                                self.logger.exception(e)
-
-        if removed:
-            # only need to write it back if something has actually changed.
-            write_yaml(base, self.base_filename + '.tmp')
-            self.backup_file(self.base_filename)
-            self.swap_temp_file(self.base_filename)
-
-        self.logger.info('updated base')
-        self.logger.info(base)
-        return base, removed
-
-    def deauthenticate(self, username, mac):
+            self._remove_aauth(aclname)
+        return len(remove) > 0
+
+    def deauthenticate(self, username, mac, commit=True):
         """Deauthenticates a username or MAC address.
         Args:
             username (str): may be None or '(null)' which is treated as None.
             mac (str): MAC address
+            commit (bool): True to write the config and reload faucet now.
+                False to only stage the change until commit() is called.
         Returns:
             True if a client that is authed has rules removed, or if client is not authed.
             other wise false (faucet fails to reload)
         """
-        self.logger.debug('deauthenticate  authed_users')
-        self.logger.debug(self.authed_users)
+        self.logger.debug('deauthenticate. %d sessions', len(self.sessions))
 
         if self.is_authenticated(mac, username):
             self.logger.info('user: {} mac: {} already authenticated removing'.format(username, mac))
-            self.remove_from_authed_dict(username, mac)
+            self._sessions_removed(self.sessions.remove_mac(mac, username))
+            self.pending_changes.append('deauthenticate user: %s mac: %s' % (username, mac))
             # update base
-            base, changed = self.remove_from_base(username, mac)
+            changed = self.remove_from_base(username, mac)
             # update faucet only if config has changed
-            if changed:
+            if changed and commit:
                 self.logger.info('base has changed. removing from faucet')
-                final = create_faucet_acls(base, self.logger)
-                write_yaml(final, self.faucet_acl_filename + '.tmp', True)
-
-                self.backup_file(self.faucet_acl_filename)
-                self.swap_temp_file(self.faucet_acl_filename)
-                # sighup.
-                start_count = self.get_faucet_reload_count()
-                self.send_signal(signal.SIGHUP)
-                self.logger.info('deauth signal sent')
-                for i in range(400):
-                    end_count = self.get_faucet_reload_count()
-                    if end_count > start_count:
-                        self.logger.info('deauth - faucet has reloaded.')
-                        return True
-                    time.sleep(0.05)
-                    self.logger.info('deauth - waiting for faucet to process sighup config reload on. %d', i)
-                self.logger.error('deauth - faucet did not process sighup within 400 * 0.05 seconds.')
-                return False
+                return self.commit()
         return True
 
-    @staticmethod
-    def backup_file(filename):
+    def backup_file(self, filename):
         """Backup a file. appends '.bak#' to filename.
+        Older backups are removed as configured by the backup retention policy.
         Args:
             filename (str)
         """
-        directory = os.path.dirname(filename)
-        if directory == '':
-            directory = '.'
-
-        filenames = ''.join(os.listdir(directory))
-        search_str = os.path.basename(filename) + '.bak'
-
-        matches = re.findall(search_str, filenames)
-
-        i = str(len(matches) + 1)
-
-        # backup old current
-        shutil.copy2(filename, filename + '.bak' + i)
+        self.backups.backup(filename)
 
     @staticmethod
     def swap_temp_file(filename):
@@ -363,9 +687,8 @@ class RuleManager(object):
         Args:
             filename (str)
         """
-        os.remove(filename)
-        # make new tmp the current.
-        os.rename(filename + '.tmp', filename)
+        # make new tmp the current. (atomically so faucet never sees a missing or partial file).
+        os.replace(filename + '.tmp', filename)
 
     def send_signal(self, signal_type):
         ''' Send a signal to the controller to indicate a change in config file
@@ -386,129 +709,14 @@ class RuleManager(object):
         Returns:
             True if already authenticated. False otherwise.
         '''
-        # TODO There might be a bug in here where passed the mac and username, but not the switch and port.
-        #  this will always return false.
-        # {mike: {aa:aa:aa:aa:aa:aa: {faucet-1: {p1: 1. p2: 1}}}}
-        if username and username != '(null)':
-            if username in self.authed_users:
-                if mac in self.authed_users[username]:
-                    if switch in self.authed_users[username][mac]:
-                        if port in self.authed_users[username][mac][switch]:
-                            return True
-        else:
-            for user, dic in list(self.authed_users.items()):
-                if mac in list(dic):
-                    return True
-        return False
+        return self.sessions.is_authenticated(mac, username, switch, port)
 
-    def add_to_authed_dict(self, username, mac, switch, port):
-        """Add an authenticted user, ... to the authed_users dictionary
-        Args:
-            username (str)
-            mac (str): MAC address.
-            switch (str): the name of the switch username has authenticated on.
-            port (str): the port the username has authenticated on.
-        """
-        if username not in self.authed_users:
-            self.authed_users[username] = {}
-            self.authed_users[username][mac] = {}
-            self.authed_users[username][mac][switch] = {}
-            self.authed_users[username][mac][switch][port] = 1
-        else:
-            if mac not in self.authed_users[username]:
-                self.authed_users[username][mac] = {}
-                self.authed_users[username][mac][switch] = {}
-                self.authed_users[username][mac][switch][port] = 1
-            else:
-                if switch not in self.authed_users[username][mac]:
-                    self.authed_users[username][mac][switch] = {}
-                    self.authed_users[username][mac][switch][port] = 1
-                else:
-                    if port not in self.authed_users[username][mac][switch]:
-                        self.authed_users[username][mac][switch][port] = 1
-
-    def remove_all_from_authed_dict(self, dp_name, port_num):
-        """Removes all users that are on coressponding dp and port.
-        Args:
-            dp_name (str): name of datapath.
-            port_num (int): port number
-        """
-# {mike: {aa:aa:aa:aa:aa:aa: {faucet-1: {p1: 1. p2: 1}}}}
-        deletes = []
-        removed_macs = []
-        for user, mac_d in self.authed_users.items():
-            macs_counter = len(mac_d)
-            for mac, dp_d in mac_d.items():
-                # TODO if user is authed on multiple ports dont delete the mac/user
-                #  if there are not on multiple ports delete user.
-
-                # if only one port and it is going to be removed, remove switch also.
-                # if no siwtches remove user, remove mac.
-                dp_counter = len(dp_d)
-                for dp_n, port_d in dp_d.items():
-                    if dp_n == dp_name:
-                        port_counter = len(port_d)
-                        for port, _ in port_d.items():
-                            if port == port_num:
-                                port_counter -= 1
-                                deletes.append((user, mac, dp_n, port))
-                                removed_macs.append(mac)
-                                break
-                                # we can remove this.
-                        if port_counter == 0:
-                            # port_d can be removed.
-                            dp_counter -= 1
-                            deletes.append((user, mac, dp_n))
-                if dp_counter == 0:
-                    #dp_d can be removed
-                    macs_counter -= 1
-                    deletes.append((user, mac))
-            if macs_counter == 0:
-                deletes.append((user,))
-
-        for delete in deletes:
-            if len(delete) == 1:
-                # user can be deleted
-                del self.authed_users[delete[0]]
-            elif len(delete) == 2:
-                # mac can be deleted
-                del self.authed_users[delete[0]][delete[1]]
-            elif len(delete) == 3:
-                # dp can be deleted
-                del self.authed_users[delete[0]][delete[1]][delete[2]]
-            elif len(delete) == 4:
-                # port can be deleted
-                del self.authed_users[delete[0]][delete[1]][delete[2]][delete[3]]
-            else:
-                self.logger.warning('drm no supported length %s %d', str(delet), len(delet))
-        return removed_macs
-
-    def remove_from_authed_dict(self, username, mac):
-        """Remove the mac from the authed_users dictionary.
-        If username is None or '(null)' as is the case with some deauthentications,
-        the mac is removed regardless of the user.
-        Args:
-            username (str): may be None or '(null)'.
-            mac (str): MAC address,
-        """
-        if username and username != '(null)':
-            if username in self.authed_users:
-                self.logger.info('removing user %s' % username)
-                del self.authed_users[username][mac]
-        else:
-            remove_users = []
-            for user, usermac in list(self.authed_users.items()):
-                if mac in usermac:
-                    remove_users.append(user)
-            for user in remove_users:
-                self.logger.info('removing mac %s. wildcard user' % mac)
-                del self.authed_users[user][mac]
-
-    def reset_port_acl(self, dp_name, port_num):
+    def reset_port_acl(self, dp_name, port_num, commit=True):
         """Reset the port acl back to the original state (where nothing is authenticated)
         Args:
             dp_name (str): name of datapath.
             port_num (int): port number.
+            commit (bool): False to leave the change staged for a later commit().
         Returns:
             list of MAC addresses (str) that were on the port.
         """
@@ -516,7 +724,7 @@ class RuleManager(object):
         # find the acl name for that port.
         acl_name = ""
         removed_macs = []
-        data = yaml.load(open(self.config.faucet_config_file, 'r'))
+        data = serialization.load_file(self.config.faucet_config_file)
         if dp_name in data['dps']:
             self.logger.debug('found dp_name: %s in dps', dp_name)
             if port_num in data['dps'][dp_name]['interfaces']:
@@ -525,38 +733,35 @@ class RuleManager(object):
                     self.logger.debug('can rewrite acl')
                     acl_name = data['dps'][dp_name]['interfaces'][port_num]['acl_in']
                     # find the acl for acl_name in base-original.
-                    orig = yaml.load(open(self.config.base_filename + '-orig', 'r'))
-                    orig_acl = orig['acls'][acl_name]
+                    if self.base_orig is None:
+                        self.base_orig = serialization.load_file(self.config.base_filename + '-orig')
+                    orig_acl = self.base_orig['acls'][acl_name]
+                    # the aauth entries only referenced by this acl are no longer needed.
+                    for item in self.base['acls'][acl_name]:
+                        if isinstance(item, dict):
+                            for aauth_name in item:
+                                port_acls = self.aauth_port_acls.get(aauth_name, set())
+                                if acl_name in port_acls:
+                                    port_acls.discard(acl_name)
+                                    self._undo(lambda aauth_name=aauth_name: self.aauth_port_acls.setdefault(
+                                        aauth_name, set()).add(acl_name))
+                                if not port_acls and aauth_name in self.base['aauth']:
+                                    self._remove_aauth(aauth_name)
                     # copy the original acl over to the current base.
-                    base = yaml.load(open(self.config.base_filename, 'r'))
-
-                    base['acls'][acl_name] = orig_acl
-
-                    final = create_faucet_acls(base, self.logger)
-                    write_yaml(final, self.faucet_acl_filename + '.tmp', True)
-                    self.backup_file(self.faucet_acl_filename)
-                    self.swap_temp_file(self.faucet_acl_filename)
-
-                    removed_macs = self.remove_all_from_authed_dict(dp_name, port_num)
-
-                    write_yaml(base, self.base_filename + '.tmp')
-                    self.backup_file(self.base_filename)
-                    self.swap_temp_file(self.base_filename)
-
-                    # sighup.
-                    start_count = self.get_faucet_reload_count()
-                    self.send_signal(signal.SIGHUP)
-                    self.logger.info('reset acl signal sent.')
-                    for i in range(400):
-                        end_count = self.get_faucet_reload_count()
-                        if end_count > start_count:
-                            self.logger.info('reset acl - faucet has reloaded.')
-                            return removed_macs
-                        time.sleep(0.05)
-                        self.logger.info('reset - waiting for faucet to process sighup config reload. %d', i)
-                    self.logger.error('reset - faucet did not process sighup within 20 seconds. 0.05 * 400')
-
-                    # send signal.
+                    acl = self.base['acls'][acl_name]
+                    self.base['acls'][acl_name] = list(orig_acl)
+                    self._undo(lambda: self.base['acls'].__setitem__(acl_name, acl))
+                    self.changed_acls.add(acl_name)
+                    self.base_changed = True
+
+                    removed = self.sessions.remove_port(dp_name, port_num)
+                    self._sessions_removed(removed)
+                    removed_macs = [session.mac for session in removed]
+                    self.pending_changes.append('reset port acl %s (%s port %s)' % (acl_name, dp_name, port_num))
+
+                    self.logger.info('reset acl %s', acl_name)
+                    if commit:
+                        self.commit()
 
         return removed_macs
 if __name__ == '__main__':
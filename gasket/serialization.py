@@ -0,0 +1,57 @@
+"""Loading and dumping of the yaml config files.
+Uses libyaml's C loader & dumper when PyYAML has been built with them,
+and can emit the faucet acl files as JSON (which is also yaml) as that is faster still.
+"""
+# pytype: disable=pyi-error
+import json
+
+import yaml
+
+SafeLoader = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+SafeDumper = getattr(yaml, 'CSafeDumper', yaml.SafeDumper)
+LIBYAML = SafeLoader is not yaml.SafeLoader
+
+FORMATS = ('yaml', 'json')
+
+
+class NoAliasSafeDumper(SafeDumper):
+    """Dumper that writes objects out in full every time, rather than using yaml aliases."""
+
+    def ignore_aliases(self, data):
+        return True
+
+
+def load(stream):
+    """Loads yaml (or JSON) safely.
+    Args:
+        stream (str or file): the yaml.
+    Returns:
+        yaml object.
+    """
+    return yaml.load(stream, Loader=SafeLoader)
+
+
+def load_file(filename):
+    """Loads a yaml (or JSON) file safely.
+    Args:
+        filename (str)
+    Returns:
+        yaml object.
+    """
+    with open(filename) as f:
+        return load(f)
+
+
+def dump(obj, ignore_aliases=False, fmt='yaml'):
+    """Returns an object as a yaml (or JSON) string.
+    Args:
+        obj (yaml): yaml object to dump.
+        ignore_aliases (bool): True if yaml aliases should be removed
+                                and object written out in full.
+                                False if aliases can be used.
+        fmt (str): 'yaml' or 'json'. JSON never has aliases.
+    """
+    if fmt == 'json':
+        return json.dumps(obj, sort_keys=True) + '\n'
+    dumper = NoAliasSafeDumper if ignore_aliases else SafeDumper
+    return yaml.dump(obj, default_flow_style=False, Dumper=dumper)
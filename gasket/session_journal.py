@@ -0,0 +1,129 @@
+"""Append-only journal of the authenticated sessions, so they survive a restart.
+
+Each session add (with the rules it was given) or remove is appended as a line of JSON.
+Once 'compact_after' records have been appended the live sessions are written to a snapshot
+and the journal is emptied. On startup the snapshot and then the journal are replayed.
+"""
+import collections
+import json
+import os
+
+from gasket.session_store import Session
+
+
+class SessionJournal(object):
+    """Journal of session add/remove records, with periodic compaction into a snapshot.
+    Replaying a record more than once gives the same result, so a crash between writing
+    the snapshot and emptying the journal is harmless.
+    """
+
+    logger = None
+    filename = None
+    snapshot_filename = None
+    compact_after = 10000
+    fsync = False
+
+    def __init__(self, filename, logger, compact_after=10000, fsync=False):
+        """
+        Args:
+            filename (str): journal file. The snapshot is filename + '.snapshot'.
+            compact_after (int): number of journal records after which to compact.
+            fsync (bool): True to fsync the journal on every sync().
+        """
+        self.filename = filename
+        self.snapshot_filename = filename + '.snapshot'
+        self.logger = logger
+        self.compact_after = compact_after
+        self.fsync = fsync
+        # the sessions (and their rules) as of the last record. {Session: rules}
+        self.live = collections.OrderedDict()
+        self.records = 0
+        self.file = None
+
+    def replay(self):
+        """Reads the snapshot and journal, and opens the journal for appending.
+        A partially written (last) record is discarded.
+        Returns:
+            OrderedDict of {Session: rules} in the order they were added.
+        """
+        self.live = collections.OrderedDict()
+        if os.path.exists(self.snapshot_filename):
+            with open(self.snapshot_filename) as f:
+                for session, rules in json.load(f):
+                    self.live[Session(*session)] = rules
+
+        self.records = 0
+        good_offset = 0
+        if os.path.exists(self.filename):
+            with open(self.filename, 'rb') as f:
+                for line in f:
+                    try:
+                        record = json.loads(line.decode())
+                    except ValueError:
+                        self.logger.warning('discarding partial session journal record at offset %d',
+                                            good_offset)
+                        break
+                    self._apply(record)
+                    good_offset += len(line)
+                    self.records += 1
+            if good_offset != os.path.getsize(self.filename):
+                with open(self.filename, 'r+b') as f:
+                    f.truncate(good_offset)
+
+        self.file = open(self.filename, 'a')
+        self.logger.info('replayed %d sessions (%d journal records)', len(self.live), self.records)
+        return collections.OrderedDict(self.live)
+
+    def _apply(self, record):
+        session = Session(*record['session'])
+        self.live.pop(session, None)
+        if record['op'] == 'add':
+            self.live[session] = record['rules']
+
+    def _append(self, record):
+        self._apply(record)
+        self.file.write(json.dumps(record, separators=(',', ':')) + '\n')
+        self.records += 1
+
+    def add(self, session, rules):
+        """Records that session was authenticated and given rules.
+        Args:
+            session (Session)
+            rules (dict): {port acl name: list of rules}
+        """
+        self._append({'op': 'add', 'session': list(session), 'rules': rules})
+
+    def remove(self, session):
+        """Records that session was removed."""
+        self._append({'op': 'remove', 'session': list(session)})
+
+    def sync(self):
+        """Flushes the records written so far to the file (and disk if fsync)."""
+        self.file.flush()
+        if self.fsync:
+            os.fsync(self.file.fileno())
+
+    def needs_compaction(self):
+        """Returns: True if enough records have been appended since the last compaction."""
+        return self.records >= self.compact_after
+
+    def compact(self):
+        """Writes the live sessions to the snapshot, and empties the journal."""
+        tmp = self.snapshot_filename + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump([[list(session), rules] for session, rules in self.live.items()], f,
+                      separators=(',', ':'))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.snapshot_filename)
+        self.file.close()
+        self.file = open(self.filename, 'w')
+        self.logger.info('compacted session journal. %d records -> %d sessions',
+                         self.records, len(self.live))
+        self.records = 0
+
+    def close(self):
+        """Closes the journal file."""
+        if self.file:
+            self.file.close()
+            self.file = None
@@ -0,0 +1,135 @@
+"""In memory store of the authenticated sessions (a username and MAC address on a switch port).
+"""
+import collections
+
+Session = collections.namedtuple('Session', ['username', 'mac', 'dp_name', 'port'])
+
+
+def _is_wildcard_user(username):
+    # hostapd disconnect events do not have a username, and hostapd may report it as '(null)'.
+    return not username or username == '(null)'
+
+
+class SessionStore(object):
+    """Sessions indexed by MAC, by username and by (dp name, port),
+    so that lookups and bulk removals only touch the sessions concerned.
+    """
+
+    def __init__(self):
+        self.sessions = set()
+        self.by_mac = {} # {mac: set(Session)}
+        self.by_user = {} # {username: set(Session)}
+        self.by_port = {} # {(dp_name, port): set(Session)}
+
+    def __len__(self):
+        return len(self.sessions)
+
+    def __iter__(self):
+        return iter(self.sessions)
+
+    def __contains__(self, session):
+        return session in self.sessions
+
+    @staticmethod
+    def _index(index, key, session):
+        sessions = index.get(key)
+        if sessions is None:
+            index[key] = sessions = set()
+        sessions.add(session)
+
+    @staticmethod
+    def _unindex(index, key, session):
+        sessions = index.get(key)
+        if sessions is not None:
+            sessions.discard(session)
+            if not sessions:
+                del index[key]
+
+    def add(self, username, mac, dp_name, port):
+        """Adds a session.
+        Returns:
+            the Session, or None if it already existed.
+        """
+        session = Session(username, mac, dp_name, port)
+        if session in self.sessions:
+            return None
+        self.sessions.add(session)
+        self._index(self.by_mac, mac, session)
+        self._index(self.by_user, username, session)
+        self._index(self.by_port, (dp_name, port), session)
+        return session
+
+    def remove(self, session):
+        """Removes a session (if present).
+        Returns:
+            True if it was removed.
+        """
+        if session not in self.sessions:
+            return False
+        self.sessions.remove(session)
+        self._unindex(self.by_mac, session.mac, session)
+        self._unindex(self.by_user, session.username, session)
+        self._unindex(self.by_port, (session.dp_name, session.port), session)
+        return True
+
+    def is_authenticated(self, mac, username=None, dp_name=None, port=None):
+        """Checks if the mac has a session.
+        Args:
+            mac (str)
+            username (str): optional. None or '(null)' matches any user.
+            dp_name (str): optional. if dp_name is used so should port and vice versa.
+            port: optional.
+        Returns:
+            True if there is a matching session.
+        """
+        if _is_wildcard_user(username):
+            return mac in self.by_mac
+        if dp_name is not None:
+            return Session(username, mac, dp_name, port) in self.sessions
+        return any(session.username == username for session in self.by_mac.get(mac, ()))
+
+    def sessions_for_mac(self, mac):
+        """Returns: list of the Sessions of mac."""
+        return list(self.by_mac.get(mac, ()))
+
+    def sessions_for_user(self, username):
+        """Returns: list of the Sessions of username."""
+        return list(self.by_user.get(username, ()))
+
+    def sessions_on_port(self, dp_name, port):
+        """Returns: list of the Sessions on the port."""
+        return list(self.by_port.get((dp_name, port), ()))
+
+    def remove_mac(self, mac, username=None):
+        """Removes the sessions of mac (on any port).
+        Args:
+            mac (str)
+            username (str): only remove the sessions of this user. None or '(null)' for any user.
+        Returns:
+            list of the removed Sessions.
+        """
+        removed = [session for session in self.sessions_for_mac(mac)
+                   if _is_wildcard_user(username) or session.username == username]
+        for session in removed:
+            self.remove(session)
+        return removed
+
+    def remove_user(self, username):
+        """Removes all the sessions of username.
+        Returns:
+            list of the removed Sessions.
+        """
+        removed = self.sessions_for_user(username)
+        for session in removed:
+            self.remove(session)
+        return removed
+
+    def remove_port(self, dp_name, port):
+        """Removes all the sessions on a port.
+        Returns:
+            list of the removed Sessions.
+        """
+        removed = self.sessions_on_port(dp_name, port)
+        for session in removed:
+            self.remove(session)
+        return removed
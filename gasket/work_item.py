@@ -1,13 +1,20 @@
 
+import time
+
 
 class WorkItem(object):
 
     mac = None
     hostapd_name = None
+    created = None
+    # time the item was (last) put on the work queue. later than created if it has been retried.
+    queued = None
 
     def __init__(self, mac, hostapd_name):
         self.mac = mac
         self.hostapd_name = hostapd_name
+        self.created = time.time()
+        self.queued = self.created
 
 
 class AuthWorkItem(WorkItem):
@@ -15,6 +22,13 @@ class AuthWorkItem(WorkItem):
     """
     username = None
     acllist = []
+    # set by the pipeline workers or the LocationPrefetcher (if used) before the item is committed.
+    location = None
+    rules = None
+    # time hostapd's EAP success event was received (if it came from hostapd).
+    success = None
+    # times the item has been put back on the work queue by the RetryQueue.
+    attempts = 0
 
     def __init__(self, mac, username, acllist, hostapd_name):
         super().__init__(mac, hostapd_name)
@@ -27,3 +41,15 @@ class DeauthWorkItem(WorkItem):
     """
     def __init__(self, mac, hostapd_name):
         super().__init__(mac, hostapd_name)
+
+
+class PortDownWorkItem(WorkItem):
+    """Class that represents a port going down, so everything authenticated on it is removed.
+    """
+    dp_name = None
+    port = None
+
+    def __init__(self, dp_name, port):
+        super().__init__(None, None)
+        self.dp_name = dp_name
+        self.port = port
@@ -0,0 +1,256 @@
+"""Queue of WorkItems for the worker thread.
+Revocations (deauths and port downs) and grants (auths) are queued in separate priority lanes,
+and the items queued for each MAC are coalesced so that a client flapping between
+authenticated and deauthenticated only costs one change.
+"""
+import collections
+import queue
+import threading
+import time
+
+from gasket.work_item import DeauthWorkItem, PortDownWorkItem
+
+REVOKE = 'revoke'
+GRANT = 'grant'
+
+DROP_OLDEST = 'drop_oldest'
+REJECT = 'reject'
+BLOCK = 'block'
+OVERLOAD_POLICIES = (DROP_OLDEST, REJECT, BLOCK)
+
+
+class Lane(object):
+    """A FIFO of work items, keyed so that an item can be replaced in place."""
+
+    name = None
+    weight = 1
+    credit = 0
+
+    def __init__(self, name, weight):
+        self.name = name
+        self.weight = weight
+        self.credit = weight
+        # {key: WorkItem} in queued order.
+        self.pending = collections.OrderedDict()
+
+
+class CoalescingWorkQueue(object):
+    """Drop in replacement for queue.Queue (put, get, get_nowait, qsize, empty).
+
+    Deauths and port downs are queued in the 'revoke' lane, everything else in the 'grant' lane.
+    When both lanes have work they are served by weighted round robin: up to
+    revoke_weight revocations, then up to grant_weight grants, and so on. So revocations
+    preempt a backlog of logins, but logins are never starved.
+
+    Items are keyed by MAC (port downs by dp name & port):
+     - a deauth replaces any pending deauth and drops any pending auth.
+     - an auth replaces any pending auth. A pending deauth is kept, and is always got first
+       (when the auth reaches the head of the grant lane, its deauth is got in its place).
+     - a port down replaces any pending port down for the same port.
+     - an auth created before the item pending for its MAC (i.e. a retried auth) is dropped.
+    So only the latest intent for a MAC survives, and the depth of the queue is bounded
+    by the number of distinct MACs and ports.
+    An item that is replaced keeps its place in its lane, so a MAC that keeps
+    changing its mind is not pushed back (and starved) by its own items.
+
+    The queue can be bounded to max_size items. When it is full a new grant is handled by the
+    overload policy:
+     - 'drop_oldest': the oldest queued grant is dropped to make room.
+       (the new grant is dropped if there are none)
+     - 'reject': the new grant is rejected (put raises queue.Full).
+     - 'block': put blocks until there is room (or timeout). A non blocking put is rejected.
+    Revocations are always queued (so the queue may go over max_size with them),
+    so that access is never left open because the queue is full.
+    Replacing a queued item does not change the size of the queue, so is always allowed.
+
+    Superseded & shed items, the depth of each lane, and the time items wait in each lane
+    are recorded in the optional metrics.
+    """
+
+    metrics = None
+    max_size = None
+    overload_policy = DROP_OLDEST
+
+    def __init__(self, metrics=None, revoke_weight=4, grant_weight=1, max_size=None,
+                 overload_policy=DROP_OLDEST):
+        """
+        Args:
+            metrics (AuthAppMetrics): optional. for the number of superseded & shed items,
+                                      lane depths and wait times.
+            revoke_weight (int): revocations served per round when both lanes have work.
+            grant_weight (int): grants served per round when both lanes have work.
+            max_size (int): items to queue before the overload_policy is applied. None for no limit.
+            overload_policy (str): 'drop_oldest', 'reject' or 'block'.
+        """
+        self.metrics = metrics
+        self.max_size = max_size
+        self.overload_policy = overload_policy
+        self.revoke = Lane(REVOKE, revoke_weight)
+        self.grant = Lane(GRANT, grant_weight)
+        # in priority order.
+        self.lanes = (self.revoke, self.grant)
+        self.size = 0
+        self.superseded = 0
+        self.shed = 0
+        self.mutex = threading.Lock()
+        self.not_empty = threading.Condition(self.mutex)
+        self.not_full = threading.Condition(self.mutex)
+        if self.metrics:
+            for lane in self.lanes:
+                self.metrics.work_queue_depth.labels(lane.name).set_function(
+                    lambda lane=lane: len(lane.pending))
+
+    @staticmethod
+    def _key(item):
+        if isinstance(item, PortDownWorkItem):
+            return (item.dp_name, item.port)
+        return item.mac
+
+    def _superseded(self, item, queued=True):
+        """Counts item as superseded. queued is False if item was never queued."""
+        if queued:
+            self.size -= 1
+            self.not_full.notify()
+        self.superseded += 1
+        if self.metrics:
+            self.metrics.work_items_superseded.labels(type(item).__name__).inc()
+
+    def _shed(self, item):
+        self.shed += 1
+        if self.metrics:
+            self.metrics.work_items_shed.labels(type(item).__name__).inc()
+
+    def _is_full(self, item, key):
+        """Returns:
+            True if queuing item would take the queue over max_size,
+            and item is not a revocation (which are always queued).
+        """
+        if self.max_size is None or self.size < self.max_size:
+            return False
+        if isinstance(item, (DeauthWorkItem, PortDownWorkItem)):
+            return False
+        return key not in self.grant.pending
+
+    def _wait_until_not_full(self, item, key, block, timeout):
+        """Applies the overload policy until there is room for item (the lock must be held).
+        Raises:
+            queue.Full if item is shed.
+        """
+        deadline = time.time() + timeout if timeout is not None else None
+        while self._is_full(item, key):
+            if self.overload_policy == DROP_OLDEST and self.grant.pending:
+                _, oldest = self.grant.pending.popitem(last=False)
+                self.size -= 1
+                self._shed(oldest)
+            elif self.overload_policy == BLOCK and block:
+                remaining = deadline - time.time() if deadline is not None else None
+                if remaining is not None and remaining <= 0:
+                    self._shed(item)
+                    raise queue.Full
+                self.not_full.wait(remaining)
+            else:
+                self._shed(item)
+                raise queue.Full
+
+    def _replace(self, lane, key, item):
+        """Puts item in lane, in the place of the item for key if there is one."""
+        old = lane.pending.get(key)
+        if old is not None:
+            self._superseded(old)
+        lane.pending[key] = item
+        self.size += 1
+
+    def put(self, item, block=True, timeout=None):
+        """Queues item, superseding the items pending for the same MAC as described above.
+        Args:
+            item (WorkItem)
+            block (bool): True to wait for room if the queue is full and the overload policy is 'block'.
+            timeout (float): seconds to wait. None to wait forever.
+        Raises:
+            queue.Full if the overload policy shed item.
+        """
+        key = self._key(item)
+        with self.mutex:
+            if not isinstance(item, (DeauthWorkItem, PortDownWorkItem)):
+                pending = self.grant.pending.get(key) or self.revoke.pending.get(key)
+                if pending is not None and pending.created > item.created:
+                    self._superseded(item, queued=False)
+                    return
+            self._wait_until_not_full(item, key, block, timeout)
+            if isinstance(item, DeauthWorkItem):
+                old = self.grant.pending.pop(key, None)
+                if old is not None:
+                    self._superseded(old)
+                self._replace(self.revoke, key, item)
+            elif isinstance(item, PortDownWorkItem):
+                self._replace(self.revoke, key, item)
+            else:
+                self._replace(self.grant, key, item)
+            self.not_empty.notify()
+
+    def put_nowait(self, item):
+        self.put(item, block=False)
+
+    def get(self, block=True, timeout=None):
+        """Removes and returns the next item, as scheduled by the weighted round robin.
+        Args:
+            block (bool): True to wait for an item (for up to timeout seconds).
+            timeout (float): seconds to wait. None to wait forever.
+        Raises:
+            queue.Empty if there is no item.
+        """
+        with self.not_empty:
+            if not block:
+                if not self.size:
+                    raise queue.Empty
+            elif timeout is None:
+                while not self.size:
+                    self.not_empty.wait()
+            else:
+                deadline = time.time() + timeout
+                while not self.size:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        raise queue.Empty
+                    self.not_empty.wait(remaining)
+            return self._get()
+
+    def get_nowait(self):
+        return self.get(block=False)
+
+    def _next_lane(self):
+        """Returns:
+            the lane to serve next. At least one lane must have work.
+        """
+        waiting = [lane for lane in self.lanes if lane.pending]
+        if len(waiting) == 1:
+            return waiting[0]
+        for lane in waiting:
+            if lane.credit > 0:
+                lane.credit -= 1
+                return lane
+        # every lane has had its share, start the next round.
+        for lane in self.lanes:
+            lane.credit = lane.weight
+        waiting[0].credit -= 1
+        return waiting[0]
+
+    def _get(self):
+        lane = self._next_lane()
+        key = next(iter(lane.pending))
+        if lane is self.grant and key in self.revoke.pending:
+            # never grant before the revocation that was queued before it.
+            lane = self.revoke
+        item = lane.pending.pop(key)
+        self.size -= 1
+        self.not_full.notify()
+        if self.metrics:
+            self.metrics.work_queue_wait.labels(lane.name).observe(time.time() - item.queued)
+        return item
+
+    def qsize(self):
+        with self.not_empty:
+            return self.size
+
+    def empty(self):
+        return self.qsize() == 0
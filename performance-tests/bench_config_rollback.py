@@ -0,0 +1,116 @@
+"""Benchmark of recovering from a config that faucet rejects.
+
+A stub controller stands in for faucet: on SIGHUP it (after a delay) loads the faucet acl file,
+rejects it if any rule's dl_type is not a number, and exports the faucet_config_reload_requests
+and faucet_config_load_error metrics like faucet does.
+Each round authenticates a user with good rules, then one whose rules are rejected
+(which is rolled back), then another with good rules.
+
+Usage: python3 bench_config_rollback.py [rounds] [controller load delay seconds]
+"""
+import http.server
+import multiprocessing
+import os
+import shutil
+import signal
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+import yaml
+
+from bench_rule_manager import make_config, mac
+from bench_session_journal import make_rule_manager
+
+BROKEN_RULES_YAML = '''
+    broken:
+        _authport_:
+            - rule:
+                _name_: _user-name_
+                _mac_: _user-mac_
+                dl_src: _user-mac_
+                dl_type: not-a-number
+                actions:
+                    allow: 1
+'''
+
+
+def run_stub_controller(acl_filename, load_delay, conn):
+    """Runs the stub controller. Sends its pid and prometheus url over conn."""
+    state = {'reloads': 0, 'load_error': 0}
+    sighup = threading.Event()
+
+    class Handler(http.server.BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+        disable_nagle_algorithm = True
+
+        def do_GET(self):
+            body = ('faucet_config_reload_requests %d.0\nfaucet_config_load_error %d.0\n' %
+                    (state['reloads'], state['load_error'])).encode()
+            self.send_response(200)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    def load_config():
+        while True:
+            sighup.wait()
+            sighup.clear()
+            time.sleep(load_delay)
+            with open(acl_filename) as f:
+                acls = yaml.safe_load(f)['acls']
+            valid = all(isinstance(rule['rule'].get('dl_type', 0), int)
+                        for rules in acls.values() for rule in rules)
+            state['load_error'] = 0 if valid else 1
+            state['reloads'] += 1
+
+    signal.signal(signal.SIGHUP, lambda signum, frame: sighup.set())
+    threading.Thread(target=load_config, daemon=True).start()
+    server = http.server.HTTPServer(('127.0.0.1', 0), Handler)
+    conn.send((os.getpid(), 'http://127.0.0.1:%d' % server.server_port))
+    server.serve_forever()
+
+
+def main():
+    rounds = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    load_delay = float(sys.argv[2]) if len(sys.argv) > 2 else 0.05
+    tmpdir = tempfile.mkdtemp()
+    parent_conn, child_conn = multiprocessing.Pipe()
+    try:
+        config = make_config(tmpdir)
+        with open(config.rules, 'a') as f:
+            f.write(BROKEN_RULES_YAML)
+        controller = multiprocessing.Process(target=run_stub_controller, daemon=True,
+                                             args=(config.acl_config_file, load_delay, child_conn))
+        controller.start()
+        pid, config.prom_url = parent_conn.recv()
+        with open(config.contr_pid_file, 'w') as f:
+            f.write(str(pid))
+        rule_man = make_rule_manager(config)
+
+        good, rejected, after = [], [], []
+        for i in range(rounds):
+            for times, acl, expected in ((good, 'allowall', True), (rejected, 'broken', False),
+                                         (after, 'allowall', True)):
+                n = len(good) + len(rejected) + len(after)
+                start = time.perf_counter()
+                success = rule_man.authenticate('user%d' % n, mac(n), 'faucet-1', n % 48 + 1, [acl])
+                times.append(time.perf_counter() - start)
+                assert success == expected, (i, acl)
+        print('controller load delay %.3fs, %d rounds, generation %d, %d sessions' %
+              (load_delay, rounds, rule_man.generation, len(rule_man.sessions)))
+        for name, times in (('good commit', good), ('rejected + rollback', rejected),
+                            ('next good commit', after)):
+            print('%22s: median %.3fs max %.3fs' % (name, statistics.median(times), max(times)))
+    finally:
+        controller.terminate()
+        shutil.rmtree(tmpdir)
+
+
+if __name__ == '__main__':
+    main()
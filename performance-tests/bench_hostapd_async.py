@@ -0,0 +1,158 @@
+"""Benchmark of the hostapd clients: a HostapdSocketThread per hostapd, against
+all hostapds served by a single HostapdAsyncThread.
+
+The hostapds are emulated (over UDP, cookie handshake included) by a separate process.
+Each client is run in its own process so the memory use can be compared.
+Measures the time until every hostapd is connected & attached, the increase in RSS,
+and the latency from hostapd sending CTRL-EVENT-EAP-SUCCESS until the work item is queued.
+
+Usage: python3 bench_hostapd_async.py [hostapds] [events per hostapd]
+"""
+import multiprocessing
+import os
+import queue
+import selectors
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from gasket.hostapd_conf import HostapdConf
+from gasket import hostapd_async_thread
+from gasket import hostapd_socket_thread
+from gasket.hostapd_socket_thread import RADIUS_ACL_MIB_KEY
+
+COOKIE = '0123456789abcdef'
+
+
+def mac(hostapd, i):
+    n = hostapd << 16 | i
+    return '02:00:%02x:%02x:%02x:%02x' % ((n >> 24) & 0xff, (n >> 16) & 0xff, (n >> 8) & 0xff, n & 0xff)
+
+
+def emulate_hostapds(count, conn):
+    """Runs count emulated hostapd UDP control interfaces.
+    Sends the ports over conn, then for each 'events' command received sends every attached
+    client one EAP-SUCCESS per hostapd and replies with the time they were sent.
+    """
+    sel = selectors.DefaultSelector()
+    socks = []
+    attached = {}
+    for i in range(count):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.bind(('127.0.0.1', 0))
+        sock.setblocking(False)
+        sel.register(sock, selectors.EVENT_READ, i)
+        socks.append(sock)
+        attached[i] = set()
+    conn.send([sock.getsockname()[1] for sock in socks])
+    sel.register(conn, selectors.EVENT_READ, None)
+
+    while True:
+        for key, _ in sel.select():
+            if key.data is None:
+                msg = conn.recv()
+                if msg[0] == 'stop':
+                    return
+                sent = {}
+                for i, sock in enumerate(socks):
+                    event_mac = mac(i, msg[1])
+                    for addr in attached[i]:
+                        sent[event_mac] = time.time()
+                        sock.sendto(('<3>CTRL-EVENT-EAP-SUCCESS %s' % event_mac).encode(), addr)
+                conn.send(sent)
+                continue
+            sock = key.fileobj
+            try:
+                data, addr = sock.recvfrom(4096)
+            except BlockingIOError:
+                continue
+            cmd = data.decode()
+            if cmd.startswith('COOKIE='):
+                cmd = cmd.split(' ', 1)[1]
+            if cmd == 'GET_COOKIE':
+                reply = 'COOKIE=%s' % COOKIE
+            elif cmd == 'PING':
+                reply = 'PONG\n'
+            elif cmd == 'ATTACH':
+                attached[key.data].add(addr)
+                reply = 'OK\n'
+            elif cmd.startswith('STA '):
+                reply = '%s\ndot1xAuthSessionUserName=user%d\n%s=accept-all\n' % (
+                    cmd.split()[1], key.data, RADIUS_ACL_MIB_KEY)
+            else:
+                reply = 'UNKNOWN COMMAND\n'
+            sock.sendto(reply.encode(), addr)
+
+
+def rss_kb():
+    with open('/proc/self/status') as status:
+        for line in status:
+            if line.startswith('VmRSS:'):
+                return int(line.split()[1])
+    return 0
+
+
+def run_client(mode, hostapds, events):
+    """Runs one client implementation against the emulated hostapds. Prints the results."""
+    parent_conn, child_conn = multiprocessing.Pipe()
+    emulator = multiprocessing.Process(target=emulate_hostapds, args=(hostapds, child_conn), daemon=True)
+    emulator.start()
+    ports = parent_conn.recv()
+
+    log = tempfile.NamedTemporaryFile(suffix='.log')
+    confs = [HostapdConf('hostapd-%d' % i, {'remote_host': '127.0.0.1', 'remote_port': port,
+                                            'unsolicited_timeout': 5, 'request_timeout': 5})
+             for i, port in enumerate(ports)]
+    work_queue = queue.Queue()
+
+    rss_before = rss_kb()
+    threads_before = threading.active_count()
+    start = time.time()
+    if mode == 'asyncio':
+        hat = hostapd_async_thread.HostapdAsyncThread(confs, work_queue, log.name)
+        hat.start()
+        hat.all_connected.wait()
+    else:
+        for conf in confs:
+            hostapd_socket_thread.HostapdSocketThread(conf, work_queue, log.name).start()
+        # unsolicited sockets are attached (and the thread receiving) once the sockets are initiated.
+        while open(log.name).read().count('sockets initiated') < hostapds:
+            time.sleep(0.01)
+    startup = time.time() - start
+    rss = rss_kb() - rss_before
+    threads = threading.active_count() - threads_before
+
+    latencies = []
+    for i in range(events):
+        parent_conn.send(('events', i))
+        sent = parent_conn.recv()
+        for _ in range(len(sent)):
+            item = work_queue.get()
+            latencies.append(item.created - sent[item.mac])
+    parent_conn.send(('stop',))
+
+    print('%-8s %8d %11.3f %10d %8d %14.3f %14.3f' % (
+        mode, hostapds, startup, rss // 1024, threads,
+        statistics.median(latencies) * 1e3, sorted(latencies)[int(len(latencies) * 0.99)] * 1e3))
+    sys.stdout.flush()
+
+
+def main():
+    if len(sys.argv) > 1 and sys.argv[1] in ('threads', 'asyncio'):
+        run_client(sys.argv[1], int(sys.argv[2]), int(sys.argv[3]))
+        # the hostapd socket threads cannot be stopped quickly.
+        os._exit(0)
+    hostapds = sys.argv[1] if len(sys.argv) > 1 else '500'
+    events = sys.argv[2] if len(sys.argv) > 2 else '5'
+    print('%-8s %8s %11s %10s %8s %14s %14s' % ('client', 'hostapds', 'startup (s)', 'rss (MiB)',
+                                                 'threads', 'p50 event (ms)', 'p99 event (ms)'))
+    for mode in ('threads', 'asyncio'):
+        subprocess.check_call([sys.executable, __file__, mode, hostapds, events])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,81 @@
+"""Benchmark of finding the access port of MACs in a scrape of faucet's learned_macs:
+a scan of every sample for each MAC (as Gasket did), and LearnedMacs: a single scan for
+all the MACs, or with NumPy decoding the scrape (once, then shared by every lookup on it).
+Times are to find 1 MAC, and a batch of 100 MACs (including decoding the scrape).
+
+Usage: python3 bench_learned_macs.py [samples ...]
+"""
+import sys
+import time
+
+from gasket import mac_location
+from gasket.mac_location import LearnedMacs, is_access_port, mac_to_value
+
+PORTS = 48
+# 1 in 4 samples are on a (non access) trunk port.
+TRUNK_PORT = PORTS + 1
+DP_PORT_MODE = {'faucet-1': {'interfaces': {p: {'auth_mode': 'access'} for p in range(1, PORTS + 1)}}}
+
+
+def make_samples(n):
+    samples = []
+    for i in range(n):
+        port = TRUNK_PORT if i % 4 == 0 else i % PORTS + 1
+        labels = {'dp_id': '0x1', 'dp_name': 'faucet-1', 'n': str(i), 'port': str(port), 'vlan': '100'}
+        samples.append(('learned_macs', labels, float(0x020000000000 + i)))
+    return samples
+
+
+def mac(i):
+    return '02:%02x:%02x:%02x:%02x:%02x' % tuple((i >> s) & 0xff for s in (32, 24, 16, 8, 0))
+
+
+def scan(samples, macs):
+    found = {}
+    for m in macs:
+        mac_as_int = mac_to_value(m)
+        for _, labels, value in samples:
+            if int(value) != mac_as_int:
+                continue
+            dp_name = labels.get('dp_name')
+            port = int(labels.get('port', -1))
+            if is_access_port(DP_PORT_MODE, dp_name, port):
+                found[m] = (dp_name, port)
+                break
+    return found
+
+
+def timed(fn):
+    start = time.perf_counter()
+    result = fn()
+    return time.perf_counter() - start, result
+
+
+def main():
+    sizes = [int(n) for n in sys.argv[1:]] or [10000, 100000, 1000000]
+    if mac_location.numpy is None:
+        print('NumPy is not installed, only the scans are benchmarked.')
+    print('%10s %8s %12s %12s %12s' % ('samples', 'macs', 'scan (s)', 'one scan (s)', 'numpy (s)'))
+    for n in sizes:
+        samples = make_samples(n)
+        for batch in (1, 100):
+            # spread over the samples, the last one has not been learned.
+            macs = [mac(i * n // batch + 1) for i in range(batch - 1)] + [mac(n + 1)]
+            methods = [('scan', lambda: scan(samples, macs)),
+                       ('one scan', lambda: LearnedMacs(samples, use_numpy=False).find_access_ports(
+                           macs, DP_PORT_MODE)),
+                       ('numpy', lambda: LearnedMacs(samples).find_access_ports(macs, DP_PORT_MODE))]
+            row = []
+            for name, fn in methods:
+                if (name == 'numpy' and mac_location.numpy is None) or (name == 'scan' and n * batch > 10 ** 7):
+                    # not installed, or the scan would take minutes.
+                    row.append(None)
+                    continue
+                seconds, found = timed(fn)
+                assert len(found) == batch - 1 and mac(n + 1) not in found
+                row.append(seconds)
+            print('%10d %8d %s' % (n, batch, ' '.join('%12s' % ('-' if t is None else '%.4f' % t) for t in row)))
+
+
+if __name__ == '__main__':
+    main()
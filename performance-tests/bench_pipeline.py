@@ -0,0 +1,133 @@
+"""Benchmark of the worker's throughput (authentications per second) for a backlog of logins,
+with the sequential worker loop and the pipeline (pipeline: workers).
+
+A stub controller stands in for faucet: it exports learned_macs for every MAC (and some on other ports),
+takes 'scrape delay' seconds to answer each scrape, and on SIGHUP reloads after 'reload delay' seconds.
+
+Usage: python3 bench_pipeline.py [logins] [scrape delay seconds] [reload delay seconds]
+"""
+import http.server
+import logging
+import multiprocessing
+import os
+import shutil
+import signal
+import socketserver
+import sys
+import tempfile
+import threading
+import time
+
+from gasket.auth_app import AuthApp
+from gasket.work_item import AuthWorkItem
+
+from bench_rule_manager import PORTS, make_config, mac
+
+OTHER_MACS = 5000
+
+
+class ThreadingHTTPServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # connections are reset when the benchmark moves on.
+        pass
+
+
+def run_stub_controller(logins, scrape_delay, reload_delay, conn):
+    """Runs the stub controller. Sends its pid and prometheus url over conn."""
+    state = {'reloads': 0}
+    sighup = threading.Event()
+    line = 'learned_macs{dp_id="0x1",dp_name="faucet-1",n="%d",port="%d",vlan="100"} %d.0\n'
+    learned_macs = ''.join(line % (i, i % PORTS + 1, int(mac(i).replace(':', ''), 16))
+                           for i in range(logins))
+    # macs learned on a (non access) port.
+    learned_macs += ''.join(line % (i, PORTS + 1, int(mac(i).replace(':', ''), 16))
+                            for i in range(logins, logins + OTHER_MACS))
+
+    class Handler(http.server.BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+        disable_nagle_algorithm = True
+
+        def do_GET(self):
+            time.sleep(scrape_delay)
+            body = ('faucet_config_reload_requests %d.0\nfaucet_config_load_error 0.0\n' %
+                    state['reloads'] + learned_macs).encode()
+            self.send_response(200)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    def load_config():
+        while True:
+            sighup.wait()
+            sighup.clear()
+            time.sleep(reload_delay)
+            state['reloads'] += 1
+
+    signal.signal(signal.SIGHUP, lambda signum, frame: sighup.set())
+    threading.Thread(target=load_config, daemon=True).start()
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    conn.send((os.getpid(), 'http://127.0.0.1:%d' % server.server_port))
+    server.serve_forever()
+
+
+def bench(logins, prom_url, pid, workers, batch_max_items):
+    """Returns:
+        authentications per second.
+    """
+    tmpdir = tempfile.mkdtemp()
+    try:
+        config = make_config(tmpdir)
+        config.prom_url = prom_url
+        config.pipeline_workers = workers
+        config.batch_max_items = batch_max_items
+        with open(config.contr_pid_file, 'w') as f:
+            f.write(str(pid))
+        logger = logging.getLogger('bench')
+        logger.addHandler(logging.NullHandler())
+        logger.propagate = False
+        app = AuthApp(config, logger)
+        for i in range(logins):
+            app.work_queue.put(AuthWorkItem(mac(i), 'user%d' % i, ['allowall'], 'hostapd'))
+
+        start = time.perf_counter()
+        if workers:
+            threading.Thread(target=app._run_pipeline, daemon=True).start()
+            while len(app.rule_man.sessions) < logins or app.rule_man.pending_changes:
+                time.sleep(0.001)
+        else:
+            while not app.work_queue.empty():
+                app._process_batch(app._get_work_batch())
+        elapsed = time.perf_counter() - start
+        assert len(app.rule_man.sessions) == logins
+        return logins / elapsed
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+def main():
+    logins = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+    scrape_delay = float(sys.argv[2]) if len(sys.argv) > 2 else 0.02
+    reload_delay = float(sys.argv[3]) if len(sys.argv) > 3 else 0.05
+    parent_conn, child_conn = multiprocessing.Pipe()
+    controller = multiprocessing.Process(target=run_stub_controller, daemon=True,
+                                         args=(logins, scrape_delay, reload_delay, child_conn))
+    controller.start()
+    try:
+        pid, prom_url = parent_conn.recv()
+        print('%d logins, scrape delay %.3fs, reload delay %.3fs' % (logins, scrape_delay, reload_delay))
+        print('%10s %10s %12s' % ('workers', 'batch', 'auths/sec'))
+        for batch_max_items in (1, 20):
+            for workers in (0, 4):
+                print('%10d %10d %12.1f' % (workers, batch_max_items,
+                                            bench(logins, prom_url, pid, workers, batch_max_items)))
+    finally:
+        controller.terminate()
+
+
+if __name__ == '__main__':
+    main()
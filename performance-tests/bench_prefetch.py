@@ -0,0 +1,95 @@
+"""Benchmark of the time from EAP success to faucet reloading the authentication,
+without and with the location prefetched when the EAP exchange starts (prefetch: workers).
+
+Logins arrive every 'interval' seconds, each EAP exchange taking 'eap delay' seconds from start to success.
+The stub controller of bench_pipeline.py stands in for faucet.
+
+Usage: python3 bench_prefetch.py [logins] [interval seconds] [eap delay seconds] [scrape delay seconds]
+       [reload delay seconds]
+"""
+import logging
+import multiprocessing
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+from gasket.auth_app import AuthApp
+from gasket.work_item import AuthWorkItem
+
+from bench_pipeline import run_stub_controller
+from bench_rule_manager import make_config, mac
+
+
+def bench(logins, interval, eap_delay, prom_url, pid, prefetch_workers):
+    """Returns:
+        sorted list of the seconds from each EAP success to its reload.
+    """
+    tmpdir = tempfile.mkdtemp()
+    try:
+        config = make_config(tmpdir)
+        config.prom_url = prom_url
+        config.prefetch_workers = prefetch_workers
+        with open(config.contr_pid_file, 'w') as f:
+            f.write(str(pid))
+        logger = logging.getLogger('bench')
+        logger.addHandler(logging.NullHandler())
+        logger.propagate = False
+        app = AuthApp(config, logger)
+
+        def eap_success(i):
+            # as the hostapd threads do, once the MIB has been got.
+            item = AuthWorkItem(mac(i), 'user%d' % i, ['allowall'], 'hostapd')
+            item.success = time.time()
+            if app.prefetcher:
+                app.prefetcher.prepare(item)
+            app.work_queue.put(item)
+
+        def hostapd():
+            for i in range(logins):
+                if app.prefetcher:
+                    app.prefetcher.prefetch(mac(i))
+                threading.Timer(eap_delay, eap_success, (i,)).start()
+                time.sleep(interval)
+
+        threading.Thread(target=hostapd, daemon=True).start()
+        latencies = []
+        while len(latencies) < logins:
+            batch = app._get_work_batch()
+            app._process_batch(batch)
+            end = time.time()
+            latencies.extend(end - item.success for item in batch)
+        assert len(app.rule_man.sessions) == logins
+        if app.prefetcher:
+            app.prefetcher.shutdown()
+        return sorted(latencies)
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+def main():
+    logins = int(sys.argv[1]) if len(sys.argv) > 1 else 30
+    interval = float(sys.argv[2]) if len(sys.argv) > 2 else 0.5
+    eap_delay = float(sys.argv[3]) if len(sys.argv) > 3 else 0.3
+    scrape_delay = float(sys.argv[4]) if len(sys.argv) > 4 else 0.05
+    reload_delay = float(sys.argv[5]) if len(sys.argv) > 5 else 0.05
+    parent_conn, child_conn = multiprocessing.Pipe()
+    controller = multiprocessing.Process(target=run_stub_controller, daemon=True,
+                                         args=(logins, scrape_delay, reload_delay, child_conn))
+    controller.start()
+    try:
+        pid, prom_url = parent_conn.recv()
+        print('%d logins every %.3fs, eap delay %.3fs, scrape delay %.3fs, reload delay %.3fs' % (
+            logins, interval, eap_delay, scrape_delay, reload_delay))
+        print('%10s %16s %16s' % ('prefetch', 'median (ms)', '95th % (ms)'))
+        for workers in (0, 2):
+            latencies = bench(logins, interval, eap_delay, prom_url, pid, workers)
+            print('%10s %16.1f %16.1f' % ('on' if workers else 'off', latencies[len(latencies) // 2] * 1000,
+                                          latencies[int(len(latencies) * 0.95)] * 1000))
+    finally:
+        controller.terminate()
+
+
+if __name__ == '__main__':
+    main()
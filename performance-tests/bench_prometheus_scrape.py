@@ -0,0 +1,104 @@
+"""Benchmark of scraping (and parsing) a (stub) prometheus exporter with a new connection per scrape
+(requests.get) against the persistent keep-alive session of auth_app_utils.PrometheusClient.
+Both a full scrape (as for learned_macs) and a scrape filtered to the reload counters
+(as the reload poller makes) are timed. The connections the keep-alive session made are also shown.
+
+Usage: python3 bench_prometheus_scrape.py [scrapes] [learned_macs ...]
+"""
+import http.server
+import sys
+import threading
+import time
+
+import requests
+
+from gasket import auth_app_utils
+
+
+def prometheus_text(learned_macs):
+    """Returns a faucet like prometheus export with learned_macs entries."""
+    lines = ['# HELP faucet_config_reload_requests number of config reload requests',
+             '# TYPE faucet_config_reload_requests counter',
+             'faucet_config_reload_requests 12.0',
+             'faucet_config_load_error 0.0',
+             'faucet_config_dp_name{dp_id="0x1",dp_name="faucet-1"} 1.0',
+             'dp_status{dp_id="0x1",dp_name="faucet-1"} 1.0',
+             '# HELP learned_macs MAC address stored as 64bit number to DP ID, port, VLAN, and n (discrete index)',
+             '# TYPE learned_macs gauge']
+    for i in range(learned_macs):
+        lines.append('learned_macs{dp_id="0x1",dp_name="faucet-1",n="%d",port="%d",vlan="100"} %d.0'
+                     % (i, i % 48 + 1, 0x020000000000 + i))
+    return ('\n'.join(lines) + '\n').encode()
+
+
+RELOAD_FAMILIES = ['faucet_config_reload_requests', 'faucet_config_load_error']
+
+
+class StubExporter(object):
+    """HTTP/1.1 (keep-alive) server that always returns the same prometheus text,
+    and counts the connections made to it.
+    """
+
+    def __init__(self, body):
+        self.connections = 0
+        exporter = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            disable_nagle_algorithm = True
+
+            def setup(self):
+                exporter.connections += 1
+                super().setup()
+
+            def do_GET(self):
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.server.daemon_threads = True
+        self.url = 'http://127.0.0.1:%d' % self.server.server_port
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def time_scrapes(scrape, scrapes):
+    """Returns the mean seconds per call of scrape()."""
+    scrape()
+    start = time.perf_counter()
+    for _ in range(scrapes):
+        scrape()
+    return (time.perf_counter() - start) / scrapes
+
+
+def main():
+    scrapes = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    sizes = [int(n) for n in sys.argv[2:]] or [0, 1000, 10000]
+    print('%12s %10s %16s %16s %8s %8s' % ('learned_macs', 'scrape', 'new conn (ms)', 'keep-alive (ms)',
+                                          'speedup', 'conns'))
+    for learned_macs in sizes:
+        for name, families in (('full', None), ('reload', RELOAD_FAMILIES)):
+            exporter = StubExporter(prometheus_text(learned_macs))
+            try:
+                fresh = time_scrapes(lambda: list(auth_app_utils.parse_prometheus(
+                    requests.get(exporter.url).text.splitlines(), families)), scrapes)
+                exporter.connections = 0
+                client = auth_app_utils.PrometheusClient(exporter.url)
+                pooled = time_scrapes(lambda: list(client.samples(families)), scrapes)
+                client.close()
+            finally:
+                exporter.stop()
+            print('%12d %10s %16.3f %16.3f %7.1fx %8d' % (learned_macs, name, fresh * 1e3, pooled * 1e3,
+                                                          fresh / pooled, exporter.connections))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,52 @@
+"""Benchmark of the RetryQueue with many pending retries: the time to schedule them,
+to cancel half of them (as deauthentications would), and for the rest to be put back on the work queue.
+
+Usage: python3 bench_retry_queue.py [pending ...]
+"""
+import sys
+import tempfile
+import time
+
+from gasket.retry_queue import RetryQueue
+from gasket.work_item import AuthWorkItem
+from gasket.work_queue import CoalescingWorkQueue
+
+from bench_rule_manager import mac
+
+
+def bench(n, log_file):
+    """Returns:
+        seconds per schedule, per cancel, and per retry.
+    """
+    work_queue = CoalescingWorkQueue()
+    retry_queue = RetryQueue(work_queue, log_file, initial_delay=0.5, max_delay=0.5, deadline=60)
+    retry_queue.logger.disabled = True
+    items = [AuthWorkItem(mac(i), 'user%d' % i, ['allowall'], 'hostapd') for i in range(n)]
+
+    start = time.perf_counter()
+    for item in items:
+        retry_queue.schedule(item)
+    scheduled = time.perf_counter()
+    for item in items[::2]:
+        retry_queue.cancel(item.mac)
+    cancelled = time.perf_counter()
+
+    retry_queue.start()
+    while work_queue.qsize() < n // 2:
+        time.sleep(0.001)
+    # the retries are due 0.5 seconds after being scheduled.
+    retried = time.perf_counter() - max(cancelled, start + 0.5)
+    retry_queue.kill()
+    return ((scheduled - start) / n, (cancelled - scheduled) / (n - n // 2), retried / (n // 2))
+
+
+def main():
+    sizes = [int(n) for n in sys.argv[1:]] or [1000, 10000, 100000]
+    print('%10s %14s %14s %14s' % ('pending', 'schedule (us)', 'cancel (us)', 'retry (us)'))
+    with tempfile.NamedTemporaryFile(suffix='.log') as log_file:
+        for n in sizes:
+            print('%10d %s' % (n, ' '.join('%14.2f' % (t * 1e6) for t in bench(n, log_file.name))))
+
+
+if __name__ == '__main__':
+    main()
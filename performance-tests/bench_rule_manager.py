@@ -0,0 +1,181 @@
+"""Benchmark of the cost of a single (de)authentication in RuleManager,
+as the number of authenticated sessions grows.
+
+Only the in memory part of an event is timed (commit=False), the commit
+(file write & faucet reload) is timed separately as it happens once per batch.
+The time to write the faucet acls after a single event is shown for both a single
+faucet-acls.yaml and a file per port acl (files: acl_config_dir).
+
+Usage: python3 bench_rule_manager.py [sessions ...]
+"""
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+from gasket.auth_config import AuthConfig
+from gasket.rule_manager import RuleManager, create_faucet_acls, write_yaml
+
+
+PORTS = 48
+
+AUTH_YAML = '''---
+version: 0
+logger_location: {tmpdir}/auth_app.log
+faucet:
+    prometheus_port: 9302
+    ip: 127.0.0.1
+files:
+    controller_pid: {tmpdir}/contr_pid
+    faucet_config: {tmpdir}/faucet.yaml
+    acl_config: {tmpdir}/faucet-acls.yaml
+    acl_config_dir: {acl_config_dir}
+    base_config: {tmpdir}/base-acls.yaml
+auth-rules:
+    file: {tmpdir}/rules.yaml
+dps:
+    faucet-1:
+        interfaces:
+{interfaces}
+hostapds: {{}}
+'''
+
+RULES_YAML = '''---
+acls:
+    allowall:
+        _authport_:
+            - rule:
+                _name_: _user-name_
+                _mac_: _user-mac_
+                dl_src: _user-mac_
+                dl_type: 0x0800
+                actions:
+                    allow: 1
+            - rule:
+                _name_: _user-name_
+                _mac_: _user-mac_
+                dl_src: _user-mac_
+                dl_type: 0x0806
+                actions:
+                    allow: 1
+'''
+
+
+def make_config(tmpdir, ports=PORTS, split=False):
+    """Creates the config files for a single datapath with 'ports' access ports in tmpdir.
+    If split the port acls are written to their own files.
+    Returns:
+        AuthConfig
+    """
+    interfaces = ''.join('            %d:\n                auth_mode: access\n' % p
+                         for p in range(1, ports + 1))
+    with open(os.path.join(tmpdir, 'auth.yaml'), 'w') as f:
+        f.write(AUTH_YAML.format(tmpdir=tmpdir, interfaces=interfaces,
+                                 acl_config_dir=os.path.join(tmpdir, 'acls.d') if split else 'null'))
+    with open(os.path.join(tmpdir, 'rules.yaml'), 'w') as f:
+        f.write(RULES_YAML)
+
+    redirect = {'rule': {'actions': {'allow': 1, 'output': {'dl_dst': '44:44:44:44:44:44'}}}}
+    eapol = {'rule': {'dl_type': 0x888e, 'actions': {'allow': 1}}}
+    base = {'acls': {}}
+    faucet = {'dps': {'faucet-1': {'dp_id': 1, 'interfaces': {}}}}
+    for port in range(1, ports + 1):
+        acl_name = 'port_faucet-1_%d' % port
+        base['acls'][acl_name] = [eapol, 'authed-rules', redirect]
+        faucet['dps']['faucet-1']['interfaces'][port] = {'native_vlan': 100, 'acl_in': acl_name}
+    base_filename = os.path.join(tmpdir, 'base-acls.yaml')
+    write_yaml(base, base_filename, True)
+    shutil.copy2(base_filename, base_filename + '-orig')
+    write_yaml(faucet, os.path.join(tmpdir, 'faucet.yaml'), True)
+    write_yaml(create_faucet_acls(base, logging), os.path.join(tmpdir, 'faucet-acls.yaml'), True)
+    return AuthConfig(os.path.join(tmpdir, 'auth.yaml'))
+
+
+def mac(i):
+    """Returns a unique MAC address string for i."""
+    return '02:%02x:%02x:%02x:%02x:%02x' % tuple((i >> s) & 0xff for s in (32, 24, 16, 8, 0))
+
+
+def make_rule_manager(tmpdir, ports=PORTS, split=False):
+    """Returns a RuleManager for a fresh config in tmpdir."""
+    logger = logging.getLogger('bench')
+    logger.addHandler(logging.NullHandler())
+    logger.propagate = False
+    return RuleManager(make_config(tmpdir, ports, split), logger)
+
+
+def populate(rule_man, sessions, ports=PORTS):
+    """Authenticates 'sessions' users spread across the ports (without committing)."""
+    for i in range(sessions):
+        rule_man.authenticate('user%d' % i, mac(i), 'faucet-1', i % ports + 1,
+                              ['allowall'], commit=False)
+
+
+def bench_write(sessions, split):
+    """Times writing the faucet acls after a single authentication.
+    Returns:
+        tuple of (seconds, bytes written).
+    """
+    tmpdir = tempfile.mkdtemp()
+    try:
+        rule_man = make_rule_manager(tmpdir, split=split)
+        populate(rule_man, sessions)
+        rule_man.write_faucet_acls()
+        rule_man.authenticate('user', mac(sessions), 'faucet-1', 1, ['allowall'], commit=False)
+        before = {f: os.stat(os.path.join(root, f)).st_mtime_ns
+                  for root, _, files in os.walk(tmpdir) for f in files}
+        start = time.perf_counter()
+        rule_man.write_faucet_acls()
+        write_time = time.perf_counter() - start
+        written = 0
+        for root, _, files in os.walk(tmpdir):
+            for f in files:
+                if '.bak' not in f and before.get(f) != os.stat(os.path.join(root, f)).st_mtime_ns:
+                    written += os.path.getsize(os.path.join(root, f))
+        return write_time, written
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+def bench(sessions, events=200):
+    """Times (de)authentication events with 'sessions' users already authenticated.
+    Returns:
+        tuple of (us per auth, us per deauth).
+    """
+    tmpdir = tempfile.mkdtemp()
+    try:
+        rule_man = make_rule_manager(tmpdir)
+        populate(rule_man, sessions)
+
+        start = time.perf_counter()
+        for i in range(sessions, sessions + events):
+            rule_man.authenticate('user%d' % i, mac(i), 'faucet-1', i % PORTS + 1,
+                                  ['allowall'], commit=False)
+        auth_time = (time.perf_counter() - start) / events
+
+        start = time.perf_counter()
+        for i in range(sessions, sessions + events):
+            rule_man.deauthenticate('user%d' % i, mac(i), commit=False)
+        deauth_time = (time.perf_counter() - start) / events
+        return auth_time * 1e6, deauth_time * 1e6
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+def main():
+    sizes = [int(n) for n in sys.argv[1:]] or [100, 1000, 10000]
+    print('%10s %12s %12s %12s %12s %12s %12s' % ('sessions', 'auth (us)', 'deauth (us)',
+                                                  'write (s)', 'bytes', 'split (s)', 'split bytes'))
+    for sessions in sizes:
+        auth_us, deauth_us = bench(sessions)
+        write_s, write_bytes = bench_write(sessions, False)
+        split_s, split_bytes = bench_write(sessions, True)
+        print('%10d %12.1f %12.1f %12.3f %12d %12.3f %12d' % (sessions, auth_us, deauth_us,
+                                                              write_s, write_bytes,
+                                                              split_s, split_bytes))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+"""Benchmark of writing the faucet acl file: PyYAML's pure python dumper (what Gasket used),
+libyaml's C dumper, and JSON (files: acl_format: json).
+Also times parsing each of the emitted files (as faucet does), with the pure python and C loaders,
+and checks they all load to the same acls.
+
+Usage: python3 bench_serialization.py [rules ...]
+"""
+import sys
+import time
+
+import yaml
+
+from gasket import serialization
+from gasket.rule_generator import RuleTemplate
+
+PORT_ACLS = 48
+
+RULE = {
+    '_name_': '_user-name_',
+    '_mac_': '_user-mac_',
+    'dl_src': '_user-mac_',
+    'dl_type': 0x0800,
+    'actions': {
+        'allow': 1,
+        'output': {'set_fields': [{'eth_dst': 'aa:aa:aa:aa:aa:aa'}]},
+    },
+}
+
+
+class PureNoAliasSafeDumper(yaml.SafeDumper):
+
+    def ignore_aliases(self, data):
+        return True
+
+
+def make_acls(rules):
+    """Returns:
+        faucet acls with rules spread over PORT_ACLS port acls.
+    """
+    template = RuleTemplate(RULE)
+    acls = {'port_faucet-1_%d' % (i + 1): [] for i in range(PORT_ACLS)}
+    for i in range(rules):
+        mac = '%02x:%02x:%02x:00:00:01' % ((i >> 16) & 0xff, (i >> 8) & 0xff, i & 0xff)
+        acls['port_faucet-1_%d' % (i % PORT_ACLS + 1)].append(template.render('user%d' % i, mac))
+    return {'acls': acls}
+
+
+def timed(fn, *args):
+    start = time.perf_counter()
+    result = fn(*args)
+    return time.perf_counter() - start, result
+
+
+def bench(rules):
+    """Returns:
+        list of (name, dump seconds, size, pure load seconds, C load seconds).
+    """
+    obj = make_acls(rules)
+    dumpers = (
+        ('yaml (pure python)',
+         lambda: yaml.dump(obj, default_flow_style=False, Dumper=PureNoAliasSafeDumper)),
+        ('yaml (libyaml)', lambda: serialization.dump(obj, True, 'yaml')),
+        ('json', lambda: serialization.dump(obj, True, 'json')),
+    )
+    results = []
+    for name, dump in dumpers:
+        dump_time, content = timed(dump)
+        pure_time, pure_obj = timed(yaml.load, content, yaml.SafeLoader)
+        c_time, c_obj = timed(serialization.load, content)
+        assert pure_obj == c_obj == obj, name
+        results.append((name, dump_time, len(content), pure_time, c_time))
+    return results
+
+
+def main():
+    if not serialization.LIBYAML:
+        print('PyYAML was built without libyaml, the libyaml rows use the pure python dumper/loader.')
+    sizes = [int(n) for n in sys.argv[1:]] or [1000, 10000]
+    print('%8s %20s %10s %10s %14s %14s' % ('rules', 'format', 'dump (s)', 'size (KB)',
+                                           'load py (s)', 'load C (s)'))
+    for rules in sizes:
+        for name, dump_time, size, pure_time, c_time in bench(rules):
+            print('%8d %20s %10.4f %10d %14.4f %14.4f' % (rules, name, dump_time, size // 1024,
+                                                           pure_time, c_time))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+"""Benchmark of the session journal: the cost of journaling a commit compared to rewriting
+(and backing up) the base file, and how long a restart takes to restore the sessions
+from the journal and from a compacted snapshot.
+
+Usage: python3 bench_session_journal.py [sessions ...]
+"""
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+from gasket.rule_manager import RuleManager
+
+from bench_rule_manager import make_config, mac, populate
+
+
+def make_rule_manager(config):
+    logger = logging.getLogger('bench')
+    logger.addHandler(logging.NullHandler())
+    logger.propagate = False
+    return RuleManager(config, logger)
+
+
+def bench(sessions):
+    """Returns:
+        tuple of seconds for (base write, journal record + sync, replay journal, replay snapshot).
+    """
+    tmpdir = tempfile.mkdtemp()
+    try:
+        config = make_config(tmpdir)
+        config.journal_file = os.path.join(tmpdir, 'sessions.journal')
+        config.journal_compact_after = sessions * 10
+        rule_man = make_rule_manager(config)
+        populate(rule_man, sessions)
+        rule_man.journal.sync()
+
+        start = time.perf_counter()
+        rule_man.write_base()
+        base_write = time.perf_counter() - start
+
+        start = time.perf_counter()
+        rule_man.authenticate('user', mac(sessions), 'faucet-1', 1, ['allowall'], commit=False)
+        rule_man.journal.sync()
+        journal_write = time.perf_counter() - start
+        rule_man.journal.close()
+
+        start = time.perf_counter()
+        restarted = make_rule_manager(config)
+        journal_replay = time.perf_counter() - start
+        assert len(restarted.sessions) == sessions + 1
+
+        restarted.journal.compact()
+        restarted.journal.close()
+        start = time.perf_counter()
+        restarted = make_rule_manager(config)
+        snapshot_replay = time.perf_counter() - start
+        assert len(restarted.sessions) == sessions + 1
+        restarted.journal.close()
+        return base_write, journal_write, journal_replay, snapshot_replay
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+def main():
+    sizes = [int(n) for n in sys.argv[1:]] or [100, 1000, 10000]
+    print('%10s %14s %14s %14s %14s' % ('sessions', 'base write (s)', 'journal (s)',
+                                        'replay (s)', 'snapshot (s)'))
+    for sessions in sizes:
+        print('%10d %14.4f %14.6f %14.4f %14.4f' % ((sessions,) + bench(sessions)))
+
+
+if __name__ == '__main__':
+    main()
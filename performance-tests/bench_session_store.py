@@ -0,0 +1,69 @@
+"""Benchmark of the session lookups done for each hostapd event and port down,
+for the SessionStore against the nested {user: {mac: {dp: {port: 1}}}} dict it replaced.
+
+Usage: python3 bench_session_store.py [sessions ...]
+"""
+import sys
+import timeit
+
+from gasket.session_store import SessionStore
+
+USERS = 1000
+PORTS = 48
+
+
+def mac(i):
+    return '02:00:%02x:%02x:%02x:%02x' % ((i >> 24) & 0xff, (i >> 16) & 0xff, (i >> 8) & 0xff, i & 0xff)
+
+
+def session(i):
+    return 'user%d' % (i % USERS), mac(i), 'faucet-%d' % (i // PORTS % 100), i % PORTS + 1
+
+
+def nested_is_authenticated(authed_users, mac_addr):
+    """The previous lookup for a '(null)' username (as hostapd disconnects send)."""
+    for _, dic in list(authed_users.items()):
+        if mac_addr in list(dic):
+            return True
+    return False
+
+
+def populate(sessions):
+    store = SessionStore()
+    authed_users = {}
+    for i in range(sessions):
+        user, mac_addr, dp_name, port = session(i)
+        store.add(user, mac_addr, dp_name, port)
+        authed_users.setdefault(user, {}).setdefault(mac_addr, {}).setdefault(dp_name, {})[port] = 1
+    return store, authed_users
+
+
+def per_call_us(stmt, number):
+    return min(timeit.repeat(stmt, number=number, repeat=3)) / number * 1e6
+
+
+def main():
+    sizes = [int(n) for n in sys.argv[1:]] or [1000, 10000, 100000]
+    print('%9s %14s %14s %14s %14s %14s' % ('sessions', 'nested (us)', 'by mac (us)', 'by user (us)',
+                                            'port down (us)', 'add+rm (us)'))
+    for sessions in sizes:
+        store, authed_users = populate(sessions)
+        missing = mac(sessions + 1)
+        nested = per_call_us(lambda: nested_is_authenticated(authed_users, missing), 20)
+        by_mac = per_call_us(lambda: store.is_authenticated(missing, '(null)'), 10000)
+        by_user = per_call_us(lambda: store.sessions_for_user('user1'), 10000)
+
+        def port_down():
+            # the sessions are put back so every call removes the same number.
+            for removed in store.remove_port('faucet-0', 1):
+                store.add(*removed)
+        port = per_call_us(port_down, 1000)
+
+        def add_remove():
+            store.remove(store.add('new-user', missing, 'faucet-0', 1))
+        add_rm = per_call_us(add_remove, 10000)
+        print('%9d %14.2f %14.2f %14.2f %14.2f %14.2f' % (sessions, nested, by_mac, by_user, port, add_rm))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,110 @@
+"""Benchmark of the work queue under auth/deauth flapping: the number of work items
+the worker has to apply (each one a change to the faucet config), and the cost of put and get,
+for queue.Queue and CoalescingWorkQueue.
+
+Each of the macs flaps (auth, deauth, ...) 'flaps' times before the worker drains the queue.
+
+Also shows how many items are served before a deauthentication that is queued behind
+a backlog of 'macs' logins (each of which costs a faucet reload when not batched).
+
+And, in simulated time, the time logins wait in the queue when they arrive at twice the rate
+the worker can serve them, for an unbounded queue and for one of max_size 100 with each overload policy
+(as 'block' would stall the simulation, non blocking puts are used, so it acts like 'reject').
+
+Usage: python3 bench_work_queue.py [macs] [flaps]
+"""
+import queue
+import sys
+import time
+
+from gasket.work_item import AuthWorkItem, DeauthWorkItem
+from gasket.work_queue import CoalescingWorkQueue, OVERLOAD_POLICIES
+
+from bench_rule_manager import mac
+
+
+def bench(work_queue, macs, flaps):
+    """Returns:
+        tuple of (items got, put seconds per item, get seconds per item).
+    """
+    items = []
+    for i in range(flaps):
+        for n in range(macs):
+            items.append(AuthWorkItem(mac(n), 'user%d' % n, ['allowall'], 'hostapd'))
+        # the last flap ends authenticated.
+        if i < flaps - 1:
+            for n in range(macs):
+                items.append(DeauthWorkItem(mac(n), 'hostapd'))
+    start = time.perf_counter()
+    for item in items:
+        work_queue.put(item)
+    put_time = time.perf_counter() - start
+
+    got = 0
+    start = time.perf_counter()
+    try:
+        while True:
+            work_queue.get_nowait()
+            got += 1
+    except queue.Empty:
+        pass
+    get_time = time.perf_counter() - start
+    return got, put_time / len(items), get_time / max(got, 1)
+
+
+def deauth_position(work_queue, macs):
+    """Returns:
+        number of items got before the deauth queued behind macs auths.
+    """
+    for n in range(macs):
+        work_queue.put(AuthWorkItem(mac(n), 'user%d' % n, ['allowall'], 'hostapd'))
+    work_queue.put(DeauthWorkItem(mac(macs), 'hostapd'))
+    position = 0
+    while not isinstance(work_queue.get_nowait(), DeauthWorkItem):
+        position += 1
+    return position
+
+
+def overload(work_queue, logins, arrivals_per_service=2):
+    """Returns:
+        tuple of (served, p50, p99 wait in units of the time to serve one login).
+    """
+    waits = []
+    n = 0
+    for tick in range(logins // arrivals_per_service):
+        for _ in range(arrivals_per_service):
+            item = AuthWorkItem(mac(n), 'user%d' % n, ['allowall'], 'hostapd')
+            item.created = tick
+            n += 1
+            try:
+                work_queue.put(item, block=False)
+            except queue.Full:
+                pass
+        waits.append(tick - work_queue.get_nowait().created)
+    waits.sort()
+    return len(waits), waits[len(waits) // 2], waits[int(len(waits) * 0.99)]
+
+
+def main():
+    macs = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    flaps = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+    print('%d macs, %d flaps each' % (macs, flaps))
+    print('%20s %10s %12s %12s' % ('queue', 'items got', 'put (us)', 'get (us)'))
+    for name, work_queue in (('queue.Queue', queue.Queue()),
+                             ('CoalescingWorkQueue', CoalescingWorkQueue())):
+        got, put_time, get_time = bench(work_queue, macs, flaps)
+        print('%20s %10d %12.2f %12.2f' % (name, got, put_time * 1e6, get_time * 1e6))
+    for name, work_queue in (('queue.Queue', queue.Queue()),
+                             ('CoalescingWorkQueue', CoalescingWorkQueue())):
+        print('%20s: deauth behind %d logins served after %d items' %
+              (name, macs, deauth_position(work_queue, macs)))
+    print('%d logins arriving at twice the service rate' % (macs * flaps))
+    print('%30s %10s %10s %10s' % ('queue', 'served', 'p50 wait', 'p99 wait'))
+    for name, work_queue in [('unbounded', CoalescingWorkQueue())] + [
+            ('max_size 100 %s' % policy, CoalescingWorkQueue(max_size=100, overload_policy=policy))
+            for policy in OVERLOAD_POLICIES]:
+        print('%30s %10d %10d %10d' % ((name,) + overload(work_queue, macs * flaps)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,126 @@
+"""Helpers for the Gasket unit tests (that do not need mininet or a running faucet)."""
+
+import logging
+import os
+import shutil
+import time
+
+from gasket.auth_config import AuthConfig
+from gasket.reload_notifier import ReloadNotifier
+from gasket.rule_manager import RuleManager, create_faucet_acls, write_yaml
+
+PORTS = 4
+
+AUTH_YAML = '''---
+version: 0
+logger_location: {tmpdir}/auth_app.log
+faucet:
+    prometheus_port: 9302
+    ip: 127.0.0.1
+files:
+    controller_pid: {tmpdir}/contr_pid
+    faucet_config: {tmpdir}/faucet.yaml
+    acl_config: {tmpdir}/faucet-acls.yaml
+    base_config: {tmpdir}/base-acls.yaml
+auth-rules:
+    file: {tmpdir}/rules.yaml
+dps:
+    faucet-1:
+        interfaces:
+{interfaces}
+hostapds: {{}}
+'''
+
+RULES_YAML = '''---
+acls:
+    allowall:
+        _authport_:
+            - rule:
+                _name_: _user-name_
+                _mac_: _user-mac_
+                dl_src: _user-mac_
+                dl_type: 0x0800
+                actions:
+                    allow: 1
+'''
+
+
+def make_config(tmpdir, ports=PORTS):
+    """Creates the config files for a single datapath with 'ports' access ports in tmpdir.
+    Returns:
+        AuthConfig
+    """
+    interfaces = ''.join('            %d:\n                auth_mode: access\n' % p
+                         for p in range(1, ports + 1))
+    with open(os.path.join(tmpdir, 'auth.yaml'), 'w') as f:
+        f.write(AUTH_YAML.format(tmpdir=tmpdir, interfaces=interfaces))
+    with open(os.path.join(tmpdir, 'rules.yaml'), 'w') as f:
+        f.write(RULES_YAML)
+
+    eapol = {'rule': {'dl_type': 0x888e, 'actions': {'allow': 1}}}
+    base = {'acls': {}}
+    faucet = {'dps': {'faucet-1': {'dp_id': 1, 'interfaces': {}}}}
+    for port in range(1, ports + 1):
+        acl_name = 'port_faucet-1_%d' % port
+        base['acls'][acl_name] = [eapol, 'authed-rules']
+        faucet['dps']['faucet-1']['interfaces'][port] = {'native_vlan': 100, 'acl_in': acl_name}
+    base_filename = os.path.join(tmpdir, 'base-acls.yaml')
+    write_yaml(base, base_filename, True)
+    shutil.copy2(base_filename, base_filename + '-orig')
+    write_yaml(faucet, os.path.join(tmpdir, 'faucet.yaml'), True)
+    write_yaml(create_faucet_acls(base, logging), os.path.join(tmpdir, 'faucet-acls.yaml'), True)
+    return AuthConfig(os.path.join(tmpdir, 'auth.yaml'))
+
+
+def make_logger():
+    logger = logging.getLogger('gasket_unit_test')
+    logger.addHandler(logging.NullHandler())
+    logger.propagate = False
+    return logger
+
+
+class FakeReloadNotifier(ReloadNotifier):
+    """Stands in for faucet, which reloads as soon as it is signaled.
+    Each signal has the next of reload_results (True if there are none):
+    True reloads, False reloads but fails to load the config (faucet_config_load_error),
+    and None does not reload (e.g. faucet is not running).
+    """
+
+    def __init__(self, logger):
+        super().__init__(logger, timeout=0)
+        self.reload_results = []
+        self.signals = 0
+        self.reloads = 0
+        self.load_error = False
+
+    def signal(self):
+        self.signals += 1
+        result = self.reload_results.pop(0) if self.reload_results else True
+        if result is not None:
+            self.reloads += 1
+            self.load_error = not result
+
+    def get_reload_state(self):
+        return self.reloads, self.load_error
+
+    def wait_for_reload(self, start_count):
+        self.last_load_error = False
+        count, load_error = self.get_reload_state()
+        if count > start_count:
+            return self._reloaded(time.time(), load_error)
+        return False
+
+
+class FakeFaucetRuleManager(RuleManager):
+    """RuleManager that signals a FakeReloadNotifier rather than faucet."""
+
+    def __init__(self, config, logger, metrics=None):
+        super().__init__(config, logger, metrics, reload_notifier=FakeReloadNotifier(logger))
+
+    def send_signal(self, signal_type):
+        self.reload_notifier.signal()
+
+
+def mac(i):
+    """Returns a unique MAC address string for i."""
+    return '02:00:00:00:%02x:%02x' % (i >> 8 & 0xff, i & 0xff)
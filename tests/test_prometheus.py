@@ -0,0 +1,141 @@
+"""Unit tests for parsing and scraping faucet's prometheus metrics."""
+
+import http.server
+import socketserver
+import threading
+import unittest
+
+from gasket.auth_app_utils import PrometheusClient, parse_prometheus
+
+PROM_TEXT = '''# HELP faucet_config_reload_requests_total number of config reload requests
+# TYPE faucet_config_reload_requests_total counter
+faucet_config_reload_requests_total 12.0
+faucet_config_reload_requests_created 1.5e+09
+# HELP faucet_config_load_error 1 if last attempt to re/load config failed
+# TYPE faucet_config_load_error gauge
+faucet_config_load_error 0.0
+faucet_config_dp_name{dp_id="0x1",dp_name="faucet-1"} 1.0
+learned_macs{dp_id="0x1",dp_name="faucet-1",n="0",port="1",vlan="100"} 2199023255553.0
+learned_macs{dp_id="0x1",dp_name="faucet-1",n="1",port="2",vlan="100"} 2199023255554.0
+'''
+
+
+class TrackingLines(object):
+    """Iterates lines, counting how many have been read."""
+
+    def __init__(self, text):
+        self.lines = text.splitlines()
+        self.read = 0
+
+    def __iter__(self):
+        for line in self.lines:
+            self.read += 1
+            yield line
+
+
+class ParsePrometheusTest(unittest.TestCase):
+
+    def test_all_families(self):
+        samples = list(parse_prometheus(PROM_TEXT.splitlines()))
+        self.assertEqual(len(samples), 6)
+        self.assertEqual(samples[0], ('faucet_config_reload_requests_total',
+                                      'faucet_config_reload_requests_total', {}, 12.0))
+        family, name, labels, value = samples[4]
+        self.assertEqual((family, name), ('learned_macs', 'learned_macs'))
+        self.assertEqual(labels, {'dp_id': '0x1', 'dp_name': 'faucet-1', 'n': '0', 'port': '1',
+                                  'vlan': '100'})
+        self.assertEqual(value, 0x020000000001)
+
+    def test_suffixes(self):
+        """Samples with the _total and _created suffixes belong to the family without them."""
+        samples = list(parse_prometheus(PROM_TEXT.splitlines(), ['faucet_config_reload_requests']))
+        self.assertEqual([(family, name, value) for family, name, _, value in samples],
+                         [('faucet_config_reload_requests', 'faucet_config_reload_requests_total', 12.0),
+                          ('faucet_config_reload_requests', 'faucet_config_reload_requests_created', 1.5e9)])
+
+    def test_stops_after_last_family(self):
+        """Lines after the last wanted family are not read."""
+        lines = TrackingLines(PROM_TEXT)
+        samples = list(parse_prometheus(lines, ['faucet_config_reload_requests', 'faucet_config_load_error']))
+        self.assertEqual([name for _, name, _, _ in samples],
+                         ['faucet_config_reload_requests_total', 'faucet_config_reload_requests_created',
+                          'faucet_config_load_error'])
+        # stopped on the first line after faucet_config_load_error.
+        self.assertEqual(lines.read, PROM_TEXT.splitlines().index(
+            'faucet_config_dp_name{dp_id="0x1",dp_name="faucet-1"} 1.0') + 1)
+
+    def test_escaped_label_values(self):
+        line = r'faucet_config_dp_name{dp_id="0x1",dp_name="a \"quoted\", \\ back\\slashed\nname"} 1.0'
+        samples = list(parse_prometheus([line]))
+        self.assertEqual(samples[0][2], {'dp_id': '0x1', 'dp_name': 'a "quoted", \\ back\\slashed\nname'})
+
+    def test_labels_with_spaces_and_braces(self):
+        line = 'faucet_config_dp_name{dp_id="0x1",dp_name="a {b} c"} 3.0 1500000000'
+        self.assertEqual(list(parse_prometheus([line])),
+                         [('faucet_config_dp_name', 'faucet_config_dp_name',
+                           {'dp_id': '0x1', 'dp_name': 'a {b} c'}, 3.0)])
+
+
+class StubExporter(object):
+    """HTTP/1.1 (keep-alive) server that returns body, and counts the connections made to it."""
+
+    def __init__(self, body):
+        self.connections = 0
+        exporter = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def setup(self):
+                exporter.connections += 1
+                super().setup()
+
+            def do_GET(self):
+                self.send_response(200)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        class Server(socketserver.ThreadingMixIn, http.server.HTTPServer):
+            daemon_threads = True
+
+        self.server = Server(('127.0.0.1', 0), Handler)
+        self.url = 'http://127.0.0.1:%d' % self.server.server_port
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class PrometheusClientTest(unittest.TestCase):
+
+    def setUp(self):
+        # enough learned_macs that the body is not read in one go.
+        body = PROM_TEXT + ''.join('learned_macs{dp_id="0x1",dp_name="faucet-1",n="%d",port="3",vlan="100"} %d.0\n'
+                                   % (i, i) for i in range(2, 5000))
+        self.exporter = StubExporter(body.encode())
+        self.client = PrometheusClient(self.exporter.url)
+
+    def tearDown(self):
+        self.client.close()
+        self.exporter.stop()
+
+    def test_full_scrapes_reuse_connection(self):
+        for _ in range(5):
+            self.assertEqual(len(list(self.client.samples())), 5004)
+        self.assertEqual(self.exporter.connections, 1)
+
+    def test_filtered_scrapes_reuse_connection(self):
+        """Scrapes that stop parsing early still leave the connection to be reused."""
+        for _ in range(5):
+            samples = list(self.client.samples(['faucet_config_reload_requests', 'faucet_config_load_error']))
+            self.assertEqual(len(samples), 3)
+        self.assertEqual(self.exporter.connections, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
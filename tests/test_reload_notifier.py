@@ -0,0 +1,130 @@
+"""Unit tests for the ReloadNotifiers, and how RuleManager.commit() acts on what they report."""
+
+import itertools
+import shutil
+import tempfile
+import unittest
+
+from gasket.reload_notifier import PollingReloadNotifier, ReloadNotifier
+
+from gasket_unit_test_util import FakeFaucetRuleManager, make_config, make_logger, mac
+
+
+class FakePromClient(object):
+    """Faucet's prometheus, which reports a reload after 'polls' more scrapes."""
+
+    def __init__(self):
+        self.reloads = 0
+        self.load_error = False
+        self.polls = None
+        self.scrapes = 0
+
+    def reload_after(self, polls, load_error=False):
+        self.polls = polls
+        self.load_error = load_error
+
+    def samples(self, families=None):
+        self.scrapes += 1
+        if self.polls is not None:
+            self.polls -= 1
+            if self.polls <= 0:
+                self.reloads += 1
+                self.polls = None
+        yield ('faucet_config_reload_requests', 'faucet_config_reload_requests_total', {}, float(self.reloads))
+        yield ('faucet_config_load_error', 'faucet_config_load_error', {}, float(self.load_error))
+
+
+class PollingReloadNotifierTest(unittest.TestCase):
+
+    def setUp(self):
+        self.prom_client = FakePromClient()
+        self.notifier = PollingReloadNotifier(self.prom_client, make_logger(), timeout=5,
+                                              min_interval=0.001, max_interval=0.008)
+
+    def _intervals(self, n):
+        return list(itertools.islice(self.notifier.poll_intervals(), n))
+
+    def test_is_reload_notifier(self):
+        self.assertIsInstance(self.notifier, ReloadNotifier)
+        with self.assertRaises(TypeError):
+            ReloadNotifier(make_logger())
+
+    def test_poll_intervals_back_off(self):
+        """With no reloads seen yet, polls start at min_interval and double up to max_interval."""
+        self.assertEqual(self._intervals(6), [0.001, 0.002, 0.004, 0.008, 0.008, 0.008])
+
+    def test_poll_intervals_from_expected_latency(self):
+        """The first poll is made shortly before a reload is expected, then backs off as before."""
+        self.notifier.expected_latency = 0.125
+        self.assertEqual(self._intervals(5), [0.1, 0.001, 0.002, 0.004, 0.008])
+        # but never sooner than min_interval.
+        self.notifier.expected_latency = 0.0001
+        self.assertEqual(self._intervals(2), [0.001, 0.001])
+
+    def test_expected_latency_ewma(self):
+        """The first reload sets the expected latency, later ones are averaged in."""
+        start = self.prom_client.reloads
+        self.prom_client.reload_after(1)
+        self.assertTrue(self.notifier.wait_for_reload(start))
+        first = self.notifier.last_reload_latency
+        self.assertEqual(self.notifier.expected_latency, first)
+
+        start = self.prom_client.reloads
+        self.prom_client.reload_after(4)
+        self.assertTrue(self.notifier.wait_for_reload(start))
+        second = self.notifier.last_reload_latency
+        self.assertGreater(second, first)
+        self.assertAlmostEqual(self.notifier.expected_latency, 0.7 * first + 0.3 * second)
+
+    def test_load_error(self):
+        """A reload that fails to load the config returns False, with last_load_error set."""
+        self.prom_client.reload_after(2, load_error=True)
+        self.assertFalse(self.notifier.wait_for_reload(0))
+        self.assertTrue(self.notifier.last_load_error)
+
+        # the next reload loads without error.
+        self.prom_client.reload_after(1)
+        self.assertTrue(self.notifier.wait_for_reload(1))
+        self.assertFalse(self.notifier.last_load_error)
+
+    def test_timeout(self):
+        """No reload within the timeout returns False, without last_load_error."""
+        self.notifier.timeout = 0.05
+        self.notifier.last_load_error = True
+        self.assertFalse(self.notifier.wait_for_reload(0))
+        self.assertFalse(self.notifier.last_load_error)
+        self.assertIsNone(self.notifier.last_reload_latency)
+        self.assertGreater(self.prom_client.scrapes, 1)
+
+
+class CommitReloadResultTest(unittest.TestCase):
+    """commit() rolls back a config faucet rejected, but keeps one it did not reload."""
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.rule_man = FakeFaucetRuleManager(make_config(self.tmpdir), make_logger())
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_load_error_rolls_back(self):
+        self.rule_man.reload_notifier.reload_results = [False, True]
+        self.assertFalse(self.rule_man.authenticate('user1', mac(1), 'faucet-1', 1, ['allowall']))
+        self.assertTrue(self.rule_man.rolled_back)
+        self.assertEqual(self.rule_man.generation, 0)
+        self.assertFalse(self.rule_man.sessions.is_authenticated(mac(1)))
+        # signaled once for the rejected config, and once for the rollback.
+        self.assertEqual(self.rule_man.reload_notifier.signals, 2)
+
+    def test_no_reload_keeps_generation(self):
+        self.rule_man.reload_notifier.reload_results = [None]
+        self.assertFalse(self.rule_man.authenticate('user1', mac(1), 'faucet-1', 1, ['allowall']))
+        self.assertFalse(self.rule_man.reload_notifier.last_load_error)
+        self.assertFalse(self.rule_man.rolled_back)
+        self.assertEqual(self.rule_man.generation, 1)
+        self.assertTrue(self.rule_man.sessions.is_authenticated(mac(1), 'user1'))
+        self.assertEqual(self.rule_man.reload_notifier.signals, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
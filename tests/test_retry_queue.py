@@ -0,0 +1,82 @@
+"""Unit tests for the RetryQueue of authentications whose MAC has not been learned."""
+
+import os
+import time
+import unittest
+
+from gasket.retry_queue import RetryQueue
+from gasket.work_item import AuthWorkItem
+from gasket.work_queue import CoalescingWorkQueue
+
+from gasket_unit_test_util import mac
+
+
+class RetryQueueTest(unittest.TestCase):
+
+    def setUp(self):
+        self.work_queue = CoalescingWorkQueue()
+        self.retry_queue = RetryQueue(self.work_queue, os.devnull,
+                                      initial_delay=0.5, max_delay=8, deadline=60)
+
+    def tearDown(self):
+        self.retry_queue.kill()
+
+    def _item(self, i, age=0):
+        item = AuthWorkItem(mac(i), 'user', ['allowall'], 'hostapd')
+        item.created -= age
+        item.queued = item.created
+        return item
+
+    def _due(self):
+        return self.retry_queue.heap[0][0]
+
+    def test_deadline_expiry(self):
+        """An item past its deadline is given up on, and forgotten."""
+        item = self._item(1)
+        self.assertTrue(self.retry_queue.schedule(item))
+        self.assertTrue(self.retry_queue.current(item))
+        item.created -= 60
+        self.assertFalse(self.retry_queue.schedule(item))
+        self.assertFalse(self.retry_queue.current(item))
+        self.assertEqual(self.retry_queue.pending, {})
+
+    def test_last_retry_at_deadline(self):
+        """The backoff is capped at max_delay, and the last retry is at the deadline."""
+        item = self._item(1, age=10)
+        item.attempts = 10
+        self.retry_queue.schedule(item)
+        self.assertLessEqual(self._due(), time.time() + 8)
+
+        item = self._item(2, age=59.9)
+        self.retry_queue.schedule(item)
+        # due before the first item.
+        self.assertAlmostEqual(self._due(), item.created + 60, places=3)
+
+    def test_cancel(self):
+        item = self._item(1)
+        self.retry_queue.schedule(item)
+        self.retry_queue.cancel(item.mac)
+        self.assertFalse(self.retry_queue.current(item))
+
+    def test_retry_requeues(self):
+        """A due item is put back on the work queue, stamped with when it was requeued."""
+        retry_queue = RetryQueue(self.work_queue, os.devnull,
+                                 initial_delay=0.01, max_delay=0.01, deadline=60)
+        retry_queue.start()
+        try:
+            item = self._item(1, age=5)
+            cancelled = self._item(2, age=5)
+            retry_queue.schedule(cancelled)
+            retry_queue.schedule(item)
+            retry_queue.cancel(cancelled.mac)
+            self.assertIs(self.work_queue.get(timeout=5), item)
+            self.assertEqual(item.attempts, 1)
+            self.assertGreater(item.queued, item.created + 4)
+            self.assertTrue(retry_queue.current(item))
+            self.assertTrue(self.work_queue.empty())
+        finally:
+            retry_queue.kill()
+
+
+if __name__ == '__main__':
+    unittest.main()
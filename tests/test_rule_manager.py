@@ -0,0 +1,115 @@
+"""Unit tests for RuleManager's commit and rollback of config generations."""
+
+import copy
+import shutil
+import tempfile
+import unittest
+
+from gasket.auth_app_metrics import AuthAppMetrics
+
+from gasket_unit_test_util import FakeFaucetRuleManager, make_config, make_logger, mac
+
+
+class RuleManagerRollbackTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.config = make_config(self.tmpdir)
+        self.rule_man = FakeFaucetRuleManager(self.config, make_logger())
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def _read(self, filename):
+        with open(filename) as f:
+            return f.read()
+
+    def test_rejected_config_is_rolled_back(self):
+        """A config faucet rejects is undone: the acl file, base and sessions are as they were."""
+        self.assertTrue(self.rule_man.authenticate('user1', mac(1), 'faucet-1', 1, ['allowall']))
+        self.assertEqual(self.rule_man.generation, 1)
+        acls = self._read(self.config.acl_config_file)
+        base = copy.deepcopy(self.rule_man.base)
+
+        self.rule_man.reload_notifier.reload_results = [False, True]
+        self.assertFalse(self.rule_man.authenticate('user2', mac(2), 'faucet-1', 2, ['allowall']))
+
+        self.assertTrue(self.rule_man.rolled_back)
+        self.assertEqual(self.rule_man.generation, 1)
+        self.assertEqual(self._read(self.config.acl_config_file), acls)
+        self.assertEqual(self.rule_man.base, base)
+        self.assertTrue(self.rule_man.sessions.is_authenticated(mac(1), 'user1'))
+        self.assertFalse(self.rule_man.sessions.is_authenticated(mac(2)))
+        self.assertEqual(len(self.rule_man.sessions), 1)
+        self.assertEqual(self._read(self.config.acl_config_file + '.rejected').count(mac(2)), 1)
+
+    def test_rolled_back_is_reset_by_next_commit(self):
+        """A later commit with nothing to do is not reported as rolled back."""
+        self.rule_man.reload_notifier.reload_results = [False, True]
+        self.assertFalse(self.rule_man.authenticate('user1', mac(1), 'faucet-1', 1, ['allowall']))
+        self.assertTrue(self.rule_man.rolled_back)
+
+        # deauthenticating a mac that was never authenticated changes nothing.
+        self.rule_man.deauthenticate(None, mac(2), commit=False)
+        self.assertTrue(self.rule_man.commit())
+        self.assertFalse(self.rule_man.rolled_back)
+
+
+class RuleManagerSkipUnchangedTest(unittest.TestCase):
+    """Commits that leave the faucet acls as they were do not signal faucet."""
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.config = make_config(self.tmpdir)
+        self.metrics = AuthAppMetrics()
+        self.rule_man = FakeFaucetRuleManager(self.config, make_logger(), self.metrics)
+        self.notifier = self.rule_man.reload_notifier
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def _skipped(self):
+        return self.metrics.registry.get_sample_value('gasket_commits_skipped_total') or 0
+
+    def test_deauth_unknown_mac(self):
+        self.rule_man.deauthenticate(None, mac(1), commit=False)
+        self.assertTrue(self.rule_man.commit())
+        self.assertEqual(self.notifier.signals, 0)
+        self.assertEqual(self._skipped(), 1)
+        self.assertEqual(self.rule_man.generation, 0)
+
+    def test_auth_then_deauth(self):
+        """An authentication and deauthentication in one commit net to the same acls."""
+        self.assertTrue(self.rule_man.authenticate('user1', mac(1), 'faucet-1', 1, ['allowall']))
+        self.assertEqual(self.notifier.signals, 1)
+
+        self.rule_man.authenticate('user2', mac(2), 'faucet-1', 2, ['allowall'], commit=False)
+        self.rule_man.deauthenticate('user2', mac(2), commit=False)
+        self.assertTrue(self.rule_man.base_changed)
+        self.assertTrue(self.rule_man.commit())
+        self.assertEqual(self.notifier.signals, 1)
+        self.assertEqual(self._skipped(), 1)
+        self.assertEqual(self.rule_man.generation, 1)
+        self.assertTrue(self.rule_man.sessions.is_authenticated(mac(1), 'user1'))
+        self.assertFalse(self.rule_man.sessions.is_authenticated(mac(2)))
+
+    def test_recommit_after_rollback(self):
+        """The rolled back acls are written again if the same change is retried,
+        rather than taken to be unchanged since the rejected write.
+        """
+        self.notifier.reload_results = [False, True]
+        self.assertFalse(self.rule_man.authenticate('user1', mac(1), 'faucet-1', 1, ['allowall']))
+        self.assertEqual(self.notifier.signals, 2)
+        with open(self.config.acl_config_file + '.rejected') as f:
+            rejected = f.read()
+
+        self.assertTrue(self.rule_man.authenticate('user1', mac(1), 'faucet-1', 1, ['allowall']))
+        self.assertEqual(self.notifier.signals, 3)
+        self.assertEqual(self._skipped(), 0)
+        self.assertEqual(self.rule_man.generation, 1)
+        with open(self.config.acl_config_file) as f:
+            self.assertEqual(f.read(), rejected)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,53 @@
+"""Unit tests for restoring the sessions from the session journal after a restart."""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from gasket_unit_test_util import FakeFaucetRuleManager, make_config, make_logger, mac
+
+
+class SessionJournalReplayTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.config = make_config(self.tmpdir)
+        self.config.journal_file = os.path.join(self.tmpdir, 'sessions.journal')
+        self.logger = make_logger()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_replay_after_restart(self):
+        """The sessions (and their rules) committed before a restart are restored from the journal."""
+        rule_man = FakeFaucetRuleManager(self.config, self.logger)
+        rule_man.authenticate('user1', mac(1), 'faucet-1', 1, ['allowall'], commit=False)
+        rule_man.authenticate('user2', mac(2), 'faucet-1', 2, ['allowall'], commit=False)
+        rule_man.authenticate('user3', mac(3), 'faucet-1', 3, ['allowall'], commit=False)
+        rule_man.deauthenticate('user2', mac(2), commit=False)
+        self.assertTrue(rule_man.commit())
+        base = rule_man.base
+        rule_man.journal.close()
+
+        restarted = FakeFaucetRuleManager(self.config, self.logger)
+        self.assertEqual(sorted((s.username, s.mac, s.dp_name, s.port) for s in restarted.sessions),
+                         [('user1', mac(1), 'faucet-1', 1), ('user3', mac(3), 'faucet-1', 3)])
+        self.assertEqual(restarted.base, base)
+        # nothing has changed since the faucet acls were last written.
+        self.assertFalse(restarted.base_changed)
+
+    def test_rolled_back_session_is_not_replayed(self):
+        """A session whose config faucet rejected is not restored."""
+        rule_man = FakeFaucetRuleManager(self.config, self.logger)
+        rule_man.authenticate('user1', mac(1), 'faucet-1', 1, ['allowall'])
+        rule_man.reload_notifier.reload_results = [False, True]
+        rule_man.authenticate('user2', mac(2), 'faucet-1', 2, ['allowall'])
+        rule_man.journal.close()
+
+        restarted = FakeFaucetRuleManager(self.config, self.logger)
+        self.assertEqual([s.mac for s in restarted.sessions], [mac(1)])
+
+
+if __name__ == '__main__':
+    unittest.main()
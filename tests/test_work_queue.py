@@ -0,0 +1,137 @@
+"""Unit tests for the CoalescingWorkQueue."""
+
+import queue
+import unittest
+
+from gasket.work_item import AuthWorkItem, DeauthWorkItem, PortDownWorkItem
+from gasket.work_queue import CoalescingWorkQueue, BLOCK, DROP_OLDEST, REJECT
+
+from gasket_unit_test_util import mac
+
+
+def auth(i, username='user'):
+    return AuthWorkItem(mac(i), username, ['allowall'], 'hostapd')
+
+
+def deauth(i):
+    return DeauthWorkItem(mac(i), 'hostapd')
+
+
+def drain(work_queue):
+    items = []
+    while True:
+        try:
+            items.append(work_queue.get_nowait())
+        except queue.Empty:
+            return items
+
+
+class CoalescingTest(unittest.TestCase):
+
+    def test_auth_deauth_auth(self):
+        """The deauth drops the first auth, and is got before the second."""
+        work_queue = CoalescingWorkQueue()
+        first = auth(1, 'first')
+        revoke = deauth(1)
+        second = auth(1, 'second')
+        for item in (first, revoke, second):
+            work_queue.put(item)
+        self.assertEqual(work_queue.qsize(), 2)
+        self.assertEqual(drain(work_queue), [revoke, second])
+        self.assertEqual(work_queue.superseded, 1)
+
+    def test_auth_replaced_in_place(self):
+        """A newer auth for a MAC replaces the pending one, keeping its place."""
+        work_queue = CoalescingWorkQueue()
+        first = auth(1, 'first')
+        other = auth(2)
+        second = auth(1, 'second')
+        for item in (first, other, second):
+            work_queue.put(item)
+        self.assertEqual(drain(work_queue), [second, other])
+
+
+class PriorityLanesTest(unittest.TestCase):
+
+    def test_weighted_round_robin(self):
+        """Up to revoke_weight revocations, then up to grant_weight grants, and so on."""
+        work_queue = CoalescingWorkQueue(revoke_weight=2, grant_weight=1)
+        grants = [auth(i) for i in range(4)]
+        revokes = [deauth(i) for i in range(10, 14)]
+        for item in grants + revokes:
+            work_queue.put(item)
+        self.assertEqual(drain(work_queue), [revokes[0], revokes[1], grants[0],
+                                             revokes[2], revokes[3], grants[1],
+                                             grants[2], grants[3]])
+
+    def test_grants_not_starved(self):
+        """Grants are served while revocations keep arriving."""
+        work_queue = CoalescingWorkQueue(revoke_weight=4, grant_weight=1)
+        grant = auth(1)
+        work_queue.put(grant)
+        got = []
+        for i in range(10, 20):
+            work_queue.put(deauth(i))
+            got.append(work_queue.get_nowait())
+        self.assertIn(grant, got)
+
+    def test_port_downs_are_revocations(self):
+        """Port downs are served ahead of grants, and coalesced by port."""
+        work_queue = CoalescingWorkQueue()
+        grant = auth(1)
+        first = PortDownWorkItem('faucet-1', 1)
+        other = PortDownWorkItem('faucet-1', 2)
+        second = PortDownWorkItem('faucet-1', 1)
+        for item in (grant, first, other, second):
+            work_queue.put(item)
+        self.assertEqual(drain(work_queue), [second, other, grant])
+
+
+class OverloadTest(unittest.TestCase):
+
+    def _full_queue(self, overload_policy):
+        work_queue = CoalescingWorkQueue(max_size=2, overload_policy=overload_policy)
+        self.grants = [auth(1), auth(2)]
+        for item in self.grants:
+            work_queue.put(item)
+        return work_queue
+
+    def test_drop_oldest(self):
+        work_queue = self._full_queue(DROP_OLDEST)
+        newest = auth(3)
+        work_queue.put(newest)
+        self.assertEqual(work_queue.shed, 1)
+        self.assertEqual(drain(work_queue), [self.grants[1], newest])
+
+    def test_reject(self):
+        work_queue = self._full_queue(REJECT)
+        self.assertRaises(queue.Full, work_queue.put, auth(3))
+        self.assertEqual(work_queue.shed, 1)
+        self.assertEqual(drain(work_queue), self.grants)
+
+    def test_block_times_out(self):
+        work_queue = self._full_queue(BLOCK)
+        self.assertRaises(queue.Full, work_queue.put, auth(3), True, 0.01)
+        self.assertRaises(queue.Full, work_queue.put_nowait, auth(3))
+        self.assertEqual(drain(work_queue), self.grants)
+
+    def test_revocations_bypass_limit(self):
+        work_queue = self._full_queue(REJECT)
+        revoke = deauth(3)
+        port_down = PortDownWorkItem('faucet-1', 1)
+        work_queue.put(revoke)
+        work_queue.put(port_down)
+        self.assertEqual(work_queue.qsize(), 4)
+        self.assertEqual(work_queue.shed, 0)
+        self.assertEqual(drain(work_queue), [revoke, port_down] + self.grants)
+
+    def test_replace_when_full(self):
+        """Replacing a queued grant does not grow the queue, so is allowed when it is full."""
+        work_queue = self._full_queue(REJECT)
+        replacement = auth(1, 'replacement')
+        work_queue.put(replacement)
+        self.assertEqual(drain(work_queue), [replacement, self.grants[1]])
+
+
+if __name__ == '__main__':
+    unittest.main()